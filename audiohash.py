@@ -0,0 +1,55 @@
+import os
+import hashlib
+
+import formats
+
+
+# Bytes read at a time while hashing; memory use doesn't grow with the file
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+def _payload_handler(file_path, handler=None):
+    handler = handler or formats.handler_for_extension(file_path)
+    if handler is None or handler.payload is None:
+        handler = formats.sniff_handler(file_path)
+    if handler is None or handler.payload is None:
+        raise ValueError(f"Can't locate the audio data of {file_path}")
+    return handler
+
+
+def payload_ranges(fileobj, handler):
+    """Return the (offset, length) ranges of audio data in an open file."""
+    size = os.fstat(fileobj.fileno()).st_size
+    try:
+        return handler.payload(fileobj, size)
+    finally:
+        fileobj.seek(0)
+
+
+def payload_size(file_path, handler=None):
+    """Number of bytes of audio data in a file, tags not counted.
+
+    Mostly headers are read, though an Ogg file's pages are all walked.
+    Files of a size no other file shares are never hashed.
+    """
+    handler = _payload_handler(file_path, handler)
+    with open(file_path, "rb") as f:
+        return sum(length for _offset, length in payload_ranges(f, handler))
+
+
+def hash_payload(file_path, handler=None):
+    """SHA-1 of a file's audio data, which stays the same when it's retagged."""
+    handler = _payload_handler(file_path, handler)
+    digest = hashlib.sha1()
+    buffer = bytearray(HASH_CHUNK_SIZE)
+    view = memoryview(buffer)
+    with open(file_path, "rb") as f:
+        for offset, length in payload_ranges(f, handler):
+            f.seek(offset)
+            while length > 0:
+                read = f.readinto(view[:min(length, HASH_CHUNK_SIZE)])
+                if not read:
+                    break
+                digest.update(view[:read])
+                length -= read
+    return digest.hexdigest()
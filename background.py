@@ -0,0 +1,118 @@
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+
+class Task:
+    """A piece of work handed to a BackgroundRunner.
+
+    Work functions get the task as their first argument and should check
+    ``task.cancelled`` between steps, and may call ``task.report(...)`` to
+    send progress back to the Tk thread.
+    """
+
+    def __init__(self, key=None):
+        self.key = key
+        self.future = None
+        self._cancel_event = threading.Event()
+        self._report = None
+
+    @property
+    def cancelled(self):
+        return self._cancel_event.is_set()
+
+    def cancel(self):
+        self._cancel_event.set()
+        if self.future is not None:
+            self.future.cancel()
+
+    def report(self, *args):
+        if self._report:
+            self._report(*args)
+
+
+class BackgroundRunner:
+    """Runs blocking work on worker threads and hands results back to Tk.
+
+    Tk widgets may only be touched from the main loop, so workers never call
+    the callbacks themselves: they queue them, and the queue is drained
+    from ``root.after`` while any task is outstanding.
+    """
+
+    def __init__(self, root, max_workers=2, poll_interval=25):
+        self.root = root
+        self.poll_interval = poll_interval
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="tag-io")
+        self._events = queue.Queue()
+        self._latest = {}
+        self._outstanding = 0
+        self._polling = False
+
+    def submit(self, func, *args, key=None, on_done=None, on_error=None, on_progress=None):
+        """Run ``func(task, *args)`` on a worker thread and return the Task.
+
+        ``on_done(result)``, ``on_error(exception)`` and ``on_progress(...)``
+        run on the Tk thread.  A task submitted with the same ``key`` as an
+        earlier one supersedes it: the earlier task is cancelled and its
+        callbacks are never called, so rapid file switches don't queue up
+        stale loads.
+        """
+        task = Task(key)
+        if key is not None:
+            previous = self._latest.get(key)
+            if previous is not None:
+                previous.cancel()
+            self._latest[key] = task
+        if on_progress:
+            task._report = lambda *progress: self._events.put((task, on_progress, progress, False))
+
+        def run():
+            try:
+                result = func(task, *args)
+            except Exception as e:
+                self._events.put((task, on_error, (e,), True))
+            else:
+                self._events.put((task, on_done, (result,), True))
+
+        def finished_unstarted(future):
+            # A task cancelled before it started never runs, still account for it
+            if future.cancelled():
+                self._events.put((task, None, (), True))
+
+        self._outstanding += 1
+        task.future = self.executor.submit(run)
+        task.future.add_done_callback(finished_unstarted)
+        self._schedule_poll()
+        return task
+
+    def _schedule_poll(self):
+        if not self._polling and self._outstanding:
+            self._polling = True
+            self.root.after(self.poll_interval, self._poll)
+
+    def _superseded(self, task):
+        return task.key is not None and self._latest.get(task.key) is not task
+
+    def _poll(self):
+        self._polling = False
+        while True:
+            try:
+                task, callback, args, finished = self._events.get_nowait()
+            except queue.Empty:
+                break
+            if finished:
+                self._outstanding -= 1
+            if callback is not None and not self._superseded(task):
+                try:
+                    callback(*args)
+                except Exception as e:
+                    print(f"Error in background task callback: {e}")
+            if finished and task.key is not None and self._latest.get(task.key) is task:
+                del self._latest[task.key]
+        self._schedule_poll()
+
+    def shutdown(self):
+        """Cancel superseding tasks (loads); anything else, like saves, still finishes."""
+        for task in list(self._latest.values()):
+            task.cancel()
+        self.executor.shutdown(wait=False)
@@ -0,0 +1,426 @@
+import os
+import sys
+import csv
+import json
+import time
+import hashlib
+import argparse
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+
+import tagcore
+import formats
+import covers
+import instrumentation
+
+
+DEFAULT_CHUNK_SIZE = 32
+
+# Distinct files whose jobs are merged before they're handed out
+COALESCE_WINDOW = 4096
+
+
+def iter_audio_files(root):
+    """Yield every audio file below root, depth first."""
+    stack = [root]
+    while stack:
+        directory = stack.pop()
+        try:
+            with os.scandir(directory) as entries:
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False):
+                        stack.append(entry.path)
+                    elif entry.is_file() and tagcore.is_audio_file(entry.name):
+                        yield entry.path
+        except OSError as e:
+            print(f"Error scanning {directory}: {e}", file=sys.stderr)
+
+
+def _normalize_fields(row):
+    fields = {}
+    for key, value in row.items():
+        field = tagcore.normalize_field_name(key) if key else None
+        if field is not None and value is not None:
+            fields[field] = str(value)
+    return fields
+
+
+def _job(path, fields, cover=None):
+    return {"path": path, "fields": fields, "cover": cover}
+
+
+def iter_directory_jobs(root, fields, cover=None):
+    for path in iter_audio_files(root):
+        yield _job(path, fields, cover)
+
+
+def iter_manifest_jobs(manifest_path):
+    """Yield jobs from a CSV, JSONL or Parquet manifest mapping paths to field values.
+
+    Relative paths are resolved against the manifest's directory.  Columns
+    that are not tag fields (other than "path" and "cover") are ignored.
+    """
+    base_dir = os.path.dirname(os.path.abspath(manifest_path))
+
+    def resolve(path):
+        return path if os.path.isabs(path) else os.path.join(base_dir, path)
+
+    if manifest_path.lower().endswith(".parquet"):
+        for row in iter_parquet_rows(manifest_path):
+            if not row.get("path"):
+                raise ValueError(f"{manifest_path}: row without a 'path'")
+            cover = row.get("cover")
+            yield _job(resolve(row["path"]), _normalize_fields(row), resolve(cover) if cover else None)
+    elif manifest_path.lower().endswith((".jsonl", ".ndjson", ".json")):
+        with open(manifest_path, encoding="utf-8") as f:
+            for line_no, line in enumerate(f, start=1):
+                line = line.strip()
+                if not line:
+                    continue
+                row = json.loads(line)
+                if "path" not in row:
+                    raise ValueError(f"{manifest_path}:{line_no}: missing 'path'")
+                fields = _normalize_fields(row.get("fields", row))
+                cover = row.get("cover")
+                yield _job(resolve(row["path"]), fields, resolve(cover) if cover else None)
+    else:
+        with open(manifest_path, newline="", encoding="utf-8") as f:
+            for row in csv.DictReader(f):
+                # Empty CSV cells mean "leave this field alone"
+                fields = _normalize_fields({k: v for k, v in row.items() if v != ""})
+                cover = row.get("cover")
+                yield _job(resolve(row["path"]), fields, resolve(cover) if cover else None)
+
+
+def iter_parquet_rows(path, batch_size=4096):
+    """Yield the rows of a Parquet file as dicts, one record batch in memory at a time."""
+    try:
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise ValueError("Reading Parquet files needs pyarrow (pip install pyarrow)") from None
+    for record_batch in pq.ParquetFile(path).iter_batches(batch_size=batch_size):
+        yield from record_batch.to_pylist()
+
+
+def apply_job(job, cover_options=None, handler=None):
+    """Apply one job in the current process and return its result dict.
+
+    ``cover_options`` are passed on to covers.load_cover (max_dimension,
+    quality) when the job embeds cover art, or re-encodes the embedded
+    art when the job has ``"normalize_cover": True``.  ``handler`` skips
+    looking up the format handler for the job's path.  A job with an
+    ``"expect"`` dict mapping fields to lists of values is only written
+    while each of those fields has one of its listed values.
+    """
+    start = time.perf_counter()
+    result = {"path": job["path"], "status": "ok", "error": None}
+    try:
+        if _is_write(job):
+            _save_job(_load_job(job, cover_options, handler), job, result)
+        else:
+            result["status"] = "read"
+            tags = tagcore.read_tags(job["path"], handler)
+            result["fields"] = tags["fields"]
+            result["format"] = tags["format"]
+    except Exception as e:
+        _set_error(result, e)
+    result["seconds"] = time.perf_counter() - start
+    return result
+
+
+def _is_write(job):
+    return bool(job["fields"] or job.get("cover") or job.get("normalize_cover"))
+
+
+def _set_error(result, error):
+    result["status"] = "error"
+    result["error"] = f"{type(error).__name__}: {error}"
+
+
+def _load_job(job, cover_options, handler):
+    """Parse the file a writing job edits and return (tag_file, fields, cover) for its save."""
+    cover = None
+    if job.get("cover"):
+        # Prepared once per worker, however many files get the same image
+        cover = covers.load_cover_cached(job["cover"], **(cover_options or {}))
+    if job.get("normalize_cover") and cover is None:
+        tag_file = tagcore.TagFile(job["path"], tagcore.COMPACT_PADDING_POLICY, handler)
+        if tag_file.cover is not None:
+            # Tracks of an album share their art, it's only re-encoded once
+            normalized = covers.prepare_cover_cached(tag_file.cover, **(cover_options or {}))
+            cover = normalized if len(normalized) < len(tag_file.cover) else None
+    else:
+        tag_file = tagcore.TagFile(job["path"], handler=handler)
+    expected = job.get("expect")
+    if expected and any(tag_file.fields.get(field, "") not in values for field, values in expected.items()):
+        raise tagcore.TagError("Changed since the values it should have were recorded")
+    if "expect_cover" in job:
+        # SHA-1 keys of the cover art it may have, None for none
+        key = hashlib.sha1(tag_file.cover).hexdigest() if tag_file.cover else None
+        if key not in job["expect_cover"]:
+            raise tagcore.TagError("Cover art changed since the one it should have was recorded")
+    # Fields merged in from other jobs for the file are written along with the re-encoded art
+    return tag_file, job["fields"], cover
+
+
+def _save_job(loaded, job, result):
+    tag_file, fields, cover = loaded
+    old_cover_size = len(tag_file.cover) if tag_file.cover else 0
+    if not tag_file.save(fields, cover):
+        result["status"] = "unchanged"
+        return
+    result["status"] = "written"
+    result["in_place"] = tag_file.last_save["in_place"]
+    result["bytes_written"] = tag_file.last_save["bytes_written"]
+    if job.get("normalize_cover") and cover is not None and not job.get("cover"):
+        result["cover_bytes_saved"] = old_cover_size - len(cover)
+
+
+def _apply_journaled(jobs, cover_options, handler, batch_dir):
+    """Apply a chunk of jobs, journaling the values they replace before any file is written.
+
+    Every file of the chunk is parsed first and its old values recorded;
+    the records are fsynced once for the whole chunk, then the files are
+    saved.
+    """
+    import journal
+    segment = journal.Segment(batch_dir)
+    results, pending = [], []
+    for job in jobs:
+        if not _is_write(job):
+            results.append(apply_job(job, cover_options, handler))
+            continue
+        start = time.perf_counter()
+        result = {"path": job["path"], "status": "unchanged", "error": None}
+        try:
+            loaded = _load_job(job, cover_options, handler)
+            if segment.record(*loaded):
+                pending.append((loaded, job, result))
+        except Exception as e:
+            _set_error(result, e)
+        result["seconds"] = time.perf_counter() - start
+        results.append(result)
+    segment.sync()
+    for loaded, job, result in pending:
+        start = time.perf_counter()
+        try:
+            _save_job(loaded, job, result)
+        except Exception as e:
+            _set_error(result, e)
+        result["seconds"] += time.perf_counter() - start
+    return results
+
+
+def _apply_chunk(handler_name, jobs, cover_options, journal_dir=None):
+    # Every job of a chunk has the same format, so the handler is looked up once
+    handler = formats.handler_named(handler_name)
+    if journal_dir:
+        results = _apply_journaled(jobs, cover_options, handler, journal_dir)
+    else:
+        results = [apply_job(job, cover_options, handler) for job in jobs]
+    # Stage timings recorded in this worker travel back with the results
+    return results, instrumentation.take_snapshot() if instrumentation.enabled() else None
+
+
+def coalesce_jobs(jobs, window=COALESCE_WINDOW):
+    """Merge jobs for the same file so it's saved once, with the later values winning.
+
+    Up to ``window`` distinct files are held back at a time; a file that
+    comes up again further apart than that is saved again.
+    """
+    pending = {}
+    for job in jobs:
+        merged = pending.get(job["path"])
+        if merged is None:
+            if len(pending) >= window:
+                yield from pending.values()
+                pending = {}
+            pending[job["path"]] = dict(job, fields=dict(job["fields"]))
+            continue
+        merged["fields"].update(job["fields"])
+        if job.get("cover"):
+            merged["cover"] = job["cover"]
+        if job.get("normalize_cover"):
+            merged["normalize_cover"] = True
+        if job.get("expect"):
+            merged.setdefault("expect", job["expect"])
+        if "expect_cover" in job:
+            merged.setdefault("expect_cover", job["expect_cover"])
+    yield from pending.values()
+
+
+def _chunks_by_handler(jobs, size):
+    """Group jobs into chunks that each hold a single format."""
+    buckets = {}
+    for job in jobs:
+        handler = formats.handler_for_extension(job["path"])
+        # Handlers hold functions, so workers get the name rather than the object
+        name = handler.name if handler else None
+        bucket = buckets.setdefault(name, [])
+        bucket.append(job)
+        if len(bucket) >= size:
+            yield name, buckets.pop(name)
+    for name, bucket in buckets.items():
+        yield name, bucket
+
+
+def make_executor(workers=None):
+    """Return the process pool run_batch uses, set up for instrumentation when it's on."""
+    pool_options = {}
+    if instrumentation.enabled():
+        pool_options = {"initializer": instrumentation.enable_worker, "initargs": (instrumentation.tracing(),)}
+    return ProcessPoolExecutor(max_workers=workers or os.cpu_count() or 1, **pool_options)
+
+
+def run_batch(jobs, workers=None, chunk_size=DEFAULT_CHUNK_SIZE, on_result=None, cover_options=None,
+              executor=None, journal=None):
+    """Apply jobs across a process pool and return a summary dict.
+
+    Jobs are sent to the workers in chunks and only a bounded number of
+    chunks is in flight at once, so arbitrarily long job streams (e.g. a
+    whole library walk) run in constant memory.  Pass a long-lived
+    ``executor`` (made with ``make_executor``) to skip starting a pool
+    for every call; ``workers`` should then match its size.  Several jobs
+    for one file are merged into a single save.  With ``journal`` (a
+    batch directory from ``journal.begin``) the values every save
+    replaces are journaled first, so the batch can be undone.
+    """
+    workers = workers or os.cpu_count() or 1
+    summary = {"files": 0, "written": 0, "unchanged": 0, "read": 0, "errors": 0,
+               "in_place": 0, "rewrites": 0, "bytes_written": 0, "workers": workers}
+    start = time.perf_counter()
+
+    def collect(chunk_result):
+        results, snapshot = chunk_result
+        if snapshot:
+            instrumentation.merge_snapshot(snapshot)
+        for result in results:
+            summary["files"] += 1
+            if result["status"] == "error":
+                summary["errors"] += 1
+            else:
+                summary[result["status"]] += 1
+            if result["status"] == "written":
+                summary["in_place" if result["in_place"] else "rewrites"] += 1
+                summary["bytes_written"] += result["bytes_written"]
+            if on_result:
+                on_result(result)
+
+    def feed(executor):
+        pending = set()
+        for handler_name, chunk in _chunks_by_handler(coalesce_jobs(jobs), chunk_size):
+            if len(pending) >= workers * 2:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    collect(future.result())
+            pending.add(executor.submit(_apply_chunk, handler_name, chunk, cover_options, journal))
+        for future in pending:
+            collect(future.result())
+
+    if executor is not None:
+        feed(executor)
+    else:
+        with make_executor(workers) as executor:
+            feed(executor)
+
+    summary["seconds"] = time.perf_counter() - start
+    summary["files_per_second"] = summary["files"] / summary["seconds"] if summary["seconds"] else 0.0
+    return summary
+
+
+def _parse_set(values):
+    fields = {}
+    for item in values:
+        name, sep, value = item.partition("=")
+        field = tagcore.normalize_field_name(name)
+        if not sep or field is None:
+            raise argparse.ArgumentTypeError(f"Invalid --set value: {item!r} (expected FIELD=VALUE)")
+        fields[field] = value
+    return fields
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="main.py batch",
+                                     description="Read or edit tags for many files at once.")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("directory", nargs="?", help="Directory tree of audio files")
+    source.add_argument("--manifest", help="CSV, JSONL or Parquet file mapping path to field values")
+    parser.add_argument("--set", action="append", default=[], metavar="FIELD=VALUE",
+                        help="Field to write on every file of the directory (repeatable)")
+    parser.add_argument("--cover", help="Cover art image to embed in every file of the directory")
+    parser.add_argument("--cover-max-dim", type=int, default=covers.COVER_MAX_DIMENSION,
+                        help="Scale cover art down to fit this many pixels before embedding")
+    parser.add_argument("--cover-quality", type=int, default=covers.COVER_QUALITY,
+                        help="JPEG quality used when cover art has to be re-encoded")
+    parser.add_argument("--workers", type=int, default=None, help="Worker processes (default: CPU count)")
+    parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE,
+                        help="Files handed to a worker at a time")
+    parser.add_argument("--results", help="Write per-file results as JSON lines to this file")
+    parser.add_argument("--quiet", action="store_true", help="Only print errors and the summary")
+    parser.add_argument("--stats", action="store_true",
+                        help="Print per-stage timings and per-format save counters at the end")
+    parser.add_argument("--trace", help="Write every timed stage to this file "
+                                        "(.jsonl for JSON lines, otherwise Chrome trace format)")
+    parser.add_argument("--journal", action="store_true",
+                        help="Journal the values every save replaces, so the run can be undone "
+                             "with 'main.py journal undo'")
+    return parser
+
+
+def main(argv):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    try:
+        fields = _parse_set(args.set)
+    except argparse.ArgumentTypeError as e:
+        parser.error(str(e))
+
+    if args.manifest:
+        if fields or args.cover:
+            parser.error("--set and --cover only apply to directory mode")
+        jobs = iter_manifest_jobs(args.manifest)
+    else:
+        jobs = iter_directory_jobs(args.directory, fields, args.cover)
+
+    if args.stats or args.trace:
+        instrumentation.enable(args.trace)
+    results_file = open(args.results, "w", encoding="utf-8") if args.results else None
+    journal_dir = None
+    if args.journal:
+        import journal
+        journal_dir = journal.begin("batch " + " ".join(argv))
+
+    def on_result(result):
+        if results_file:
+            results_file.write(json.dumps(result) + "\n")
+        if result["status"] == "error":
+            print(f"error     {result['path']}: {result['error']}", file=sys.stderr)
+        elif not args.quiet:
+            print(f"{result['status']:<9} {result['path']}")
+
+    try:
+        summary = run_batch(jobs, workers=args.workers, chunk_size=args.chunk_size, on_result=on_result,
+                            cover_options={"max_dimension": args.cover_max_dim, "quality": args.cover_quality},
+                            journal=journal_dir)
+        # An interrupted run is left unfinished, "main.py journal list" shows it as such
+        if journal_dir and not journal.finish(journal_dir):
+            journal_dir = None
+    finally:
+        if results_file:
+            results_file.close()
+        if args.stats or args.trace:
+            instrumentation.finish(None)
+
+    print(f"{summary['files']} files ({summary['written']} written, {summary['unchanged']} unchanged, "
+          f"{summary['read']} read, "
+          f"{summary['errors']} errors) in {summary['seconds']:.2f}s "
+          f"with {summary['workers']} workers: {summary['files_per_second']:.1f} files/s")
+    if summary["written"]:
+        print(f"{summary['in_place']} saved in place, {summary['rewrites']} rewritten, "
+              f"~{summary['bytes_written'] / (1024 * 1024):.1f} MiB written")
+    if journal_dir:
+        batch_id = os.path.basename(journal_dir)
+        print(f"Journaled as {batch_id}, undo with: python main.py journal undo {batch_id}")
+    if args.stats:
+        print()
+        print(instrumentation.report(), end="")
+    return 1 if summary["errors"] else 0
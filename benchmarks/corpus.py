@@ -0,0 +1,273 @@
+"""Synthetic audio fixtures for the tag benchmarks.
+
+The audio payloads are structurally valid (frame headers, stream info,
+container atoms) but contain no real sound, so they can be generated for
+every format without any encoder installed.  Tags and cover art are
+written through tagcore, with an exact amount of padding.
+"""
+import io
+import os
+import json
+import wave
+import struct
+import random
+import argparse
+
+import tagcore
+
+
+FORMATS = ["mp3", "flac", "ogg", "m4a", "wav", "aac"]
+
+SAMPLE_RATE = 44100
+
+
+class FixedPadding:
+    # Padding policy that always leaves exactly ``padding`` bytes
+    def __init__(self, padding):
+        self.padding = padding
+
+    def __call__(self, info):
+        return self.padding
+
+
+def _payload(size, rng):
+    # Random bytes rather than zeros so the files don't compress on disk
+    return rng.randbytes(size) if hasattr(rng, "randbytes") else os.urandom(size)
+
+
+# Raw streams, one writer per format: write_<format>(path, audio_size, rng)
+
+def write_mp3(path, audio_size, rng):
+    # MPEG-1 Layer III, 128 kbps, 44.1 kHz, joint stereo: 417 byte frames
+    header = b"\xff\xfb\x90\x64"
+    frame = header + bytes(413)
+    with open(path, "wb") as f:
+        for _ in range(max(audio_size // len(frame), 8)):
+            f.write(frame)
+
+
+def write_aac(path, audio_size, rng):
+    # ADTS frames, AAC LC, 44.1 kHz, stereo
+    payload = 400
+    length = payload + 7
+    header = bytes([0xFF, 0xF1, (1 << 6) | (4 << 2), (2 << 6) | ((length >> 11) & 3),
+                    (length >> 3) & 0xFF, ((length & 7) << 5) | 0x1F, 0xFC])
+    frame = header + bytes(payload)
+    with open(path, "wb") as f:
+        for _ in range(max(audio_size // len(frame), 8)):
+            f.write(frame)
+
+
+def write_wav(path, audio_size, rng):
+    with wave.open(path, "wb") as w:
+        w.setnchannels(2)
+        w.setsampwidth(2)
+        w.setframerate(SAMPLE_RATE)
+        w.writeframes(_payload(audio_size - audio_size % 4, rng))
+
+
+def write_flac(path, audio_size, rng):
+    samples = audio_size // 4
+    streaminfo = struct.pack(">HH", 4096, 4096) + bytes(6)
+    # 20 bits sample rate, 3 bits channels - 1, 5 bits bits per sample - 1, 36 bits total samples
+    streaminfo += ((SAMPLE_RATE << 44) | (1 << 41) | (15 << 36) | samples).to_bytes(8, "big")
+    streaminfo += bytes(16)
+    with open(path, "wb") as f:
+        f.write(b"fLaC")
+        f.write(bytes([0x80]) + len(streaminfo).to_bytes(3, "big") + streaminfo)
+        f.write(b"\xff\xf8" + _payload(audio_size, rng))
+
+
+def write_ogg(path, audio_size, rng):
+    from mutagen.ogg import OggPage
+
+    serial = rng.randrange(1, 2 ** 31)
+    identification = (b"\x01vorbis" + struct.pack("<IBIiii", 0, 2, SAMPLE_RATE, 0, 128000, 0)
+                      + b"\xb8\x01")
+    comment = b"\x03vorbis" + struct.pack("<I", 4) + b"ATE " + struct.pack("<I", 0) + b"\x01"
+    setup = b"\x05vorbis" + bytes(64)
+
+    pages = []
+
+    def page(packets, position, first=False):
+        p = OggPage()
+        p.serial = serial
+        p.sequence = len(pages)
+        p.position = position
+        p.first = first
+        p.packets = packets
+        pages.append(p)
+
+    page([identification], 0, first=True)
+    page([comment, setup], 0)
+    packet_size = 4000
+    position = 0
+    for _ in range(max(audio_size // packet_size, 2)):
+        position += 1024 * 8
+        page([_payload(packet_size, rng)], position)
+    pages[-1].last = True
+    with open(path, "wb") as f:
+        for p in pages:
+            f.write(p.write())
+
+
+def write_opus(path, audio_size, rng):
+    from mutagen.ogg import OggPage
+
+    serial = rng.randrange(1, 2 ** 31)
+    head = b"OpusHead" + struct.pack("<BBHIhB", 1, 2, 312, 48000, 0, 0)
+    tags = b"OpusTags" + struct.pack("<I", 4) + b"none" + struct.pack("<I", 0)
+    packet_size = 4000
+    pages = []
+    for sequence, packet in enumerate([head, tags] + [_payload(packet_size, rng)
+                                                      for _ in range(max(audio_size // packet_size, 2))]):
+        p = OggPage()
+        p.serial = serial
+        p.sequence = sequence
+        p.position = 0 if sequence < 2 else (sequence - 1) * 960 * 50
+        p.first = sequence == 0
+        p.packets = [packet]
+        pages.append(p)
+    pages[-1].last = True
+    with open(path, "wb") as f:
+        for p in pages:
+            f.write(p.write())
+
+
+def write_aiff(path, audio_size, rng):
+    samples = audio_size // 4
+    # 2 channels, 16 bits, 44.1 kHz as an 80 bit extended float
+    comm = struct.pack(">hIh", 2, samples, 16) + bytes.fromhex("400EAC44000000000000")
+    ssnd = struct.pack(">II", 0, 0) + _payload(samples * 4, rng)
+    chunks = b"COMM" + struct.pack(">I", len(comm)) + comm + b"SSND" + struct.pack(">I", len(ssnd)) + ssnd
+    with open(path, "wb") as f:
+        f.write(b"FORM" + struct.pack(">I", 4 + len(chunks)) + b"AIFF" + chunks)
+
+
+def write_wavpack(path, audio_size, rng):
+    samples = audio_size // 4
+    # One block: 16 bits per sample (flags 1), 44.1 kHz (rate index 9 in bits 23-26)
+    header = b"wvpk" + struct.pack("<IHBBIIIII", 24 + audio_size, 0x410, 0, 0, samples, 0, samples,
+                                   (9 << 23) | 1, 0)
+    with open(path, "wb") as f:
+        f.write(header + _payload(audio_size, rng))
+
+
+def write_ape(path, audio_size, rng):
+    # Version 3.99 header: descriptor, then frame layout and stream format at bytes 56-76
+    header = b"MAC " + struct.pack("<H", 3990) + bytes(50)
+    header += struct.pack("<IIIHHI", 73728, max(audio_size // 4, 1), 1, 16, 2, SAMPLE_RATE)
+    with open(path, "wb") as f:
+        f.write(header + _payload(audio_size, rng))
+
+
+def _atom(name, payload):
+    return struct.pack(">I", 8 + len(payload)) + name + payload
+
+
+def write_m4a(path, audio_size, rng):
+    timescale = SAMPLE_RATE
+    duration = audio_size // 16
+    mvhd = _atom(b"mvhd", struct.pack(">IIIII", 0, 0, 0, timescale, duration)
+                 + struct.pack(">IH", 0x00010000, 0x0100) + bytes(10)
+                 + struct.pack(">9I", 0x00010000, 0, 0, 0, 0x00010000, 0, 0, 0, 0x40000000)
+                 + bytes(24) + struct.pack(">I", 2))
+    mdhd = _atom(b"mdhd", struct.pack(">IIIIIHH", 0, 0, 0, timescale, duration, 0x55C4, 0))
+    hdlr = _atom(b"hdlr", struct.pack(">II", 0, 0) + b"soun" + bytes(12) + b"\x00")
+    trak = _atom(b"trak", _atom(b"mdia", mdhd + hdlr))
+    moov = _atom(b"moov", mvhd + trak)
+    ftyp = _atom(b"ftyp", b"M4A " + struct.pack(">I", 0) + b"M4A mp42isom")
+    with open(path, "wb") as f:
+        f.write(ftyp)
+        f.write(moov)
+        f.write(_atom(b"mdat", _payload(audio_size, rng)))
+
+
+WRITERS = {
+    "mp3": write_mp3,
+    "flac": write_flac,
+    "ogg": write_ogg,
+    "m4a": write_m4a,
+    "wav": write_wav,
+    "aac": write_aac,
+    "opus": write_opus,
+    "aiff": write_aiff,
+    "wavpack": write_wavpack,
+    "ape": write_ape,
+}
+
+_cover_cache = {}
+
+
+def make_cover(resolution, seed=0):
+    """Return JPEG bytes of a noisy square image, so its size is realistic."""
+    key = (resolution, seed)
+    if key not in _cover_cache:
+        from PIL import Image
+        image = Image.effect_noise((resolution, resolution), 48).convert("RGB")
+        out = io.BytesIO()
+        image.save(out, format="JPEG", quality=90)
+        _cover_cache[key] = out.getvalue()
+    return _cover_cache[key]
+
+
+def make_fields(index, tag_size):
+    """Field values for track ``index``, the title padded out to ``tag_size`` characters."""
+    title = f"Track {index:05d} "
+    return {
+        "Song Name": (title + "x" * tag_size)[:max(tag_size, len(title))],
+        "Artist": f"Artist {index % 97}",
+        "Album": f"Album {index % 503}",
+        "Genre": "Benchmark",
+        "Year": str(1960 + index % 60),
+    }
+
+
+def make_file(path, fmt, audio_size=1024 * 1024, tag_size=32, padding=1024, cover_resolution=0,
+              index=0, seed=0):
+    """Write one tagged fixture and return its path."""
+    rng = random.Random(seed * 1000003 + index)
+    WRITERS[fmt](path, audio_size, rng)
+    cover = make_cover(cover_resolution, seed) if cover_resolution else None
+    tag_file = tagcore.TagFile(path, padding_policy=FixedPadding(padding))
+    tag_file.save(make_fields(index, tag_size), cover)
+    return path
+
+
+def make_corpus(directory, formats=FORMATS, count=1, audio_size=1024 * 1024, tag_size=32, padding=1024,
+                cover_resolution=0, seed=0):
+    """Write ``count`` fixtures per format below ``directory`` and return their paths.
+
+    A ``corpus.json`` next to them records the parameters they were made with.
+    """
+    paths = []
+    for fmt in formats:
+        fmt_dir = os.path.join(directory, fmt)
+        os.makedirs(fmt_dir, exist_ok=True)
+        for index in range(count):
+            path = os.path.join(fmt_dir, f"track{index:05d}.{fmt}")
+            paths.append(make_file(path, fmt, audio_size, tag_size, padding, cover_resolution, index, seed))
+    with open(os.path.join(directory, "corpus.json"), "w", encoding="utf-8") as f:
+        json.dump({"formats": list(formats), "count": count, "audio_size": audio_size, "tag_size": tag_size,
+                   "padding": padding, "cover_resolution": cover_resolution, "seed": seed}, f, indent=2)
+    return paths
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate synthetic tagged audio files.")
+    parser.add_argument("directory")
+    parser.add_argument("--formats", default=",".join(FORMATS), help="Comma separated formats")
+    parser.add_argument("--count", type=int, default=10, help="Files per format")
+    parser.add_argument("--audio-size", type=int, default=1024 * 1024, help="Audio payload bytes per file")
+    parser.add_argument("--tag-size", type=int, default=32, help="Length of the title field")
+    parser.add_argument("--padding", type=int, default=1024, help="Tag padding bytes")
+    parser.add_argument("--cover", type=int, default=0, help="Cover art resolution in pixels (0 for none)")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+    paths = make_corpus(args.directory, args.formats.split(","), args.count, args.audio_size, args.tag_size,
+                        args.padding, args.cover, args.seed)
+    print(f"Wrote {len(paths)} files to {args.directory}")
+
+
+if __name__ == "__main__":
+    main()
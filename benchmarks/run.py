@@ -0,0 +1,321 @@
+"""Tag load/save benchmarks over a synthetic corpus.
+
+    python -m benchmarks.run --output results.json
+    python -m benchmarks.run --output new.json --compare results.json
+
+The single-file suite times loading and saving one file per combination
+of format, audio size, tag size, padding and cover resolution.  The scale
+suite loads and saves a whole corpus of small files per format, one by
+one and then through the batch process pool.  Results are written as
+JSON; ``--compare`` prints the change against an earlier run and exits
+non-zero when something got slower by more than ``--threshold``.
+"""
+import os
+import sys
+import gc
+import json
+import time
+import shutil
+import platform
+import argparse
+import tempfile
+import itertools
+import statistics
+import tracemalloc
+
+import tagcore
+import batch
+from benchmarks import corpus
+
+
+KIB = 1024
+MIB = 1024 * 1024
+
+# Parameter grid of the single-file suite
+AUDIO_SIZES = [256 * KIB, 8 * MIB]
+TAG_SIZES = [32, 4 * KIB]
+PADDINGS = [0, 8 * KIB]
+COVER_RESOLUTIONS = [0, 600, 3000]
+
+# Files of the scale suite are small (~80 KB), 10k per format still take ~5 GB
+SCALE_FILES = 10000
+SCALE_AUDIO_SIZE = 16 * KIB
+SCALE_COVER = 300
+
+# Every save grows the title by this much, so files without padding get rewritten
+TITLE_GROWTH = 16
+
+
+def _percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(int(len(ordered) * fraction), len(ordered) - 1)]
+
+
+def _latency(seconds):
+    """Summary in milliseconds of a list of timings in seconds."""
+    ms = [s * 1000 for s in seconds]
+    return {
+        "median_ms": statistics.median(ms),
+        "min_ms": min(ms),
+        "p95_ms": _percentile(ms, 0.95),
+        "p99_ms": _percentile(ms, 0.99),
+    }
+
+
+def _max_rss_kib():
+    try:
+        import resource
+    except ImportError:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Bytes on macOS, KiB elsewhere
+    return rss // 1024 if sys.platform == "darwin" else rss
+
+
+def _grown_title(fields):
+    return fields.get("Song Name", "") + "+" * TITLE_GROWTH
+
+
+def single_file_case(work_dir, fmt, audio_size, tag_size, padding, cover, repeat):
+    """Time ``repeat`` load+save rounds, each on a fresh copy of the same fixture."""
+    pristine = os.path.join(work_dir, f"pristine.{fmt}")
+    target = os.path.join(work_dir, f"target.{fmt}")
+    corpus.make_file(pristine, fmt, audio_size, tag_size, padding, cover)
+
+    loads, saves, bytes_written, in_place = [], [], [], []
+    for _ in range(repeat):
+        shutil.copyfile(pristine, target)
+        start = time.perf_counter()
+        tag_file = tagcore.TagFile(target)
+        loaded = time.perf_counter()
+        tag_file.save({"Song Name": _grown_title(tag_file.fields)})
+        saved = time.perf_counter()
+        loads.append(loaded - start)
+        saves.append(saved - loaded)
+        bytes_written.append(tag_file.last_save["bytes_written"])
+        in_place.append(tag_file.last_save["in_place"])
+
+    # Memory is measured in a separate round, tracemalloc skews the timings
+    shutil.copyfile(pristine, target)
+    gc.collect()
+    tracemalloc.start()
+    tag_file = tagcore.TagFile(target)
+    tag_file.save({"Song Name": _grown_title(tag_file.fields)})
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    del tag_file
+
+    return {
+        "format": fmt,
+        "audio_size": audio_size,
+        "tag_size": tag_size,
+        "padding": padding,
+        "cover": cover,
+        "file_size": os.path.getsize(pristine),
+        "load": _latency(loads),
+        "save": _latency(saves),
+        "bytes_written": statistics.median(bytes_written),
+        "in_place": all(in_place),
+        "peak_memory_kib": peak // KIB,
+    }
+
+
+def run_single(formats, repeat, work_dir, on_case=None):
+    cases = []
+    grid = itertools.product(formats, AUDIO_SIZES, TAG_SIZES, PADDINGS, COVER_RESOLUTIONS)
+    for fmt, audio_size, tag_size, padding, cover in grid:
+        case = single_file_case(work_dir, fmt, audio_size, tag_size, padding, cover, repeat)
+        cases.append(case)
+        if on_case:
+            on_case(case)
+    return cases
+
+
+def _scale_corpus(directory, formats, files):
+    """Reuse a corpus from an earlier run when it was made with the same parameters."""
+    params = {"formats": list(formats), "count": files, "audio_size": SCALE_AUDIO_SIZE, "tag_size": 32,
+              "padding": 1024, "cover_resolution": SCALE_COVER, "seed": 0}
+    try:
+        with open(os.path.join(directory, "corpus.json"), encoding="utf-8") as f:
+            if json.load(f) == params:
+                return
+    except (OSError, ValueError):
+        pass
+    print(f"Generating {files} files per format in {directory}...", file=sys.stderr)
+    corpus.make_corpus(directory, formats, files, SCALE_AUDIO_SIZE, 32, 1024, SCALE_COVER)
+
+
+def scale_case(directory, fmt, workers):
+    paths = sorted(entry.path for entry in os.scandir(os.path.join(directory, fmt)))
+    loads, saves = [], []
+    bytes_written = in_place = 0
+    start = time.perf_counter()
+    for path in paths:
+        t0 = time.perf_counter()
+        tag_file = tagcore.TagFile(path)
+        t1 = time.perf_counter()
+        # Same length either way, so the corpus can be reused across runs
+        genre = "Benchmark B" if tag_file.fields.get("Genre") == "Benchmark A" else "Benchmark A"
+        tag_file.save({"Genre": genre})
+        saves.append(time.perf_counter() - t1)
+        loads.append(t1 - t0)
+        bytes_written += tag_file.last_save["bytes_written"]
+        in_place += tag_file.last_save["in_place"]
+    seconds = time.perf_counter() - start
+
+    summary = batch.run_batch(batch.iter_directory_jobs(os.path.join(directory, fmt), {}), workers=workers)
+    return {
+        "format": fmt,
+        "files": len(paths),
+        "seconds": seconds,
+        "files_per_second": len(paths) / seconds if seconds else 0.0,
+        "load": _latency(loads),
+        "save": _latency(saves),
+        "bytes_written": bytes_written,
+        "in_place": in_place,
+        "rewrites": len(paths) - in_place,
+        "batch_read": {
+            "workers": summary["workers"],
+            "seconds": summary["seconds"],
+            "files_per_second": summary["files_per_second"],
+            "errors": summary["errors"],
+        },
+        "max_rss_kib": _max_rss_kib(),
+    }
+
+
+def run_scale(formats, files, directory, workers, on_case=None):
+    _scale_corpus(directory, formats, files)
+    cases = []
+    for fmt in formats:
+        case = scale_case(directory, fmt, workers)
+        cases.append(case)
+        if on_case:
+            on_case(case)
+    return cases
+
+
+def _metadata(args):
+    import mutagen
+    try:
+        import PIL
+        pillow = PIL.__version__
+    except ImportError:
+        pillow = None
+    return {
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "mutagen": mutagen.version_string,
+        "pillow": pillow,
+        "args": {key: value for key, value in vars(args).items() if key != "compare"},
+    }
+
+
+# Comparing runs
+
+def _case_key(case):
+    return tuple((name, case[name]) for name in ("format", "audio_size", "tag_size", "padding", "cover", "files")
+                 if name in case)
+
+
+def _describe(key):
+    return " ".join(f"{value}" if name == "format" else f"{name}={value}" for name, value in key)
+
+
+def _metrics(case):
+    """The numbers of a case that are compared between runs, lower is better for all."""
+    metrics = {}
+    for stage in ("load", "save"):
+        metrics[f"{stage} median ms"] = case[stage]["median_ms"]
+    metrics["bytes written"] = case["bytes_written"]
+    if "peak_memory_kib" in case:
+        metrics["peak KiB"] = case["peak_memory_kib"]
+    if "batch_read" in case:
+        metrics["batch read s"] = case["batch_read"]["seconds"]
+    return metrics
+
+
+def compare(baseline, current, threshold):
+    """Print the change of every metric against ``baseline`` and return the regressions."""
+    regressions = []
+    for suite in ("single", "scale"):
+        old_cases = {_case_key(case): case for case in baseline.get(suite, [])}
+        for case in current.get(suite, []):
+            key = _case_key(case)
+            old = old_cases.get(key)
+            if old is None:
+                continue
+            old_metrics = _metrics(old)
+            for name, value in _metrics(case).items():
+                before = old_metrics.get(name)
+                if not before:
+                    continue
+                change = (value - before) / before
+                flag = ""
+                if change > threshold:
+                    flag = "  REGRESSION"
+                    regressions.append((suite, key, name, change))
+                print(f"{suite:6} {_describe(key):<52} {name:<16} {before:12.2f} -> {value:12.2f} "
+                      f"({change:+.1%}){flag}")
+    return regressions
+
+
+def _print_case(case):
+    if "files" in case:
+        print(f"{case['format']:5} {case['files']} files: load p50 {case['load']['median_ms']:.2f} ms, "
+              f"save p50 {case['save']['median_ms']:.2f} ms, {case['files_per_second']:.0f} files/s, "
+              f"batch read {case['batch_read']['files_per_second']:.0f} files/s", file=sys.stderr)
+    else:
+        print(f"{case['format']:5} audio={case['audio_size']} tag={case['tag_size']} pad={case['padding']} "
+              f"cover={case['cover']}: load {case['load']['median_ms']:.2f} ms, "
+              f"save {case['save']['median_ms']:.2f} ms, {case['bytes_written']:.0f} B "
+              f"{'in place' if case['in_place'] else 'rewritten'}, peak {case['peak_memory_kib']} KiB",
+              file=sys.stderr)
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.run",
+                                     description="Benchmark tag loading and saving per format.")
+    parser.add_argument("--suite", choices=["single", "scale", "all"], default="all")
+    parser.add_argument("--formats", default=",".join(corpus.FORMATS), help="Comma separated formats")
+    parser.add_argument("--repeat", type=int, default=5, help="Rounds per single-file case")
+    parser.add_argument("--files", type=int, default=SCALE_FILES, help="Files per format in the scale suite")
+    parser.add_argument("--corpus", help="Directory for the scale corpus, kept between runs "
+                                         "(default: a temporary directory)")
+    parser.add_argument("--workers", type=int, default=None, help="Batch workers (default: CPU count)")
+    parser.add_argument("--output", help="Write the results as JSON to this file")
+    parser.add_argument("--compare", help="Earlier results JSON to compare against")
+    parser.add_argument("--threshold", type=float, default=0.10,
+                        help="Relative slowdown reported as a regression (default: 0.10)")
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    formats = args.formats.split(",")
+    results = {"meta": _metadata(args)}
+
+    with tempfile.TemporaryDirectory(prefix="tagbench-") as work_dir:
+        if args.suite in ("single", "all"):
+            results["single"] = run_single(formats, args.repeat, work_dir, on_case=_print_case)
+        if args.suite in ("scale", "all"):
+            directory = args.corpus or os.path.join(work_dir, "corpus")
+            results["scale"] = run_scale(formats, args.files, directory, args.workers, on_case=_print_case)
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)
+        regressions = compare(baseline, results, args.threshold)
+        if regressions:
+            print(f"{len(regressions)} metrics regressed by more than {args.threshold:.0%}", file=sys.stderr)
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
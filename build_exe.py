@@ -1,18 +1,51 @@
 import PyInstaller.__main__
+import argparse
 import os
 
+from main import COMMANDS
+
 # Get the current directory
 current_dir = os.path.dirname(os.path.abspath(__file__))
 main_script = os.path.join(current_dir, "main.py")
 
-# Run PyInstaller with proper arguments
-PyInstaller.__main__.run([
-    '--onefile',                    # Create a single executable file
+# Modules pulled in through Pillow or the standard library that the app never
+# uses; leaving them out makes the bundle smaller and faster to unpack and load
+EXCLUDED_MODULES = [
+    "numpy",
+    "PIL.ImageQt",
+    "PyQt5",
+    "PyQt6",
+    "PySide2",
+    "PySide6",
+    "IPython",
+    "matplotlib",
+    "unittest",
+    "doctest",
+    "pydoc",
+    "lib2to3",
+    "setuptools",
+    "pkg_resources",
+]
+
+parser = argparse.ArgumentParser(description="Build the AudioTagEditor executable.")
+parser.add_argument("--onedir", action="store_true",
+                    help="Build a folder instead of a single file. Starts faster because "
+                         "nothing has to be unpacked to a temp directory on every launch.")
+args = parser.parse_args()
+
+pyinstaller_args = [
+    '--onedir' if args.onedir else '--onefile',  # Folder or single executable file
     '--windowed',                   # Hide console window (for GUI apps)
     '--name=AudioTagEditor',        # Name of the executable
     '--icon=icon.ico',             # Add icon if you have one (optional)
     '--distpath=dist',             # Output directory
     '--workpath=build',            # Temporary build directory
     '--clean',                     # Clean cache and remove temporary files
-    main_script
-])
\ No newline at end of file
+    '--noupx',                     # UPX-compressed libraries must be decompressed on every start
+]
+pyinstaller_args += [f'--exclude-module={module}' for module in EXCLUDED_MODULES]
+# Command modules are imported by name at runtime, PyInstaller can't see them
+pyinstaller_args += [f'--hidden-import={module}' for module in COMMANDS.values()]
+
+# Run PyInstaller with proper arguments
+PyInstaller.__main__.run(pyinstaller_args + [main_script])
@@ -0,0 +1,264 @@
+import io
+import os
+import struct
+import hashlib
+import threading
+from collections import OrderedDict
+
+import instrumentation
+
+
+# Defaults for embedding cover art: no size limit, JPEG quality when re-encoding
+COVER_MAX_DIMENSION = None
+COVER_QUALITY = 90
+
+# Size of the cover preview shown in the editor
+THUMBNAIL_SIZE = (150, 150)
+
+PREVIEW_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".audio_tag_editor", "previews")
+
+JPEG_MAGIC = b"\xff\xd8\xff"
+PNG_MAGIC = b"\x89PNG\r\n\x1a\n"
+
+
+def sniff_mime(data):
+    """Return "image/jpeg" or "image/png" for those formats, None for anything else."""
+    if data.startswith(JPEG_MAGIC):
+        return "image/jpeg"
+    if data.startswith(PNG_MAGIC):
+        return "image/png"
+    return None
+
+
+def prepare_cover(data, max_dimension=COVER_MAX_DIMENSION, quality=COVER_QUALITY):
+    """Return the image bytes to embed for the given image file contents.
+
+    JPEG and PNG images within ``max_dimension`` are embedded unchanged,
+    without even being decoded.  Other formats (BMP, GIF, WebP, ...) and
+    oversized images are re-encoded: as PNG when they have transparency,
+    as JPEG at ``quality`` otherwise.
+    """
+    mime = sniff_mime(data)
+    if mime and max_dimension is None:
+        return data
+    from PIL import Image
+    with instrumentation.stage("encode"):
+        image = Image.open(io.BytesIO(data))
+        too_big = max_dimension is not None and max(image.size) > max_dimension
+        if mime and not too_big:
+            return data
+        if too_big:
+            image.thumbnail((max_dimension, max_dimension), Image.LANCZOS)
+        return encode_image(image, quality)
+
+
+def encode_image(image, quality=COVER_QUALITY):
+    out = io.BytesIO()
+    if image.mode in ("RGBA", "LA") or (image.mode == "P" and "transparency" in image.info):
+        image.save(out, format="PNG", optimize=True)
+    else:
+        image.convert("RGB").save(out, format="JPEG", quality=quality, optimize=True)
+    return out.getvalue()
+
+
+def load_cover(image_path, max_dimension=COVER_MAX_DIMENSION, quality=COVER_QUALITY):
+    with open(image_path, "rb") as img_file:
+        return prepare_cover(img_file.read(), max_dimension, quality)
+
+
+# Prepared cover art kept per process, keyed by a hash of the source image:
+# a batch putting one cover on every track of an album reads and encodes it once
+PREPARED_CACHE_ENTRIES = 16
+_prepared = OrderedDict()
+_prepared_files = {}
+_prepared_lock = threading.Lock()
+
+
+def prepare_cover_cached(data, max_dimension=COVER_MAX_DIMENSION, quality=COVER_QUALITY):
+    """Like prepare_cover, but every distinct image is only prepared once."""
+    return _prepare_once(hashlib.sha1(data).digest(), data, max_dimension, quality)
+
+
+def load_cover_cached(image_path, max_dimension=COVER_MAX_DIMENSION, quality=COVER_QUALITY):
+    """Like load_cover, but an unchanged image file is only read and prepared once."""
+    stat = os.stat(image_path)
+    file_key = (image_path, stat.st_size, stat.st_mtime_ns)
+    with _prepared_lock:
+        digest = _prepared_files.get(file_key)
+    data = None
+    if digest is None:
+        with open(image_path, "rb") as img_file:
+            data = img_file.read()
+        digest = hashlib.sha1(data).digest()
+        with _prepared_lock:
+            _prepared_files[file_key] = digest
+    return _prepare_once(digest, data, max_dimension, quality, image_path)
+
+
+def _prepare_once(digest, data, max_dimension, quality, image_path=None):
+    key = (digest, max_dimension, quality)
+    with _prepared_lock:
+        prepared = _prepared.get(key)
+        if prepared is not None:
+            _prepared.move_to_end(key)
+            return prepared
+    if data is None:
+        # Known file whose prepared bytes were evicted since
+        with open(image_path, "rb") as img_file:
+            data = img_file.read()
+    prepared = prepare_cover(data, max_dimension, quality)
+    with _prepared_lock:
+        _prepared[key] = prepared
+        while len(_prepared) > PREPARED_CACHE_ENTRIES:
+            _prepared.popitem(last=False)
+    return prepared
+
+
+def image_size(data):
+    """Return (width, height) of JPEG or PNG bytes from their headers, None for anything else."""
+    if data.startswith(PNG_MAGIC):
+        return struct.unpack(">II", data[16:24]) if len(data) >= 24 else None
+    if not data.startswith(JPEG_MAGIC):
+        return None
+    offset = 2
+    while offset + 9 <= len(data):
+        if data[offset] != 0xFF:
+            return None
+        marker = data[offset + 1]
+        if marker == 0xFF:
+            # Fill byte
+            offset += 1
+            continue
+        if marker == 0x01 or 0xD0 <= marker <= 0xD8:
+            # Markers without a length
+            offset += 2
+            continue
+        if 0xC0 <= marker <= 0xCF and marker not in (0xC4, 0xC8, 0xCC):
+            # Start of frame: length, precision, height, width
+            height, width = struct.unpack(">HH", data[offset + 5:offset + 9])
+            return width, height
+        offset += 2 + int.from_bytes(data[offset + 2:offset + 4], "big")
+    return None
+
+
+def thumbnail(data, size=THUMBNAIL_SIZE):
+    """Decode image bytes into a small PIL image for display only.
+
+    JPEGs are decoded in draft mode, which lets the decoder scale down by
+    1/2, 1/4 or 1/8 while decoding instead of decoding every pixel of a
+    3000px scan just to throw most of them away.
+    """
+    # Pillow is only imported once an image is actually needed
+    from PIL import Image
+    with instrumentation.stage("thumbnail"):
+        image = Image.open(io.BytesIO(data))
+        if image.format == "JPEG":
+            image.draft("RGB", size)
+        image.thumbnail(size)
+    return image
+
+
+class PreviewCache:
+    """LRU cache of cover previews keyed by a hash of the picture bytes.
+
+    Tracks of an album usually share the same cover, so the picture is
+    decoded once and every other track gets the cached preview.  Previews
+    are kept in memory (up to ``max_entries``) and as small PNGs in
+    ``cache_dir`` (up to ``max_disk_entries``, least recently used files
+    are removed first) so they survive restarts.  Pass ``cache_dir=None``
+    for a memory-only cache.  Safe to use from several threads.
+    """
+
+    PRUNE_EVERY = 64
+
+    def __init__(self, size=THUMBNAIL_SIZE, max_entries=256, cache_dir=PREVIEW_CACHE_DIR,
+                 max_disk_entries=5000):
+        self.size = size
+        self.max_entries = max_entries
+        self.cache_dir = cache_dir
+        self.max_disk_entries = max_disk_entries
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._disk_writes = 0
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    def key(self, data):
+        return f"{hashlib.sha1(data).hexdigest()}-{self.size[0]}x{self.size[1]}"
+
+    def get(self, data):
+        """Return the preview image for picture bytes, decoding them only on a miss."""
+        key = self.key(data)
+        with self._lock:
+            image = self._memory.get(key)
+            if image is not None:
+                self._memory.move_to_end(key)
+                self.hits += 1
+                return image
+        image = self._read_disk(key)
+        if image is not None:
+            self.disk_hits += 1
+        else:
+            self.misses += 1
+            image = thumbnail(data, self.size)
+            self._write_disk(key, image)
+        with self._lock:
+            self._memory[key] = image
+            if len(self._memory) > self.max_entries:
+                self._memory.popitem(last=False)
+        return image
+
+    def _disk_path(self, key):
+        return os.path.join(self.cache_dir, key[:2], key + ".png")
+
+    def _read_disk(self, key):
+        if not self.cache_dir:
+            return None
+        path = self._disk_path(key)
+        from PIL import Image
+        try:
+            image = Image.open(path)
+            image.load()
+            # Bump the mtime so pruning treats it as recently used
+            os.utime(path)
+            return image
+        except (OSError, ValueError):
+            return None
+
+    def _write_disk(self, key, image):
+        if not self.cache_dir:
+            return
+        path = self._disk_path(key)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            image.save(tmp_path, format="PNG")
+            os.replace(tmp_path, path)
+        except (OSError, ValueError) as e:
+            print(f"Error caching cover preview: {e}")
+            return
+        with self._lock:
+            self._disk_writes += 1
+            prune = self._disk_writes % self.PRUNE_EVERY == 0
+        if prune:
+            self.prune_disk()
+
+    def prune_disk(self):
+        """Remove the least recently used preview files beyond max_disk_entries."""
+        entries = []
+        for root, _dirs, files in os.walk(self.cache_dir):
+            for name in files:
+                path = os.path.join(root, name)
+                try:
+                    entries.append((os.stat(path).st_mtime, path))
+                except OSError:
+                    continue
+        if len(entries) <= self.max_disk_entries:
+            return
+        entries.sort()
+        for _mtime, path in entries[:len(entries) - self.max_disk_entries]:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
@@ -0,0 +1,534 @@
+import os
+import base64
+import struct
+
+# mutagen's format modules are imported by the functions using them, so
+# starting the app (or a batch worker) only pays for the formats it touches.
+
+
+ID3_TAG_MAP = {
+    "TIT2": "Song Name",
+    "TPE1": "Artist",
+    "TALB": "Album",
+    "TCON": "Genre",
+    "TYER": "Year"
+}
+# mutagen upgrades TYER to TDRC when saving ID3v2.4, so the year is read from either
+ID3_YEAR_FRAMES = ("TYER", "TDRC")
+
+MP4_TAG_MAP = {
+    "\xa9nam": "Song Name",
+    "\xa9ART": "Artist",
+    "\xa9alb": "Album",
+    "\xa9gen": "Genre",
+    "\xa9day": "Year"
+}
+
+VORBIS_TAG_MAP = {
+    "TITLE": "Song Name",
+    "ARTIST": "Artist",
+    "ALBUM": "Album",
+    "GENRE": "Genre",
+    "DATE": "Year"
+}
+
+APEV2_TAG_MAP = {
+    "Title": "Song Name",
+    "Artist": "Artist",
+    "Album": "Album",
+    "Genre": "Genre",
+    "Year": "Year"
+}
+APEV2_COVER_KEY = "Cover Art (Front)"
+
+# Bytes read from the start of a file to sniff its format
+HEADER_SIZE = 128
+
+
+class FormatHandler:
+    """How to read and write the tags of one audio format.
+
+    ``load(path)`` returns the parsed mutagen object and its stream info,
+    ``read(handler, audio)`` returns ``(fields, cover)`` and
+    ``apply(handler, audio, fields, cover)`` puts edited values on the
+    object before it's saved.  ``tag_map`` maps the format's tag keys to
+    editor fields; the reverse mapping is built once at registration.
+    ``sniff(header)`` tells whether the first bytes of a file (after any
+    ID3v2 tag) look like this format.  ``payload(fileobj, size)`` returns
+    the (offset, length) ranges holding the audio itself, without any tags.
+    ``padding`` tells whether the mutagen object's ``save`` takes a
+    padding callback; APEv2 tags sit at the end of the file and have none.
+    """
+
+    def __init__(self, name, extensions, tag_map, load, read, apply, sniff=None, payload=None, padding=True):
+        self.name = name
+        self.extensions = tuple(extensions)
+        self.tag_map = tag_map
+        self.field_keys = {field: key for key, field in tag_map.items()}
+        self.load = load
+        self.read = read
+        self.apply = apply
+        self.sniff = sniff
+        self.payload = payload
+        self.padding = padding
+
+    def __repr__(self):
+        return f"<FormatHandler {self.name}>"
+
+
+_handlers = []
+_handlers_by_extension = {}
+
+
+def register_handler(handler):
+    """Make a format handler available, replacing any handler for its extensions.
+
+    A handler with the same name, or one left with no extensions of its
+    own, is dropped so sniffing and lookups by name find the new one.
+    """
+    for extension in handler.extensions:
+        _handlers_by_extension[extension] = handler
+    owned = set(_handlers_by_extension.values())
+    superseded = [old for old in _handlers
+                  if old is not handler and (old.name == handler.name or old not in owned)]
+    # The new handler takes the place of the one it replaces in sniffing order
+    if handler not in _handlers:
+        position = _handlers.index(superseded[0]) if superseded else len(_handlers)
+        _handlers.insert(position, handler)
+    for old in superseded:
+        _handlers.remove(old)
+    for extension, old in list(_handlers_by_extension.items()):
+        if old in superseded:
+            del _handlers_by_extension[extension]
+    return handler
+
+
+def handlers():
+    return list(_handlers)
+
+
+def audio_extensions():
+    return tuple(_handlers_by_extension)
+
+
+def handler_named(name):
+    return next((handler for handler in _handlers if handler.name == name), None)
+
+
+def handler_for_extension(file_path):
+    return _handlers_by_extension.get(os.path.splitext(file_path)[1].lower())
+
+
+def read_header(file_path):
+    """Return the first bytes of the audio data, skipping a leading ID3v2 tag."""
+    with open(file_path, "rb") as f:
+        header = f.read(HEADER_SIZE)
+        size = id3v2_size(header)
+        if size:
+            f.seek(size)
+            header = f.read(HEADER_SIZE)
+    return header
+
+
+def id3v2_size(header):
+    """Size of the ID3v2 tag the given bytes start with, 0 if they don't start with one."""
+    if header[:3] != b"ID3" or len(header) < 10:
+        return 0
+    # Syncsafe size, plus the 10 byte header (and footer if flagged)
+    size = 0
+    for byte in header[6:10]:
+        size = (size << 7) | (byte & 0x7F)
+    return size + (20 if header[5] & 0x10 else 10)
+
+
+def sniff_handler(file_path):
+    """Pick a handler from the file's contents, like mutagen.File does."""
+    try:
+        header = read_header(file_path)
+    except OSError:
+        return None
+    for handler in _handlers:
+        if handler.sniff and handler.sniff(header):
+            return handler
+    return None
+
+
+def image_mime(data):
+    if data[:3] == b"\xff\xd8\xff":
+        return "image/jpeg"
+    return "image/png"
+
+
+# ID3 based formats (MP3, WAV, AIFF and ADTS AAC)
+
+def _id3_fields(handler, tags):
+    fields = {}
+    if tags is None:
+        return fields
+    for tag, field in handler.tag_map.items():
+        if tag in tags and tags[tag].text:
+            fields[field] = str(tags[tag].text[0])
+    if "Year" not in fields and "TDRC" in tags and tags["TDRC"].text:
+        fields["Year"] = str(tags["TDRC"].text[0])
+    return fields
+
+
+def _id3_cover(tags):
+    if tags is None:
+        return None
+    apic_key = next((k for k in tags.keys() if k.startswith("APIC")), None)
+    if apic_key:
+        return tags[apic_key].data
+    return None
+
+
+def _apply_id3(handler, tags, fields, cover):
+    from mutagen import id3
+    for field, value in fields.items():
+        tag = handler.field_keys[field]
+        for old_tag in (ID3_YEAR_FRAMES if tag == "TYER" else (tag,)):
+            if old_tag in tags:
+                del tags[old_tag]
+        # The frame classes are named after their IDs (TIT2, TPE1, ...)
+        tags.add(getattr(id3, tag)(encoding=3, text=value))
+    if cover is not None:
+        tags.delall("APIC")
+        tags.add(id3.APIC(encoding=3, mime=image_mime(cover), type=3, desc='Cover Art', data=cover))
+
+
+def _read_id3_file(handler, audio):
+    return _id3_fields(handler, audio.tags), _id3_cover(audio.tags)
+
+
+def _apply_id3_file(handler, audio, fields, cover):
+    if audio.tags is None:
+        audio.add_tags()
+    _apply_id3(handler, audio.tags, fields, cover)
+
+
+def _load_mp3(file_path):
+    from mutagen.mp3 import MP3
+    from mutagen.id3 import ID3
+    audio = MP3(file_path, ID3=ID3)
+    return audio, audio.info
+
+
+def _load_wav(file_path):
+    from mutagen.wave import WAVE
+    audio = WAVE(file_path)
+    return audio, audio.info
+
+
+def _load_aiff(file_path):
+    from mutagen.aiff import AIFF
+    audio = AIFF(file_path)
+    return audio, audio.info
+
+
+def _load_aac(file_path):
+    from mutagen.aac import AAC
+    from mutagen.id3 import ID3, ID3NoHeaderError
+    # mutagen's AAC type has no tag support, ADTS streams carry a plain ID3 header
+    try:
+        tags = ID3(file_path)
+    except ID3NoHeaderError:
+        tags = ID3()
+    try:
+        info = AAC(file_path).info
+    except Exception:
+        info = None
+    return tags, info
+
+
+def _read_aac(handler, tags):
+    return _id3_fields(handler, tags), _id3_cover(tags)
+
+
+def _sniff_mp3(header):
+    # MPEG audio frame sync with a layer set (layer bits 00 are ADTS AAC)
+    return len(header) >= 2 and header[0] == 0xFF and header[1] & 0xE0 == 0xE0 and header[1] & 0x06 != 0
+
+
+def _sniff_aac(header):
+    return header[:4] == b"ADIF" or (len(header) >= 2 and header[0] == 0xFF and header[1] & 0xF6 == 0xF0)
+
+
+# MP4/M4A
+
+def _load_m4a(file_path):
+    from mutagen.mp4 import MP4
+    audio = MP4(file_path)
+    return audio, audio.info
+
+
+def _read_m4a(handler, audio):
+    fields = {}
+    tags = audio.tags or {}
+    for mp4_tag, field in handler.tag_map.items():
+        value = tags.get(mp4_tag)
+        if value and len(value) > 0:
+            fields[field] = str(value[0])
+    covr = tags.get("covr")
+    cover = bytes(covr[0]) if covr and len(covr) > 0 else None
+    return fields, cover
+
+
+def _apply_m4a(handler, audio, fields, cover):
+    if audio.tags is None:
+        audio.add_tags()
+    for field, value in fields.items():
+        audio[handler.field_keys[field]] = value
+    if cover is not None:
+        from mutagen.mp4 import MP4Cover
+        imageformat = MP4Cover.FORMAT_JPEG if image_mime(cover) == "image/jpeg" else MP4Cover.FORMAT_PNG
+        audio["covr"] = [MP4Cover(cover, imageformat=imageformat)]
+
+
+# Vorbis comment formats (FLAC, Ogg Vorbis and Opus)
+
+def _vorbis_fields(handler, audio):
+    fields = {}
+    for vorbis_tag, field in handler.tag_map.items():
+        value = audio.get(vorbis_tag)
+        if value and len(value) > 0:
+            fields[field] = value[0]
+    return fields
+
+
+def _apply_vorbis_fields(handler, audio, fields):
+    if audio.tags is None:
+        audio.add_tags()
+    for field, value in fields.items():
+        audio[handler.field_keys[field]] = value
+
+
+def _cover_picture(cover):
+    from mutagen.flac import Picture
+    picture = Picture()
+    picture.type = 3  # Cover (front)
+    picture.mime = image_mime(cover)
+    picture.data = cover
+    return picture
+
+
+def _load_flac(file_path):
+    from mutagen.flac import FLAC
+    audio = FLAC(file_path)
+    return audio, audio.info
+
+
+def _read_flac(handler, audio):
+    cover = audio.pictures[0].data if audio.pictures else None
+    return _vorbis_fields(handler, audio), cover
+
+
+def _apply_flac(handler, audio, fields, cover):
+    _apply_vorbis_fields(handler, audio, fields)
+    if cover is not None:
+        audio.clear_pictures()
+        audio.add_picture(_cover_picture(cover))
+
+
+def _load_ogg(file_path):
+    from mutagen.oggvorbis import OggVorbis
+    audio = OggVorbis(file_path)
+    return audio, audio.info
+
+
+def _load_opus(file_path):
+    from mutagen.oggopus import OggOpus
+    audio = OggOpus(file_path)
+    return audio, audio.info
+
+
+def _read_ogg(handler, audio):
+    from mutagen.flac import Picture
+    cover = None
+    for value in audio.get("METADATA_BLOCK_PICTURE", []):
+        try:
+            cover = Picture(base64.b64decode(value)).data
+            break
+        except Exception:
+            continue
+    return _vorbis_fields(handler, audio), cover
+
+
+def _apply_ogg(handler, audio, fields, cover):
+    _apply_vorbis_fields(handler, audio, fields)
+    if cover is not None:
+        picture_data = _cover_picture(cover).write()
+        audio["METADATA_BLOCK_PICTURE"] = [base64.b64encode(picture_data).decode("ascii")]
+
+
+# APEv2 formats (WavPack and Monkey's Audio)
+
+def _read_apev2(handler, audio):
+    fields = {}
+    tags = audio.tags or {}
+    for ape_tag, field in handler.tag_map.items():
+        if ape_tag in tags:
+            fields[field] = str(tags[ape_tag])
+    cover = None
+    if APEV2_COVER_KEY in tags:
+        # Binary item: "<file name>\0<image data>"
+        cover = bytes(tags[APEV2_COVER_KEY].value).split(b"\x00", 1)[-1]
+    return fields, cover
+
+
+def _apply_apev2(handler, audio, fields, cover):
+    from mutagen.apev2 import APEValue, BINARY
+    if audio.tags is None:
+        audio.add_tags()
+    for field, value in fields.items():
+        audio[handler.field_keys[field]] = value
+    if cover is not None:
+        name = b"cover.jpg" if image_mime(cover) == "image/jpeg" else b"cover.png"
+        audio[APEV2_COVER_KEY] = APEValue(name + b"\x00" + cover, BINARY)
+
+
+def _load_wavpack(file_path):
+    from mutagen.wavpack import WavPack
+    audio = WavPack(file_path)
+    return audio, audio.info
+
+
+def _load_ape(file_path):
+    from mutagen.monkeysaudio import MonkeysAudio
+    audio = MonkeysAudio(file_path)
+    return audio, audio.info
+
+
+# Audio payload: where the audio data lies once every tag is left out, so
+# it can be hashed to find the same recording under different tags
+
+def _trailing_tags_start(fileobj, end):
+    """Offset where the ID3v1 and APEv2 tags at the end of a file begin."""
+    while True:
+        if end >= 128:
+            fileobj.seek(end - 128)
+            if fileobj.read(3) == b"TAG":
+                end -= 128
+                continue
+        if end >= 32:
+            fileobj.seek(end - 32)
+            footer = fileobj.read(32)
+            if footer[:8] == b"APETAGEX":
+                _version, size, _items, flags = struct.unpack("<IIII", footer[8:24])
+                # The size covers the items and footer, not the optional header
+                end -= size + (32 if flags & 0x80000000 else 0)
+                continue
+        return end
+
+
+def _stream_payload(fileobj, size):
+    # Raw streams (MP3, AAC, WavPack, APE): everything between leading and trailing tags
+    start = id3v2_size(fileobj.read(10))
+    end = _trailing_tags_start(fileobj, size)
+    return [(start, max(end - start, 0))]
+
+
+def _flac_payload(fileobj, size):
+    offset = id3v2_size(fileobj.read(10))
+    fileobj.seek(offset)
+    if fileobj.read(4) != b"fLaC":
+        raise ValueError("Not a FLAC stream")
+    offset += 4
+    while True:
+        header = fileobj.read(4)
+        if len(header) < 4:
+            raise ValueError("Truncated FLAC metadata")
+        offset += 4 + int.from_bytes(header[1:4], "big")
+        if header[0] & 0x80:
+            break
+        fileobj.seek(offset)
+    end = _trailing_tags_start(fileobj, size)
+    return [(offset, max(end - offset, 0))]
+
+
+def _mp4_payload(fileobj, size):
+    # Tags live in moov/udta, the audio in the top level mdat atoms
+    ranges = []
+    offset = 0
+    while offset + 8 <= size:
+        fileobj.seek(offset)
+        header = fileobj.read(16)
+        length, kind = struct.unpack(">I4s", header[:8])
+        header_size = 8
+        if length == 1:
+            length = struct.unpack(">Q", header[8:16])[0]
+            header_size = 16
+        elif length == 0:
+            length = size - offset
+        if length < header_size:
+            raise ValueError("Invalid MP4 atom size")
+        if kind == b"mdat":
+            ranges.append((offset + header_size, min(length, size - offset) - header_size))
+        offset += length
+    return ranges
+
+
+def _iff_payload(chunk_id, byteorder):
+    # RIFF (WAV) and IFF (AIFF) files: the chunk holding the samples
+    def payload(fileobj, size):
+        offset = 12
+        while offset + 8 <= size:
+            fileobj.seek(offset)
+            header = fileobj.read(8)
+            length = int.from_bytes(header[4:8], byteorder)
+            if header[:4] == chunk_id:
+                return [(offset + 8, min(length, size - offset - 8))]
+            offset += 8 + length + (length & 1)
+        raise ValueError(f"No {chunk_id.decode()} chunk")
+    return payload
+
+
+def _ogg_payload(header_packets):
+    # The comment is one of the header packets; saving it renumbers the pages
+    # after it, so only the bodies of the audio pages are payload
+    def payload(fileobj, size):
+        ranges = []
+        packets = 0
+        offset = 0
+        while offset + 27 <= size:
+            fileobj.seek(offset)
+            header = fileobj.read(27)
+            if header[:4] != b"OggS":
+                raise ValueError("Lost Ogg page sync")
+            lacing = fileobj.read(header[26])
+            body_offset = offset + 27 + len(lacing)
+            body_size = sum(lacing)
+            if packets >= header_packets:
+                ranges.append((body_offset, body_size))
+            else:
+                packets += sum(1 for value in lacing if value < 255)
+            offset = body_offset + body_size
+        return ranges
+    return payload
+
+
+# Sniffing order matters only for ambiguous headers: containers first, raw MPEG streams last
+register_handler(FormatHandler("flac", [".flac"], VORBIS_TAG_MAP, _load_flac, _read_flac, _apply_flac,
+                               sniff=lambda h: h[:4] == b"fLaC", payload=_flac_payload))
+register_handler(FormatHandler("ogg", [".ogg", ".oga"], VORBIS_TAG_MAP, _load_ogg, _read_ogg, _apply_ogg,
+                               sniff=lambda h: h[:4] == b"OggS" and b"\x01vorbis" in h,
+                               payload=_ogg_payload(3)))
+register_handler(FormatHandler("opus", [".opus"], VORBIS_TAG_MAP, _load_opus, _read_ogg, _apply_ogg,
+                               sniff=lambda h: h[:4] == b"OggS" and b"OpusHead" in h,
+                               payload=_ogg_payload(2)))
+register_handler(FormatHandler("m4a", [".m4a", ".mp4", ".m4b"], MP4_TAG_MAP, _load_m4a, _read_m4a, _apply_m4a,
+                               sniff=lambda h: h[4:8] == b"ftyp", payload=_mp4_payload))
+register_handler(FormatHandler("wav", [".wav"], ID3_TAG_MAP, _load_wav, _read_id3_file, _apply_id3_file,
+                               sniff=lambda h: h[:4] == b"RIFF" and h[8:12] == b"WAVE",
+                               payload=_iff_payload(b"data", "little")))
+register_handler(FormatHandler("aiff", [".aiff", ".aif"], ID3_TAG_MAP, _load_aiff, _read_id3_file,
+                               _apply_id3_file,
+                               sniff=lambda h: h[:4] == b"FORM" and h[8:12] in (b"AIFF", b"AIFC"),
+                               payload=_iff_payload(b"SSND", "big")))
+register_handler(FormatHandler("wavpack", [".wv"], APEV2_TAG_MAP, _load_wavpack, _read_apev2, _apply_apev2,
+                               sniff=lambda h: h[:4] == b"wvpk", payload=_stream_payload, padding=False))
+register_handler(FormatHandler("ape", [".ape"], APEV2_TAG_MAP, _load_ape, _read_apev2, _apply_apev2,
+                               sniff=lambda h: h[:4] == b"MAC ", payload=_stream_payload, padding=False))
+register_handler(FormatHandler("aac", [".aac"], ID3_TAG_MAP, _load_aac, _read_aac, _apply_id3,
+                               sniff=_sniff_aac, payload=_stream_payload))
+register_handler(FormatHandler("mp3", [".mp3"], ID3_TAG_MAP, _load_mp3, _read_id3_file, _apply_id3_file,
+                               sniff=_sniff_mp3, payload=_stream_payload))
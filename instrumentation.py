@@ -0,0 +1,323 @@
+"""Opt-in timing of the tag read/write hot paths.
+
+Code wraps its expensive steps in ``with stage(name, format, path):``.
+While instrumentation is off (the default) that costs one function call;
+once ``enable()`` is called every stage feeds a latency histogram per
+(stage, format), failures are counted per format, and with a trace file
+every stage is also written out as an event.
+
+Stages: "parse" (opening and parsing a file), "extract" (reading the
+editor fields out of the parsed tags), "thumbnail" (decoding cover art
+for a preview), "encode" (re-encoding cover art before embedding) and
+"save" (writing the tags back and flushing the file).
+
+Trace files ending in ``.jsonl`` get one JSON event per line, anything
+else is written in the Chrome trace event format (open it in
+chrome://tracing or https://ui.perfetto.dev).
+"""
+import os
+import sys
+import json
+import time
+import atexit
+import threading
+from collections import Counter
+
+
+# AUDIO_TAG_TRACE=<file> turns instrumentation on for the GUI and batch mode
+ENV_VAR = "AUDIO_TAG_TRACE"
+
+# Events kept in memory before they are written to the trace file
+FLUSH_EVERY = 1000
+
+_enabled = False
+_lock = threading.Lock()
+_histograms = {}
+_counters = Counter()
+_events = []
+_trace = None
+# Workers hand their events back to the parent instead of writing a file
+_keep_events = False
+
+
+class Histogram:
+    """Latency histogram with power-of-two microsecond buckets."""
+
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.buckets = Counter()
+
+    def add(self, seconds, error=False):
+        self.count += 1
+        self.errors += error
+        self.total += seconds
+        self.max = max(self.max, seconds)
+        # Bucket b holds durations below 2**b microseconds
+        self.buckets[int(seconds * 1e6).bit_length()] += 1
+
+    def percentile(self, fraction):
+        """Upper bound in seconds of the bucket holding the given fraction of samples."""
+        if not self.count:
+            return 0.0
+        wanted = fraction * self.count
+        seen = 0
+        for bucket in sorted(self.buckets):
+            seen += self.buckets[bucket]
+            if seen >= wanted:
+                return min(2 ** bucket / 1e6, self.max)
+        return self.max
+
+    def merge(self, other):
+        self.count += other.count
+        self.errors += other.errors
+        self.total += other.total
+        self.max = max(self.max, other.max)
+        self.buckets.update(other.buckets)
+
+    def to_dict(self):
+        return {
+            "count": self.count,
+            "errors": self.errors,
+            "total_seconds": self.total,
+            "max_seconds": self.max,
+            "p50_seconds": self.percentile(0.5),
+            "p95_seconds": self.percentile(0.95),
+            "p99_seconds": self.percentile(0.99),
+            # Bucket upper bounds in microseconds
+            "buckets": {str(2 ** bucket): n for bucket, n in sorted(self.buckets.items())},
+        }
+
+
+class _Stage:
+    __slots__ = ("name", "format", "path", "start")
+
+    def __init__(self, name, format, path):
+        self.name = name
+        self.format = format
+        self.path = path
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        _record(self.name, self.format, self.path, self.start, time.perf_counter() - self.start, exc)
+        return False
+
+
+class _NoStage:
+    # Shared stand-in while instrumentation is off; attributes set on it are ignored
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+    def __setattr__(self, name, value):
+        pass
+
+
+_NO_STAGE = _NoStage()
+
+
+def enabled():
+    return _enabled
+
+
+def stage(name, format=None, path=None):
+    """Context manager timing one stage of work on ``path``.
+
+    The format can be filled in later through the ``format`` attribute of
+    the returned object, e.g. once a file's type has been sniffed.
+    """
+    if not _enabled:
+        return _NO_STAGE
+    return _Stage(name, format, path)
+
+
+def count(name, format=None, n=1):
+    if _enabled:
+        with _lock:
+            _counters[(name, format)] += n
+
+
+def _record(name, format, path, start, seconds, exc):
+    with _lock:
+        histogram = _histograms.get((name, format))
+        if histogram is None:
+            histogram = _histograms[(name, format)] = Histogram()
+        histogram.add(seconds, exc is not None)
+        if exc is not None:
+            _counters[("errors", format)] += 1
+        if _trace is None and not _keep_events:
+            return
+        event = {"stage": name, "format": format, "path": path, "start": start, "seconds": seconds,
+                 "pid": os.getpid(), "tid": threading.get_ident()}
+        if exc is not None:
+            event["error"] = f"{type(exc).__name__}: {exc}"
+        _events.append(event)
+        if _trace is not None and len(_events) >= FLUSH_EVERY:
+            _flush()
+
+
+class _TraceWriter:
+    def __init__(self, path):
+        self.chrome = not path.endswith(".jsonl")
+        self.file = open(path, "w", encoding="utf-8")
+        self.first = True
+        if self.chrome:
+            # The JSON array form of the trace format, written as events come in
+            self.file.write("[\n")
+        # Nothing may sit in the buffer when workers fork, they would write it again
+        self.file.flush()
+
+    def write(self, event):
+        if not self.chrome:
+            self.file.write(json.dumps(event) + "\n")
+            return
+        args = {"path": event["path"]}
+        if "error" in event:
+            args["error"] = event["error"]
+        chrome_event = {"name": event["stage"], "cat": event["format"] or "", "ph": "X",
+                        "ts": event["start"] * 1e6, "dur": event["seconds"] * 1e6,
+                        "pid": event["pid"], "tid": event["tid"], "args": args}
+        self.file.write(("" if self.first else ",\n") + json.dumps(chrome_event))
+        self.first = False
+
+    def close(self):
+        if self.chrome:
+            self.file.write("\n]\n")
+        self.file.close()
+
+
+def _flush():
+    # Called with the lock held
+    for event in _events:
+        _trace.write(event)
+    _events.clear()
+    _trace.file.flush()
+
+
+def enable(trace_path=None):
+    """Start collecting stage timings, and write every stage to ``trace_path`` if given."""
+    global _enabled, _trace
+    with _lock:
+        if trace_path and _trace is None:
+            _trace = _TraceWriter(trace_path)
+        _enabled = True
+
+
+def enable_worker(keep_events):
+    """Process pool initializer: start with empty statistics in a worker process.
+
+    Forked workers inherit the parent's statistics, which would otherwise
+    be counted twice once the worker's snapshot is merged back.
+    """
+    global _enabled, _trace, _keep_events
+    with _lock:
+        _histograms.clear()
+        _counters.clear()
+        _events.clear()
+        _trace = None
+        _keep_events = keep_events
+        _enabled = True
+
+
+def tracing():
+    return _trace is not None
+
+
+def enable_from_environment():
+    """Turn instrumentation on when AUDIO_TAG_TRACE names a trace file.
+
+    The statistics are printed to stderr, and the trace closed, at exit.
+    """
+    path = os.environ.get(ENV_VAR)
+    if path and not _enabled:
+        enable(path)
+        atexit.register(finish)
+        return True
+    return False
+
+
+def take_snapshot():
+    """Return and reset everything recorded so far, in a picklable form.
+
+    Worker processes send this back with their results and the parent
+    merges it with ``merge_snapshot``.
+    """
+    with _lock:
+        snapshot = (dict(_histograms), Counter(_counters), list(_events))
+        _histograms.clear()
+        _counters.clear()
+        _events.clear()
+    return snapshot
+
+
+def merge_snapshot(snapshot):
+    histograms, counters, events = snapshot
+    with _lock:
+        for key, other in histograms.items():
+            histogram = _histograms.get(key)
+            if histogram is None:
+                histogram = _histograms[key] = Histogram()
+            histogram.merge(other)
+        _counters.update(counters)
+        if _trace is not None:
+            _events.extend(events)
+            if len(_events) >= FLUSH_EVERY:
+                _flush()
+
+
+def stats():
+    """Return the histograms and counters as a JSON-serializable dict."""
+    with _lock:
+        histograms = {f"{name}/{format or '-'}": histogram.to_dict()
+                      for (name, format), histogram in sorted(_histograms.items(), key=_sort_key)}
+        counters = {f"{name}/{format or '-'}": n
+                    for (name, format), n in sorted(_counters.items(), key=_sort_key)}
+    return {"stages": histograms, "counters": counters}
+
+
+def _sort_key(item):
+    name, format = item[0]
+    return name, format or ""
+
+
+def report():
+    """Return the statistics as a text table, slowest stages (by total time) first."""
+    with _lock:
+        stages = sorted(_histograms.items(), key=lambda item: -item[1].total)
+        counters = dict(_counters)
+    lines = [f"{'stage':<10} {'format':<8} {'count':>7} {'errors':>6} {'total s':>9} "
+             f"{'mean ms':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'max ms':>8}"]
+    for (name, format), h in stages:
+        lines.append(f"{name:<10} {format or '-':<8} {h.count:>7} {h.errors:>6} {h.total:>9.3f} "
+                     f"{h.total / h.count * 1000:>8.2f} {h.percentile(0.5) * 1000:>8.2f} "
+                     f"{h.percentile(0.95) * 1000:>8.2f} {h.percentile(0.99) * 1000:>8.2f} "
+                     f"{h.max * 1000:>8.2f}")
+    formats = sorted({format or "-" for _name, format in counters})
+    if formats:
+        names = ["loads", "saves", "in_place", "rewrites", "errors"]
+        lines.append("")
+        lines.append(f"{'format':<8} " + " ".join(f"{name:>9}" for name in names))
+        for format in formats:
+            key = None if format == "-" else format
+            lines.append(f"{format:<8} " + " ".join(f"{counters.get((name, key), 0):>9}" for name in names))
+    return "\n".join(lines) + "\n"
+
+
+def finish(output=sys.stderr):
+    """Close the trace file and write the statistics table to ``output`` (if any)."""
+    global _trace, _enabled
+    with _lock:
+        if _trace is not None:
+            _flush()
+            _trace.close()
+            _trace = None
+    if output is not None and _enabled:
+        output.write(report())
+    _enabled = False
@@ -0,0 +1,373 @@
+"""An append-only journal of the values batch saves replace, so a batch can be undone.
+
+Every journaled save run is a batch: a directory holding ``batch.json``
+and one JSON lines segment per process that wrote files.  A record
+holds only the fields that changed, with their old and new values.
+Replaced cover art is stored once per distinct image under ``covers/``,
+keyed by its SHA-1.  The records for a group of files are written and
+fsynced together before any of those files is saved, so an interrupted
+run never leaves a file changed without its old values on disk.
+"""
+import os
+import sys
+import json
+import time
+import uuid
+import shutil
+import hashlib
+import argparse
+
+import batch
+
+
+DEFAULT_JOURNAL_DIR = os.path.join(os.path.expanduser("~"), ".audio_tag_editor", "journal")
+
+COVERS_DIR = "covers"
+BATCH_FILE = "batch.json"
+
+# File times can trail time.time() by a clock tick, or by 2 seconds on FAT
+CLOCK_SLACK = 2
+
+
+def _write_file(path, data):
+    # Written to a temporary name and renamed, so a crash leaves the old file or the new one
+    temp_path = f"{path}.{os.getpid()}.tmp"
+    with open(temp_path, "wb") as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temp_path, path)
+
+
+def begin(description, root=DEFAULT_JOURNAL_DIR):
+    """Start a batch and return its directory, which is passed on to whatever saves files."""
+    batch_id = f"{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:6]}"
+    batch_dir = os.path.join(root, batch_id)
+    os.makedirs(batch_dir)
+    info = {"id": batch_id, "description": description, "started": time.time(), "finished": None}
+    _write_file(os.path.join(batch_dir, BATCH_FILE), json.dumps(info).encode("utf-8"))
+    return batch_dir
+
+
+def finish(batch_dir):
+    """Mark a batch complete; a batch that changed no file is removed.  Returns whether it was kept.
+
+    The number of files and the covers the batch uses are noted in
+    ``batch.json``, so listing and pruning don't read its records again.
+    """
+    if not _segments(batch_dir):
+        shutil.rmtree(batch_dir, ignore_errors=True)
+        return False
+    records = read_records(batch_dir)
+    info = read_info(batch_dir)
+    info["finished"] = time.time()
+    info["files"] = len({record["path"] for record in records})
+    info["covers"] = sorted(_cover_keys(records))
+    _write_file(os.path.join(batch_dir, BATCH_FILE), json.dumps(info).encode("utf-8"))
+    return True
+
+
+def read_info(batch_dir):
+    with open(os.path.join(batch_dir, BATCH_FILE), encoding="utf-8") as f:
+        return json.load(f)
+
+
+def _segments(batch_dir):
+    try:
+        return sorted(os.path.join(batch_dir, name) for name in os.listdir(batch_dir) if name.endswith(".jsonl"))
+    except OSError:
+        return []
+
+
+class Segment:
+    """Collects the records of one process and appends them to the batch with a single fsync.
+
+    ``record`` before saving a file, ``sync`` once the records of a
+    group of files are collected, then save the files.
+    """
+
+    def __init__(self, batch_dir):
+        self.batch_dir = batch_dir
+        self.covers_dir = os.path.join(os.path.dirname(os.path.abspath(batch_dir)), COVERS_DIR)
+        self.path = os.path.join(batch_dir, f"{os.getpid()}.jsonl")
+        self.lines = []
+
+    def record(self, tag_file, fields, cover=None):
+        """Note the values a save of ``tag_file`` will replace; returns False when nothing would change."""
+        if tag_file.changed_on_disk():
+            # The save would reload it too, record the values it will actually replace
+            tag_file.load()
+        changed, cover_changed = tag_file.changes(fields, cover)
+        if not changed and not cover_changed:
+            return False
+        entry = {
+            "path": os.path.abspath(tag_file.path),
+            "time": time.time(),
+            "old": {field: tag_file.fields.get(field, "") for field in changed},
+            "new": changed,
+        }
+        if cover_changed:
+            entry["old_cover"] = self.store_cover(tag_file.cover)
+            entry["new_cover"] = self.store_cover(cover)
+        self.lines.append(json.dumps(entry, ensure_ascii=False))
+        return True
+
+    def store_cover(self, data):
+        """Keep a copy of cover art in the journal; returns its key, None for no cover."""
+        if not data:
+            return None
+        key = hashlib.sha1(data).hexdigest()
+        path = os.path.join(self.covers_dir, key[:2], key)
+        try:
+            # Touched even when it's already stored, prune keeps covers newer than a running batch
+            os.utime(path)
+        except FileNotFoundError:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            _write_file(path, data)
+        return key
+
+    def sync(self):
+        """Append the collected records and fsync them, once for the whole group."""
+        if not self.lines:
+            return
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write("\n".join(self.lines) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        self.lines = []
+
+
+def cover_path(batch_dir, key):
+    return os.path.join(os.path.dirname(os.path.abspath(batch_dir)), COVERS_DIR, key[:2], key)
+
+
+def read_records(batch_dir):
+    """Return the records of a batch in the order they were written."""
+    records = []
+    for segment in _segments(batch_dir):
+        with open(segment, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    records.append(json.loads(line))
+                except ValueError:
+                    # A line cut short by a crash; its file was never saved
+                    continue
+    records.sort(key=lambda record: record["time"])
+    return records
+
+
+def _cover_keys(records):
+    return {key for record in records for key in (record.get("old_cover"), record.get("new_cover")) if key}
+
+
+def _changes_by_file(records):
+    """Fold the records of a batch into {path: (old, new, old_cover, new_cover)}.
+
+    A file edited more than once keeps its values from before its first
+    edit as ``old`` and those after its last edit as ``new``.  The cover
+    keys are missing (not None) when the batch left the cover alone.
+    """
+    files = {}
+    for record in records:
+        old, new, covers = files.setdefault(record["path"], ({}, {}, {}))
+        for field, value in record["old"].items():
+            old.setdefault(field, value)
+        new.update(record["new"])
+        if "old_cover" in record:
+            covers.setdefault("old", record["old_cover"])
+            covers["new"] = record["new_cover"]
+    return files
+
+
+def undo_jobs(batch_dir, force=False):
+    """Return (jobs, covers_left): batch jobs putting back the values a batch replaced.
+
+    Unless ``force``, a file edited again since the batch is left alone
+    and reported as an error.  A file an interrupted batch never got to
+    still has its old values and is simply unchanged.  Cover art can be
+    put back but not taken away, so ``covers_left`` lists files the batch
+    gave their first cover.
+    """
+    records = read_records(batch_dir)
+    # Records are synced before their files are saved, so a field may hold
+    # the value it had before the batch or any value the batch wrote.  The
+    # same goes for the cover, by key
+    accepted = {}
+    accepted_covers = {}
+    for record in records:
+        values = accepted.setdefault(record["path"], {})
+        for field, value in record["new"].items():
+            values.setdefault(field, [record["old"].get(field, "")]).append(value)
+        if "old_cover" in record:
+            accepted_covers.setdefault(record["path"], [record["old_cover"]]).append(record["new_cover"])
+    jobs, covers_left = [], []
+    for path, (old, _new, covers) in _changes_by_file(records).items():
+        job = {"path": path, "fields": old, "cover": None}
+        if "old" in covers:
+            if covers["old"] is None:
+                covers_left.append(path)
+            else:
+                job["cover"] = cover_path(batch_dir, covers["old"])
+        if not force:
+            job["expect"] = accepted[path]
+            if path in accepted_covers:
+                job["expect_cover"] = accepted_covers[path]
+        if job["fields"] or job["cover"]:
+            jobs.append(job)
+    return jobs, covers_left
+
+
+def replay_jobs(batch_dir):
+    """Return batch jobs writing a batch's new values again, e.g. after an undo or to finish an interrupted run."""
+    jobs = []
+    for path, (_old, new, covers) in _changes_by_file(read_records(batch_dir)).items():
+        cover = covers.get("new")
+        jobs.append({"path": path, "fields": new, "cover": cover_path(batch_dir, cover) if cover else None})
+    return jobs
+
+
+def list_batches(root=DEFAULT_JOURNAL_DIR):
+    """Return (batch_dir, info, file_count) for every batch, oldest first."""
+    batches = []
+    try:
+        names = [name for name in os.listdir(root) if name != COVERS_DIR]
+    except OSError:
+        return []
+    for name in names:
+        batch_dir = os.path.join(root, name)
+        try:
+            info = read_info(batch_dir)
+        except (OSError, ValueError):
+            continue
+        files = info.get("files")
+        if files is None:
+            # Not finished, so not counted yet
+            files = len({record["path"] for record in read_records(batch_dir)})
+        batches.append((batch_dir, info, files))
+    # Ids only have second resolution, batches started within a second are ordered by their start time
+    batches.sort(key=lambda entry: entry[1]["started"])
+    return batches
+
+
+def find_batch(batch_id, root=DEFAULT_JOURNAL_DIR):
+    """Return the directory of a batch by id, a unique id prefix, or "last"."""
+    batches = [batch_dir for batch_dir, _info, _files in list_batches(root)]
+    if batch_id == "last":
+        matches = batches[-1:]
+    else:
+        matches = [batch_dir for batch_dir in batches if os.path.basename(batch_dir).startswith(batch_id)]
+    if len(matches) != 1:
+        raise ValueError(f"No batch {batch_id!r} in {root}" if not matches else f"Batch id {batch_id!r} is ambiguous")
+    return matches[0]
+
+
+def prune(keep, root=DEFAULT_JOURNAL_DIR, interrupted=False):
+    """Delete all but the newest ``keep`` finished batches and the stored covers no remaining batch uses.
+
+    A batch that hasn't finished may still be running, so it's kept, along
+    with every cover stored since it started.  With ``interrupted`` such
+    batches are deleted like the others; only pass it when none is running.
+    """
+    batches = list_batches(root)
+    running = [] if interrupted else [(batch_dir, info) for batch_dir, info, _files in batches if not info["finished"]]
+    finished = [batch_dir for batch_dir, info, _files in batches if interrupted or info["finished"]]
+    removed = set(finished[:max(0, len(finished) - keep)])
+    for batch_dir in removed:
+        shutil.rmtree(batch_dir, ignore_errors=True)
+    used = set()
+    for batch_dir, info, _files in batches:
+        if batch_dir in removed:
+            continue
+        if "covers" in info:
+            used.update(info["covers"])
+        else:
+            used.update(_cover_keys(read_records(batch_dir)))
+    # A running batch stores a cover before the record naming it is synced
+    since = min((info["started"] - CLOCK_SLACK for _batch_dir, info in running), default=None)
+    for directory, _dirs, names in os.walk(os.path.join(root, COVERS_DIR)):
+        for name in names:
+            path = os.path.join(directory, name)
+            if name in used or (since is not None and os.path.getmtime(path) >= since):
+                continue
+            os.remove(path)
+    return len(removed)
+
+
+def run_journaled(jobs, description, root=DEFAULT_JOURNAL_DIR, workers=None, on_result=None):
+    """Run batch jobs in a new journaled batch; returns (summary, batch_dir or None when nothing changed)."""
+    batch_dir = begin(description, root)
+    try:
+        summary = batch.run_batch(jobs, workers=workers, on_result=on_result, journal=batch_dir)
+    finally:
+        kept = finish(batch_dir)
+    return summary, batch_dir if kept else None
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="main.py journal",
+                                     description="List, undo or replay journaled batches of tag edits.")
+    parser.add_argument("--dir", default=DEFAULT_JOURNAL_DIR, help=f"Journal directory (default: {DEFAULT_JOURNAL_DIR})")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("list", help="List journaled batches")
+    show = commands.add_parser("show", help="Show the changes a batch made")
+    show.add_argument("batch", help='Batch id, a unique prefix of one, or "last"')
+    undo = commands.add_parser("undo", help="Put back the values a batch replaced")
+    undo.add_argument("batch", help='Batch id, a unique prefix of one, or "last"')
+    undo.add_argument("--force", action="store_true", help="Also undo files edited again since the batch")
+    undo.add_argument("--workers", type=int, default=None, help="Worker processes (default: CPU count)")
+    replay = commands.add_parser("replay", help="Write a batch's new values again")
+    replay.add_argument("batch", help='Batch id, a unique prefix of one, or "last"')
+    replay.add_argument("--workers", type=int, default=None, help="Worker processes (default: CPU count)")
+    prune_parser = commands.add_parser("prune", help="Delete old batches")
+    prune_parser.add_argument("--keep", type=int, default=50, help="Newest batches to keep (default: 50)")
+    prune_parser.add_argument("--interrupted", action="store_true",
+                              help="Also delete batches that never finished; only use when no batch is running")
+    return parser
+
+
+def _print_error(result):
+    if result["status"] == "error":
+        print(f"error     {result['path']}: {result['error']}", file=sys.stderr)
+
+
+def main(argv):
+    args = build_parser().parse_args(argv)
+    if args.command == "list":
+        for batch_dir, info, files in list_batches(args.dir):
+            state = "" if info["finished"] else " (interrupted)"
+            started = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(info["started"]))
+            print(f"{info['id']}  {started}  {files:>6} files  {info['description']}{state}")
+        return 0
+    if args.command == "prune":
+        print(f"Removed {prune(args.keep, args.dir, args.interrupted)} batches")
+        return 0
+    try:
+        batch_dir = find_batch(args.batch, args.dir)
+    except ValueError as e:
+        print(f"Error: {e}", file=sys.stderr)
+        return 2
+    batch_id = os.path.basename(batch_dir)
+
+    if args.command == "show":
+        for path, (old, new, covers) in _changes_by_file(read_records(batch_dir)).items():
+            print(path)
+            for field in new:
+                print(f"    {field}: {old.get(field, '')!r} -> {new[field]!r}")
+            if "old" in covers:
+                print(f"    cover: {covers['old'] or 'none'} -> {covers['new']}")
+        return 0
+
+    if args.command == "undo":
+        jobs, covers_left = undo_jobs(batch_dir, args.force)
+        description = f"undo {batch_id}"
+    else:
+        jobs, covers_left = replay_jobs(batch_dir), []
+        description = f"replay {batch_id}"
+    summary, new_batch = run_journaled(jobs, description, args.dir, args.workers, _print_error)
+    print(f"{summary['files']} files: {summary['written']} written, {summary['unchanged']} unchanged, "
+          f"{summary['errors']} errors in {summary['seconds']:.2f}s")
+    if covers_left:
+        print(f"{len(covers_left)} files had no cover art before the batch; the cover it added was left in place")
+    if new_batch:
+        print(f"Journaled as {os.path.basename(new_batch)}")
+    return 1 if summary["errors"] else 0
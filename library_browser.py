@@ -0,0 +1,328 @@
+import os
+import time
+import tkinter as tk
+from tkinter import filedialog, ttk
+from collections import OrderedDict
+
+import library_index
+from background import BackgroundRunner
+
+
+class LibraryBrowser:
+    """A window listing the tracks of the library index, however many there are.
+
+    Only the ids of the matching tracks are kept, in sort order; the
+    table holds just the rows on screen, and those are read from the
+    index a page at a time as the list scrolls.  Filtering and sorting
+    run in SQLite on indexed columns, on a background thread so typing
+    never waits for a query.  Opening rows shows them in the editor.
+    """
+
+    VISIBLE_ROWS = 25
+    PAGE_SIZE = 200
+    CACHED_PAGES = 50
+    # Milliseconds of typing pause before the filter is applied
+    FILTER_DELAY = 50
+
+    # (column, heading, width); the columns in SORT_ORDERS can be sorted on
+    COLUMNS = [
+        ("artist", "Artist", 150),
+        ("album", "Album", 150),
+        ("title", "Title", 200),
+        ("genre", "Genre", 90),
+        ("year", "Year", 50),
+        ("format", "Format", 60),
+        ("duration", "Length", 60),
+    ]
+
+    def __init__(self, editor, db_path=library_index.DEFAULT_DB_PATH):
+        self.editor = editor
+        self.db_path = db_path
+        self.index = library_index.LibraryIndex(db_path)
+        self.ids = []
+        self.top = 0
+        self.selected = set()
+        self.sort = "artist"
+        self.descending = False
+        self.pages = OrderedDict()
+        self.filter_job = None
+        self.query_task = None
+        self.scan_task = None
+        # Queries get a thread of their own, so typing never waits behind a
+        # scan or the editor's file I/O
+        self.query_runner = BackgroundRunner(editor.root, max_workers=1)
+
+        self.window = tk.Toplevel(editor.root)
+        self.window.title("Library")
+        self.window.protocol("WM_DELETE_WINDOW", self.close)
+
+        tk.Label(self.window, text="Filter:").grid(row=0, column=0, sticky="e", padx=5, pady=5)
+        self.filter_text = tk.StringVar()
+        self.filter_text.trace_add("write", lambda *args: self.schedule_filter())
+        self.filter_entry = tk.Entry(self.window, textvariable=self.filter_text, width=40)
+        self.filter_entry.grid(row=0, column=1, sticky="we", padx=5)
+        self.scan_button = tk.Button(self.window, text="Scan Folder", command=self.choose_scan_folder)
+        self.scan_button.grid(row=0, column=2, padx=5)
+
+        columns = [column for column, _heading, _width in self.COLUMNS]
+        self.tree = ttk.Treeview(self.window, columns=columns, show="headings", height=self.VISIBLE_ROWS)
+        for column, heading, width in self.COLUMNS:
+            self.tree.heading(column, text=heading)
+            self.tree.column(column, width=width, stretch=column in ("artist", "album", "title"))
+            if column in library_index.SORT_ORDERS:
+                self.tree.heading(column, command=lambda column=column: self.sort_by(column))
+        self.show_sort()
+        self.tree.grid(row=1, column=0, columnspan=3, sticky="nsew", padx=(5, 0))
+        # The tree only ever holds the visible rows, so it's scrolled by hand
+        self.scrollbar = ttk.Scrollbar(self.window, orient="vertical", command=self.on_scrollbar)
+        self.scrollbar.grid(row=1, column=3, sticky="ns", padx=(0, 5))
+
+        self.tree.bind("<<TreeviewSelect>>", self.on_select)
+        self.tree.bind("<Double-1>", lambda event: self.open_selected())
+        self.tree.bind("<Return>", lambda event: self.open_selected())
+        self.tree.bind("<MouseWheel>", self.on_mouse_wheel)
+        self.tree.bind("<Button-4>", lambda event: self.scroll_by(-3))
+        self.tree.bind("<Button-5>", lambda event: self.scroll_by(3))
+        self.tree.bind("<Up>", lambda event: self.move_focus(-1))
+        self.tree.bind("<Down>", lambda event: self.move_focus(1))
+        self.tree.bind("<Prior>", lambda event: self.scroll_by(-self.VISIBLE_ROWS))
+        self.tree.bind("<Next>", lambda event: self.scroll_by(self.VISIBLE_ROWS))
+
+        self.status = tk.Label(self.window, text="", anchor="w")
+        self.status.grid(row=2, column=0, columnspan=2, sticky="we", padx=5)
+        self.open_button = tk.Button(self.window, text="Open in Editor", command=self.open_selected)
+        self.open_button.grid(row=2, column=2, pady=5)
+        self.window.columnconfigure(1, weight=1)
+
+        self.apply_filter()
+        self.filter_entry.focus_set()
+
+    def schedule_filter(self):
+        # Wait for a pause in typing so each keystroke doesn't run a query
+        if self.filter_job is not None:
+            self.window.after_cancel(self.filter_job)
+        self.filter_job = self.window.after(self.FILTER_DELAY, self.apply_filter)
+
+    def apply_filter(self, keep_position=False):
+        self.filter_job = None
+        text = self.filter_text.get().strip()
+        # A newer query supersedes one still running, which is then interrupted
+        self.query_task = self.query_runner.submit(
+            query_ids, self.db_path, text or None, self.sort, self.descending, key="library-query",
+            on_done=lambda result: self.show_ids(result, text, keep_position), on_error=self.on_query_error)
+
+    def show_ids(self, result, text, keep_position):
+        self.query_task = None
+        if not self.window.winfo_exists():
+            return
+        self.ids, elapsed = result
+        self.pages.clear()
+        if not keep_position:
+            self.top = 0
+        if self.ids or text:
+            self.status.config(text=f"{len(self.ids)} tracks ({elapsed:.0f} ms)")
+        else:
+            self.status.config(text="The library index is empty, scan a folder to fill it.")
+        self.scroll_to(self.top, force=True)
+
+    def on_query_error(self, error):
+        self.query_task = None
+        print(f"Error querying the library index: {error}")
+        if self.window.winfo_exists():
+            self.status.config(text=f"Query failed: {error}")
+
+    def reload(self):
+        """Query the index again, e.g. after files were rescanned, staying at the same place in the list."""
+        self.apply_filter(keep_position=True)
+
+    def sort_by(self, column):
+        self.descending = not self.descending if column == self.sort else False
+        self.sort = column
+        self.show_sort()
+        self.apply_filter()
+
+    def show_sort(self):
+        for column, heading, _width in self.COLUMNS:
+            arrow = (" ▼" if self.descending else " ▲") if column == self.sort else ""
+            self.tree.heading(column, text=heading + arrow)
+
+    def rows(self, start, end):
+        """Return {rowid: row} for positions start..end of the list, reading uncached pages."""
+        rows = {}
+        for page in range(start // self.PAGE_SIZE, (end - 1) // self.PAGE_SIZE + 1):
+            cached = self.pages.get(page)
+            if cached is None:
+                ids = self.ids[page * self.PAGE_SIZE:(page + 1) * self.PAGE_SIZE]
+                cached = self.index.rows_by_id(ids)
+                self.pages[page] = cached
+                if len(self.pages) > self.CACHED_PAGES:
+                    self.pages.popitem(last=False)
+            else:
+                self.pages.move_to_end(page)
+            rows.update(cached)
+        return rows
+
+    def values(self, row):
+        if row is None:
+            # Removed from the index since the list was queried
+            return [""] * len(self.COLUMNS)
+        values = []
+        for column, _heading, _width in self.COLUMNS:
+            value = row[column]
+            if column == "duration" and value is not None:
+                value = f"{int(value) // 60}:{int(value) % 60:02d}"
+            values.append("" if value is None else value)
+        return values
+
+    def scroll_to(self, top, force=False):
+        top = max(0, min(top, len(self.ids) - self.VISIBLE_ROWS))
+        if top == self.top and not force:
+            return
+        self.top = top
+        visible = self.ids[top:top + self.VISIBLE_ROWS]
+        rows = self.rows(top, top + len(visible)) if visible else {}
+        self.tree.delete(*self.tree.get_children())
+        for rowid in visible:
+            self.tree.insert("", tk.END, iid=str(rowid), values=self.values(rows.get(rowid)))
+        self.tree.selection_set([str(rowid) for rowid in visible if rowid in self.selected])
+        total = len(self.ids)
+        if total:
+            self.scrollbar.set(top / total, (top + len(visible)) / total)
+        else:
+            self.scrollbar.set(0, 1)
+
+    def scroll_by(self, rows):
+        self.scroll_to(self.top + rows)
+        return "break"
+
+    def on_scrollbar(self, action, amount, unit=None):
+        if action == "moveto":
+            self.scroll_to(int(float(amount) * len(self.ids)))
+        elif unit == "pages":
+            self.scroll_by(int(amount) * self.VISIBLE_ROWS)
+        else:
+            self.scroll_by(int(amount))
+
+    def on_mouse_wheel(self, event):
+        # Windows reports multiples of 120, macOS small steps
+        steps = event.delta // 120 if abs(event.delta) >= 120 else event.delta
+        return self.scroll_by(-3 * steps)
+
+    def move_focus(self, step):
+        """Move the selection with the arrow keys, scrolling at the edges of the visible rows."""
+        items = self.tree.get_children()
+        if not items:
+            return "break"
+        focus = self.tree.focus()
+        position = self.top + (items.index(focus) if focus in items else 0) + step
+        if not 0 <= position < len(self.ids):
+            return "break"
+        if not self.top <= position < self.top + len(items):
+            self.scroll_to(self.top + step)
+        item = str(self.ids[position])
+        self.selected = {self.ids[position]}
+        self.tree.selection_set(item)
+        self.tree.focus(item)
+        return "break"
+
+    def on_select(self, event=None):
+        visible = set(self.ids[self.top:self.top + self.VISIBLE_ROWS])
+        self.selected = (self.selected - visible) | {int(item) for item in self.tree.selection()}
+
+    def selected_paths(self):
+        """Paths of the selected tracks, in list order."""
+        rows = self.index.rows_by_id(self.selected)
+        return [rows[rowid]["path"] for rowid in self.ids if rowid in rows]
+
+    def open_selected(self):
+        paths = [path for path in self.selected_paths() if os.path.exists(path)]
+        if not paths:
+            self.status.config(text="Select tracks that still exist to open them.")
+            return "break"
+        self.editor.open_files(paths)
+        return "break"
+
+    def choose_scan_folder(self):
+        folder = filedialog.askdirectory(title="Select a Folder to Add to the Library", parent=self.window)
+        if folder:
+            self.scan(folder)
+
+    def scan(self, folder):
+        self.scan_button.config(state="disabled")
+        self.status.config(text=f"Scanning {folder}...")
+        self.scan_task = self.editor.runner.submit(scan_library, self.db_path, folder, key="library-scan",
+                                                   on_done=self.on_scan_done, on_error=self.on_scan_error,
+                                                   on_progress=self.on_scan_progress)
+
+    def on_scan_progress(self, done):
+        if self.window.winfo_exists():
+            self.status.config(text=f"Scanning, {done} files read...")
+
+    def on_scan_done(self, summary):
+        self.scan_task = None
+        if not self.window.winfo_exists():
+            return
+        self.scan_button.config(state="normal")
+        print(f"Library scan: {summary['files']} files, {summary['updated']} parsed, "
+              f"{summary['removed']} removed, {summary['errors']} errors in {summary['seconds']:.2f}s")
+        self.reload()
+
+    def on_scan_error(self, error):
+        self.scan_task = None
+        print(f"Error scanning library: {error}")
+        if self.window.winfo_exists():
+            self.scan_button.config(state="normal")
+            self.status.config(text=f"Scan failed: {error}")
+
+    def update_paths(self, paths):
+        """Re-index files the editor just saved, then refresh the list."""
+        self.editor.runner.submit(update_library, self.db_path, paths, key="library-update",
+                                  on_done=self.on_update_done, on_error=self.on_update_error)
+
+    def on_update_done(self, summary):
+        if self.window.winfo_exists() and summary["updated"] + summary["removed"]:
+            self.reload()
+
+    def on_update_error(self, error):
+        print(f"Error updating the library index: {error}")
+
+    def close(self):
+        if self.filter_job is not None:
+            self.window.after_cancel(self.filter_job)
+        if self.scan_task is not None:
+            # Files parsed so far stay indexed, the rest wait for the next scan
+            self.scan_task.cancel()
+        self.query_runner.shutdown()
+        self.index.close()
+        self.window.destroy()
+        self.editor.library_browser = None
+
+
+# Work functions run on the editor's BackgroundRunner threads; each opens its
+# own connection, SQLite connections stay on the thread that made them
+
+def query_ids(task, db_path, text, sort, descending):
+    """Return (sorted ids, milliseconds taken) for a filter; a superseded query is interrupted."""
+    start = time.perf_counter()
+    with library_index.LibraryIndex(db_path) as index:
+        # Checked every few thousand SQLite steps, a non-zero return aborts the query
+        index.conn.set_progress_handler(lambda: task.cancelled, 10000)
+        ids = index.sorted_ids(text, sort, descending)
+    return ids, (time.perf_counter() - start) * 1000
+
+
+def scan_library(task, db_path, folder):
+    done = 0
+
+    def on_progress(count):
+        nonlocal done
+        done += count
+        task.report(done)
+
+    with library_index.LibraryIndex(db_path) as index:
+        return index.rescan(folder, on_progress=on_progress, should_stop=lambda: task.cancelled)
+
+
+def update_library(task, db_path, paths):
+    with library_index.LibraryIndex(db_path) as index:
+        return index.update_paths(paths)
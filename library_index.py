@@ -0,0 +1,608 @@
+import os
+import sys
+import time
+import struct
+import sqlite3
+import hashlib
+import argparse
+import itertools
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import tagcore
+import covers
+import formats
+import watcher
+import audiohash
+from batch import iter_audio_files
+
+
+DEFAULT_DB_PATH = os.path.join(os.path.expanduser("~"), ".audio_tag_editor", "library.db")
+
+# Index column for each editor field
+FIELD_COLUMNS = {
+    "Song Name": "title",
+    "Artist": "artist",
+    "Album": "album",
+    "Genre": "genre",
+    "Year": "year",
+}
+
+COLUMNS = ["path", "inode", "size", "mtime_ns", "format",
+           "title", "artist", "album", "genre", "year",
+           "duration", "bitrate", "cover_hash", "error", "audio_size", "audio_hash",
+           "cover_size", "cover_width", "cover_height"]
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS tracks (
+    path TEXT PRIMARY KEY,
+    inode INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    format TEXT,
+    title TEXT,
+    artist TEXT,
+    album TEXT,
+    genre TEXT,
+    year TEXT,
+    duration REAL,
+    bitrate INTEGER,
+    cover_hash TEXT,
+    error TEXT,
+    audio_size INTEGER,
+    audio_hash TEXT,
+    cover_size INTEGER,
+    cover_width INTEGER,
+    cover_height INTEGER
+);
+CREATE INDEX IF NOT EXISTS tracks_artist ON tracks (artist COLLATE NOCASE);
+CREATE INDEX IF NOT EXISTS tracks_album ON tracks (album COLLATE NOCASE);
+CREATE INDEX IF NOT EXISTS tracks_title ON tracks (title COLLATE NOCASE);
+CREATE INDEX IF NOT EXISTS tracks_genre ON tracks (genre COLLATE NOCASE);
+CREATE INDEX IF NOT EXISTS tracks_year ON tracks (year);
+"""
+
+# Columns added after the first release, added to older databases on open
+ADDED_COLUMNS = [
+    ("audio_size", "INTEGER"),
+    ("audio_hash", "TEXT"),
+    ("cover_size", "INTEGER"),
+    ("cover_width", "INTEGER"),
+    ("cover_height", "INTEGER"),
+]
+
+INDEXES = """
+CREATE INDEX IF NOT EXISTS tracks_audio_size ON tracks (audio_size);
+CREATE INDEX IF NOT EXISTS tracks_audio_hash ON tracks (audio_hash);
+CREATE INDEX IF NOT EXISTS tracks_cover_hash ON tracks (cover_hash);
+CREATE INDEX IF NOT EXISTS tracks_artist_album_title
+    ON tracks (artist COLLATE NOCASE, album COLLATE NOCASE, title COLLATE NOCASE);
+CREATE INDEX IF NOT EXISTS tracks_album_title ON tracks (album COLLATE NOCASE, title COLLATE NOCASE);
+"""
+
+# Columns the library browser sorts on, each with its tie-breakers; every
+# order is covered by one of the indexes so no sort step is needed
+SORT_ORDERS = {
+    "artist": ["artist", "album", "title"],
+    "album": ["album", "title"],
+    "title": ["title"],
+    "genre": ["genre"],
+    "year": ["year"],
+}
+
+# Threads hashing audio data; reading and SHA-1 both release the GIL
+HASH_WORKERS = 8
+
+SCAN_CHUNK_SIZE = 64
+
+
+def cover_hash(data):
+    return hashlib.sha1(data).hexdigest() if data else None
+
+
+def file_signature(stat):
+    """The (inode, size, mtime) triple a rescan compares to spot changed files."""
+    return (stat.st_ino, stat.st_size, stat.st_mtime_ns)
+
+
+def index_row(path, signature):
+    """Parse one file and return its row for the tracks table."""
+    row = dict.fromkeys(COLUMNS)
+    row["path"] = path
+    row["inode"], row["size"], row["mtime_ns"] = signature
+    row["format"] = tagcore.file_type_of(path).lstrip(".")
+    try:
+        tags = tagcore.read_tags(path)
+    except Exception as e:
+        # Keep the row so a broken file isn't re-parsed until it changes
+        row["error"] = f"{type(e).__name__}: {e}"
+        return row
+    for field, column in FIELD_COLUMNS.items():
+        row[column] = tags["fields"].get(field)
+    row["format"] = tags["format"]
+    row["duration"] = tags["duration"]
+    row["bitrate"] = tags["bitrate"]
+    row["cover_hash"] = cover_hash(tags["cover"])
+    if tags["cover"]:
+        row["cover_size"] = len(tags["cover"])
+        row["cover_width"], row["cover_height"] = covers.image_size(tags["cover"]) or (None, None)
+    return row
+
+
+def _payload_size(path, format_name=None):
+    try:
+        return audiohash.payload_size(path, formats.handler_named(format_name) if format_name else None)
+    except (OSError, ValueError, struct.error):
+        # 0 rather than NULL so the file isn't retried on every search
+        return 0
+
+
+def _hash_row(row):
+    # Skip files changed since they were indexed, the next scan re-reads them
+    try:
+        if file_signature(os.stat(row["path"])) != (row["inode"], row["size"], row["mtime_ns"]):
+            return None
+        return audiohash.hash_payload(row["path"], formats.handler_named(row["format"]))
+    except (OSError, ValueError, struct.error):
+        return None
+
+
+def _index_rows(items):
+    return [index_row(path, signature) for path, signature in items]
+
+
+def _chunks(items, size):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+class LibraryIndex:
+    """SQLite index of the tags and stream info of every file in a library."""
+
+    def __init__(self, db_path=DEFAULT_DB_PATH):
+        self.db_path = db_path
+        if db_path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        self.conn = sqlite3.connect(db_path)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(SCHEMA)
+        existing = {row[1] for row in self.conn.execute("PRAGMA table_info(tracks)")}
+        for column, column_type in ADDED_COLUMNS:
+            if column not in existing:
+                self.conn.execute(f"ALTER TABLE tracks ADD COLUMN {column} {column_type}")
+        if "cover_size" not in existing:
+            # Files with art get re-read on the next scan to fill in its size
+            self.conn.execute("UPDATE tracks SET mtime_ns = -1 WHERE cover_hash IS NOT NULL")
+            self.conn.commit()
+        self.conn.executescript(INDEXES)
+
+    def close(self):
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _signatures_under(self, root):
+        prefix = os.path.join(root, "")
+        # A range over the primary key rather than LIKE, so the index is used
+        rows = self.conn.execute(
+            "SELECT path, inode, size, mtime_ns FROM tracks WHERE path >= ? AND path < ?",
+            (prefix, prefix + "\U0010ffff"))
+        return {row[0]: (row[1], row[2], row[3]) for row in rows}
+
+    def rescan(self, root, workers=None, on_progress=None, should_stop=None):
+        """Bring the index up to date with the files below root.
+
+        Only files whose (inode, size, mtime) changed since the last scan are
+        parsed again; rows of files that no longer exist are removed.
+        ``should_stop()`` is checked as the scan goes; once it returns True
+        the files parsed so far are kept and the rest are left for the next
+        scan.  Returns a summary dict of the work done.
+        """
+        start = time.perf_counter()
+        root = os.path.abspath(root)
+        known = self._signatures_under(root)
+        changed = []
+        seen = 0
+        stopped = False
+        for path in iter_audio_files(root):
+            if should_stop and should_stop():
+                stopped = True
+                break
+            try:
+                signature = file_signature(os.stat(path))
+            except OSError:
+                continue
+            seen += 1
+            if known.pop(path, None) != signature:
+                changed.append((path, signature))
+        # A walk cut short hasn't seen every file, so nothing counts as removed
+        removed = [] if stopped else list(known)
+
+        errors, updated = self._parse(changed, workers, on_progress, should_stop)
+        self.remove(removed, commit=False)
+        self.conn.commit()
+        return {
+            "files": seen,
+            "updated": updated,
+            "unchanged": seen - len(changed),
+            "removed": len(removed),
+            "errors": errors,
+            "seconds": time.perf_counter() - start,
+        }
+
+    def _parse(self, changed, workers=None, on_progress=None, should_stop=None):
+        """Parse (path, signature) pairs into rows and upsert them; returns (errors, rows stored)."""
+        if len(changed) <= SCAN_CHUNK_SIZE:
+            # Starting a process pool costs more than parsing a handful of files
+            return (self._store(_index_rows(changed), on_progress), len(changed)) if changed else (0, 0)
+        errors = stored = 0
+        with ProcessPoolExecutor(max_workers=workers or os.cpu_count() or 1) as executor:
+            futures = [executor.submit(_index_rows, chunk) for chunk in _chunks(changed, SCAN_CHUNK_SIZE)]
+            for future in futures:
+                if should_stop and should_stop():
+                    for pending in futures:
+                        pending.cancel()
+                    break
+                rows = future.result()
+                errors += self._store(rows, on_progress)
+                stored += len(rows)
+        return errors, stored
+
+    def _store(self, rows, on_progress=None):
+        self.upsert(rows, commit=False)
+        if on_progress:
+            on_progress(len(rows))
+        return sum(1 for row in rows if row["error"])
+
+    def update_paths(self, paths, workers=None):
+        """Re-index just the given files, e.g. the ones a watcher saw change.
+
+        Files whose (inode, size, mtime) still match the index are skipped,
+        files that no longer exist are removed.  Returns a summary dict
+        like ``rescan``.
+        """
+        start = time.perf_counter()
+        changed, removed = [], []
+        for path in paths:
+            path = os.path.abspath(path)
+            try:
+                signature = file_signature(os.stat(path))
+            except OSError:
+                removed.append(path)
+                continue
+            row = self.conn.execute("SELECT inode, size, mtime_ns FROM tracks WHERE path = ?",
+                                    (path,)).fetchone()
+            if row is None or tuple(row) != signature:
+                changed.append((path, signature))
+        errors, _stored = self._parse(changed, workers)
+        self.remove(removed, commit=False)
+        self.conn.commit()
+        return {
+            "files": len(paths),
+            "updated": len(changed),
+            "unchanged": len(paths) - len(changed) - len(removed),
+            "removed": len(removed),
+            "errors": errors,
+            "seconds": time.perf_counter() - start,
+        }
+
+    def remove_tree(self, directory, commit=True):
+        """Drop every row below ``directory``; returns the number removed."""
+        prefix = os.path.join(os.path.abspath(directory), "")
+        cursor = self.conn.execute("DELETE FROM tracks WHERE path >= ? AND path < ?",
+                                   (prefix, prefix + "\U0010ffff"))
+        if commit:
+            self.conn.commit()
+        return cursor.rowcount
+
+    def apply_changes(self, changes, workers=None):
+        """Bring the index up to date with a batch of watcher changes.
+
+        ``changes`` maps paths to "changed", "removed", "removed_tree" or
+        "rescan" (see watcher.py).  Returns a summary dict like ``rescan``.
+        """
+        summary = self.update_paths([path for path, change in changes.items()
+                                     if change in ("changed", "removed")], workers)
+        for path, change in changes.items():
+            if change == "removed_tree":
+                summary["removed"] += self.remove_tree(path)
+            elif change == "rescan":
+                rescanned = self.rescan(path, workers)
+                for key in ("updated", "removed", "errors", "seconds"):
+                    summary[key] += rescanned[key]
+        return summary
+
+    def find_duplicates(self, root=None, workers=HASH_WORKERS, on_progress=None):
+        """Return groups of files with the same audio data, and a summary dict.
+
+        Only files sharing their audio size with another file are hashed,
+        and hashes are kept in the index until the file changes, so
+        repeated runs only hash new or modified files.  ``root`` limits
+        the search to the files below a directory.
+        """
+        start = time.perf_counter()
+        scope, params = self._scope(root)
+
+        # Sizes are only worked out here, scans don't pay for walking every Ogg page
+        missing = self.conn.execute(f"SELECT path, format FROM tracks WHERE {scope} AND audio_size IS NULL "
+                                    "AND error IS NULL", params).fetchall()
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            sizes = list(executor.map(_payload_size, [row["path"] for row in missing],
+                                      [row["format"] for row in missing]))
+            self.conn.executemany("UPDATE tracks SET audio_size = ? WHERE path = ?",
+                                  zip(sizes, (row[0] for row in missing)))
+
+            candidates = self.conn.execute(
+                f"SELECT path, inode, size, mtime_ns, format, audio_size FROM tracks "
+                f"WHERE {scope} AND audio_hash IS NULL AND audio_size > 0 AND audio_size IN "
+                f"(SELECT audio_size FROM tracks WHERE {scope} GROUP BY audio_size HAVING COUNT(*) > 1)",
+                params * 2).fetchall()
+            hashed = skipped = 0
+            hashed_bytes = 0
+            for row, digest in zip(candidates, executor.map(_hash_row, candidates)):
+                if digest is None:
+                    skipped += 1
+                    continue
+                self.conn.execute("UPDATE tracks SET audio_hash = ? WHERE path = ?", (digest, row["path"]))
+                hashed += 1
+                hashed_bytes += row["audio_size"]
+                if on_progress:
+                    on_progress(hashed)
+        self.conn.commit()
+
+        rows = self.conn.execute(
+            f"SELECT * FROM tracks WHERE {scope} AND audio_hash IN "
+            f"(SELECT audio_hash FROM tracks WHERE {scope} AND audio_hash IS NOT NULL "
+            f"GROUP BY audio_hash HAVING COUNT(*) > 1) ORDER BY audio_hash, path", params * 2)
+        groups = [list(group) for _digest, group in itertools.groupby(rows, key=lambda row: row["audio_hash"])]
+        return groups, {
+            "groups": len(groups),
+            "duplicates": sum(len(group) - 1 for group in groups),
+            "hashed": hashed,
+            "hashed_bytes": hashed_bytes,
+            "skipped": skipped,
+            "seconds": time.perf_counter() - start,
+        }
+
+    def _scope(self, root):
+        # WHERE clause and parameters limiting a query to the files below root
+        if root is None:
+            return "1", []
+        prefix = os.path.join(os.path.abspath(root), "")
+        return "path >= ? AND path < ?", [prefix, prefix + "\U0010ffff"]
+
+    def cover_report(self, root=None, limit=None):
+        """Return one row per distinct embedded cover, biggest total footprint first.
+
+        Rows have the cover's hash, size in bytes, width, height, the
+        number of tracks carrying it, and one album and artist using it.
+        """
+        scope, params = self._scope(root)
+        sql = (f"SELECT cover_hash, MAX(cover_size) AS size, MAX(cover_width) AS width, "
+               f"MAX(cover_height) AS height, COUNT(*) AS tracks, MIN(album) AS album, MIN(artist) AS artist "
+               f"FROM tracks WHERE {scope} AND cover_hash IS NOT NULL GROUP BY cover_hash "
+               f"ORDER BY COALESCE(MAX(cover_size), 0) * COUNT(*) DESC")
+        if limit:
+            sql += f" LIMIT {int(limit)}"
+        return self.conn.execute(sql, params).fetchall()
+
+    def oversized_covers(self, max_dimension, root=None):
+        """Paths of files whose embedded art is wider or taller than max_dimension."""
+        scope, params = self._scope(root)
+        rows = self.conn.execute(f"SELECT path FROM tracks WHERE {scope} AND "
+                                 f"MAX(COALESCE(cover_width, 0), COALESCE(cover_height, 0)) > ?",
+                                 params + [max_dimension])
+        return [row[0] for row in rows]
+
+    def upsert(self, rows, commit=True):
+        placeholders = ", ".join("?" * len(COLUMNS))
+        # Updated in place rather than replaced, so a track keeps its rowid
+        # (the library browser keys its list and selection on rowids)
+        updates = ", ".join(f"{column} = excluded.{column}" for column in COLUMNS if column != "path")
+        self.conn.executemany(
+            f"INSERT INTO tracks ({', '.join(COLUMNS)}) VALUES ({placeholders}) "
+            f"ON CONFLICT(path) DO UPDATE SET {updates}",
+            ([row[column] for column in COLUMNS] for row in rows))
+        if commit:
+            self.conn.commit()
+
+    def remove(self, paths, commit=True):
+        self.conn.executemany("DELETE FROM tracks WHERE path = ?", ((path,) for path in paths))
+        if commit:
+            self.conn.commit()
+
+    def get(self, path):
+        return self.conn.execute("SELECT * FROM tracks WHERE path = ?",
+                                 (os.path.abspath(path),)).fetchone()
+
+    def count(self):
+        return self.conn.execute("SELECT COUNT(*) FROM tracks").fetchone()[0]
+
+    def search(self, text=None, limit=100, offset=0, **filters):
+        """Return rows matching a free-text query and/or exact column filters.
+
+        ``text`` is matched case-insensitively against the title, artist,
+        album and genre; keyword filters (e.g. ``artist="..."``) must match
+        a column exactly and use the column indexes.
+        """
+        where, params = self._where(text, filters)
+        sql = f"SELECT * FROM tracks {where} ORDER BY artist, album, title LIMIT ? OFFSET ?"
+        return self.conn.execute(sql, params + [limit, offset]).fetchall()
+
+    def sorted_ids(self, text=None, sort="artist", descending=False, **filters):
+        """Return the rowids of the tracks matching ``search``'s filters, in ``sort`` order.
+
+        Only ids are fetched, so even a whole library is a cheap list; the
+        rows themselves are read a page at a time with ``rows_by_id``.
+        """
+        if sort not in SORT_ORDERS:
+            raise ValueError(f"Can't sort on: {sort}")
+        where, params = self._where(text, filters)
+        direction = " DESC" if descending else ""
+        order = ", ".join(f"{column}{'' if column == 'year' else ' COLLATE NOCASE'}{direction}"
+                          for column in SORT_ORDERS[sort])
+        # A text filter reads every row anyway; scanning the table and sorting
+        # the matches beats walking the sort index row by row
+        hint = "NOT INDEXED" if text else ""
+        sql = f"SELECT rowid FROM tracks {hint} {where} ORDER BY {order}, rowid{direction}"
+        return [row[0] for row in self.conn.execute(sql, params)]
+
+    def rows_by_id(self, ids):
+        """Return {rowid: row} for the given rowids; rows deleted since are left out."""
+        rows = {}
+        for chunk in _chunks(list(ids), 500):
+            sql = f"SELECT rowid, * FROM tracks WHERE rowid IN ({', '.join('?' * len(chunk))})"
+            rows.update((row[0], row) for row in self.conn.execute(sql, chunk))
+        return rows
+
+    def _where(self, text, filters):
+        clauses, params = [], []
+        for column, value in filters.items():
+            if column not in COLUMNS:
+                raise ValueError(f"Unknown column: {column}")
+            clauses.append(f"{column} = ? COLLATE NOCASE" if column in FIELD_COLUMNS.values()
+                           else f"{column} = ?")
+            params.append(value)
+        if text:
+            like = f"%{text}%"
+            clauses.append("(title LIKE ? OR artist LIKE ? OR album LIKE ? OR genre LIKE ?)")
+            params.extend([like] * 4)
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+        return where, params
+
+
+def watch_library(index, root, workers=None, delay=watcher.DEBOUNCE_DELAY, poll_interval=None):
+    """Apply every settled batch of changes below root to the index until interrupted."""
+    def on_batch(changes):
+        summary = index.apply_changes(changes, workers)
+        print(f"{len(changes)} changes: {summary['updated']} parsed, {summary['removed']} removed, "
+              f"{summary['errors']} errors in {summary['seconds']:.2f}s", flush=True)
+
+    print(f"Watching {root} for changes (Ctrl+C to stop)", flush=True)
+    try:
+        watcher.watch([root], on_batch, delay=delay, poll_interval=poll_interval)
+    except KeyboardInterrupt:
+        pass
+
+
+def print_cover_report(index, root=None, limit=50):
+    rows = index.cover_report(root)
+    print(f"{'cover':<12} {'tracks':>6} {'KiB':>8} {'size':>11}  album / artist")
+    for row in rows[:limit]:
+        size = f"{row['width']}x{row['height']}" if row["width"] else "?"
+        kib = f"{row['size'] / 1024:.0f}" if row["size"] is not None else "?"
+        print(f"{row['cover_hash'][:12]} {row['tracks']:>6} {kib:>8} {size:>11}  "
+              f"{row['album'] or ''} / {row['artist'] or ''}")
+    tracks = sum(row["tracks"] for row in rows)
+    embedded = sum((row["size"] or 0) * row["tracks"] for row in rows)
+    distinct = sum(row["size"] or 0 for row in rows)
+    print(f"{len(rows)} distinct covers on {tracks} tracks: {embedded / (1024 * 1024):.1f} MiB embedded, "
+          f"{distinct / (1024 * 1024):.1f} MiB if each were stored once", file=sys.stderr)
+
+
+def normalize_covers(index, max_dimension, quality=covers.COVER_QUALITY, root=None, workers=None):
+    """Shrink embedded art bigger than max_dimension across the index, in parallel."""
+    from batch import run_batch
+    paths = index.oversized_covers(max_dimension, root)
+    saved = 0
+
+    def on_result(result):
+        nonlocal saved
+        saved += result.get("cover_bytes_saved", 0)
+        if result["status"] == "error":
+            print(f"error     {result['path']}: {result['error']}", file=sys.stderr)
+
+    jobs = ({"path": path, "fields": {}, "normalize_cover": True} for path in paths)
+    summary = run_batch(jobs, workers=workers, on_result=on_result,
+                        cover_options={"max_dimension": max_dimension, "quality": quality})
+    index.update_paths(paths, workers)
+    print(f"Normalized cover art in {summary['written']} of {len(paths)} files with art over "
+          f"{max_dimension}px: {saved / (1024 * 1024):.1f} MiB of art removed, {summary['errors']} errors "
+          f"in {summary['seconds']:.2f}s", file=sys.stderr)
+    return summary
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="main.py index",
+                                     description="Maintain and query the library tag index.")
+    parser.add_argument("--db", default=DEFAULT_DB_PATH, help=f"Index database (default: {DEFAULT_DB_PATH})")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    scan = commands.add_parser("scan", help="Incrementally (re)index a directory tree")
+    scan.add_argument("directory")
+    scan.add_argument("--workers", type=int, default=None, help="Worker processes (default: CPU count)")
+
+    watch = commands.add_parser("watch", help="Keep the index of a directory tree up to date as files change")
+    watch.add_argument("directory")
+    watch.add_argument("--workers", type=int, default=None, help="Worker processes (default: CPU count)")
+    watch.add_argument("--debounce", type=float, default=watcher.DEBOUNCE_DELAY,
+                       help="Seconds without changes before the index is updated")
+    watch.add_argument("--poll", type=float, default=None, metavar="SECONDS",
+                       help="Poll for changes every SECONDS instead of using inotify")
+
+    duplicates = commands.add_parser("duplicates", help="List files with the same audio under different tags")
+    duplicates.add_argument("directory", nargs="?",
+                            help="Scan this directory tree first and only look for duplicates in it")
+    duplicates.add_argument("--workers", type=int, default=None,
+                            help=f"Worker processes for the scan, and threads for hashing (default: CPU count "
+                                 f"and {HASH_WORKERS})")
+
+    cover_report = commands.add_parser("covers", help="List distinct embedded cover art, "
+                                                      "or shrink oversized art across the library")
+    cover_report.add_argument("directory", nargs="?",
+                              help="Scan this directory tree first and only report the art in it")
+    cover_report.add_argument("--limit", type=int, default=50, help="Covers to list (default: 50)")
+    cover_report.add_argument("--normalize", type=int, metavar="MAX_DIM",
+                              help="Re-encode embedded art larger than MAX_DIM pixels to fit it")
+    cover_report.add_argument("--quality", type=int, default=covers.COVER_QUALITY,
+                              help="JPEG quality used by --normalize")
+    cover_report.add_argument("--workers", type=int, default=None, help="Worker processes (default: CPU count)")
+
+    search = commands.add_parser("search", help="Search the index")
+    search.add_argument("text", nargs="?", help="Text to look for in title/artist/album/genre")
+    for column in FIELD_COLUMNS.values():
+        search.add_argument(f"--{column}", help=f"Exact {column} to match")
+    search.add_argument("--limit", type=int, default=100)
+    return parser
+
+
+def main(argv):
+    args = build_parser().parse_args(argv)
+    with LibraryIndex(args.db) as index:
+        if args.command in ("scan", "watch"):
+            summary = index.rescan(args.directory, workers=args.workers)
+            print(f"{summary['files']} files: {summary['updated']} parsed, {summary['unchanged']} unchanged, "
+                  f"{summary['removed']} removed, {summary['errors']} errors in {summary['seconds']:.2f}s")
+            if args.command == "watch":
+                watch_library(index, args.directory, args.workers, args.debounce, args.poll)
+        elif args.command == "covers":
+            if args.directory:
+                index.rescan(args.directory, workers=args.workers)
+            if args.normalize:
+                normalize_covers(index, args.normalize, args.quality, args.directory, args.workers)
+            print_cover_report(index, args.directory, args.limit)
+        elif args.command == "duplicates":
+            if args.directory:
+                index.rescan(args.directory, workers=args.workers)
+            groups, summary = index.find_duplicates(args.directory, workers=args.workers or HASH_WORKERS)
+            for group in groups:
+                for row in group:
+                    print(f"{row['format'] or '':<6} {row['artist'] or '':<24} {row['title'] or '':<32} {row['path']}")
+                print()
+            print(f"{summary['groups']} groups, {summary['duplicates']} duplicate files; hashed "
+                  f"{summary['hashed']} files ({summary['hashed_bytes'] / (1024 * 1024):.1f} MiB) "
+                  f"in {summary['seconds']:.2f}s", file=sys.stderr)
+        else:
+            filters = {column: getattr(args, column) for column in FIELD_COLUMNS.values()
+                       if getattr(args, column) is not None}
+            start = time.perf_counter()
+            rows = index.search(args.text, limit=args.limit, **filters)
+            for row in rows:
+                print(f"{row['artist'] or '':<24} {row['album'] or '':<24} {row['title'] or '':<32} {row['path']}")
+            print(f"{len(rows)} results in {(time.perf_counter() - start) * 1000:.1f} ms", file=sys.stderr)
+    return 0
@@ -1,18 +1,35 @@
-import tkinter as tk
-from tkinter import filedialog
+import sys
+import startup_profile
+
+# With --profile-startup every import below is timed
+if __name__ == "__main__" and startup_profile.requested(sys.argv[1:]):
+    startup_profile.start()
+
 import os
-from PIL import Image, ImageTk
-import tempfile
-from mutagen.mp3 import MP3
-from mutagen.id3 import ID3, TIT2, TPE1, TALB, TCON, TYER, ID3NoHeaderError, APIC
-from mutagen.mp4 import MP4, MP4Cover
-from mutagen.flac import FLAC
-from mutagen.oggvorbis import OggVorbis
-from mutagen.aac import AAC
-from mutagen.wave import WAVE
-import io
-import glob
-from mutagen.flac import Picture
+import importlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import tagcore
+import formats
+import covers
+import instrumentation
+from background import BackgroundRunner
+
+# Bound by main() when the window is opened, so command line modes and
+# pool workers importing this module never load Tk
+tk = filedialog = ttk = None
+
+# Shown in a field when the open files don't all share the same value
+MULTIPLE_VALUES = "<multiple>"
+
+# Threads used to read or save the files of a multi-file selection
+FILE_IO_WORKERS = 8
+
+# Journaled batches kept after an editor save, counting batch runs (see journal.py)
+JOURNAL_KEEP = 50
+
+# Template first offered by "Tags from Filenames" (see path_templates.py)
+DEFAULT_PATH_TEMPLATE = "{artist}/{album}/{track} - {title}"
 
 
 class AudioTagEditor:
@@ -25,47 +42,108 @@ class AudioTagEditor:
         self.file_path = ""
         self.file_name = ""
         self.verify_label = None
-        self.temp_path = None
+        self.cover_data = None
         self.file_type = None
+        # Every open file, and the values shown in the entries once they loaded
+        self.file_paths = []
+        self.folder = None
+        self.tag_files = []
+        self.shown_values = {}
         self.cover_art_label = None
         
         self.cover_art_selected = False
+        # Previews of cover art, shared by every file opened in this window
+        self.preview_cache = covers.PreviewCache()
+        # Limits applied to chosen cover art before it's embedded
+        self.cover_max_dimension = covers.COVER_MAX_DIMENSION
+        self.cover_quality = covers.COVER_QUALITY
+
+        # File I/O runs here so the window stays responsive; one thread
+        # is taken by the watch on the open files
+        self.runner = BackgroundRunner(root, max_workers=3)
+        self.save_task = None
+        self.refresh_after_save = False
+        # File changes seen while a save runs, applied once it's done
+        self.deferred_changes = {}
+        self.watch_task = None
+        self.library_browser = None
+        self.busy_widgets = []
+        self.root.protocol("WM_DELETE_WINDOW", self.close)
 
         self.label = tk.Label(root, text="Choose an audio file")
         self.label.grid(row=0, column=0)
 
         self.button = tk.Button(root, text="Open File", command=self.choose_file)
         self.button.grid(row=0, column=1)
+        self.folder_button = tk.Button(root, text="Open Folder", command=self.choose_folder)
+        self.folder_button.grid(row=0, column=2)
+        self.library_button = tk.Button(root, text="Library", command=self.show_library)
+        self.library_button.grid(row=1, column=2)
 
         # Placeholders for tag entry widgets
         self.tag_widgets = {}
 
     def is_audio_file(self, file_path):
-        return file_path.lower().endswith(('.mp3', '.wav', '.flac', '.ogg', '.aac', '.m4a'))
+        return tagcore.is_audio_file(file_path)
 
     def choose_file(self):
-        file_path = filedialog.askopenfilename(
-            title="Select an Audio File",
-            filetypes=(("Audio Files", "*.mp3 *.wav *.flac *.ogg *.aac *.m4a"),
+        file_paths = filedialog.askopenfilenames(
+            title="Select Audio Files",
+            filetypes=(("Audio Files", " ".join("*" + ext for ext in formats.audio_extensions())),
                        ("All Files", "*.*"))
         )
-        if file_path and self.is_audio_file(file_path):
-            self.file_path = file_path
-            self.file_name = os.path.basename(file_path)
-            self.label.config(text=f"{self.file_name}", width=30)
-            self.file_chosen = True
-            self.file_type = os.path.splitext(self.file_name)[1].lower()
-            if self.verify_label:
-                self.verify_label.destroy()
-            self.verify_label = tk.Label(self.root, text="File selected successfully!")
-            self.verify_label.grid(row=1, column=0, columnspan=2)
-            self.show_tag_options()
+        file_paths = [path for path in file_paths if self.is_audio_file(path)]
+        if file_paths:
+            self.open_files(file_paths)
         else:
-            self.label.config(text="Error: No audio file selected.")
-            if self.verify_label:
-                self.verify_label.destroy()
-                self.verify_label = None
-            self.hide_tag_options()
+            self.show_no_files()
+
+    def show_library(self):
+        if self.library_browser is not None:
+            self.library_browser.window.lift()
+            return
+        # Only imported once the library is first opened
+        from library_browser import LibraryBrowser
+        self.library_browser = LibraryBrowser(self)
+
+    def choose_folder(self):
+        folder = filedialog.askdirectory(title="Select a Folder of Audio Files")
+        if folder:
+            # The folder is walked in the background along with loading the tags
+            self.open_files([], folder=folder)
+        else:
+            self.show_no_files()
+
+    def open_files(self, file_paths, folder=None):
+        self.file_paths = list(file_paths)
+        self.folder = folder
+        self.file_path = self.file_paths[0] if self.file_paths else ""
+        if folder:
+            self.file_name = os.path.basename(os.path.normpath(folder)) + os.sep
+        elif len(self.file_paths) == 1:
+            self.file_name = os.path.basename(self.file_path)
+        else:
+            self.file_name = f"{len(self.file_paths)} files"
+        self.label.config(text=f"{self.file_name}", width=30)
+        self.file_chosen = True
+        self.file_type = os.path.splitext(self.file_path)[1].lower() if self.file_path else None
+        self.show_verify_label("Folder selected successfully!" if folder else
+                               "File selected successfully!" if len(self.file_paths) == 1 else
+                               "Files selected successfully!")
+        self.show_tag_options()
+
+    def show_verify_label(self, text):
+        if self.verify_label:
+            self.verify_label.destroy()
+        self.verify_label = tk.Label(self.root, text=text)
+        self.verify_label.grid(row=1, column=0, columnspan=2)
+
+    def show_no_files(self):
+        self.label.config(text="Error: No audio file selected.")
+        if self.verify_label:
+            self.verify_label.destroy()
+            self.verify_label = None
+        self.hide_tag_options()
 
     def show_tag_options(self):
         # Remove previous widgets if any
@@ -90,6 +168,9 @@ class AudioTagEditor:
         # Save Button
         self.save_button = tk.Button(self.root, text="Save Tags", command=self.save_tags)
         self.save_button.grid(row=idx+3, column=0, columnspan=2, pady=10)
+        self.filename_button = tk.Button(self.root, text="Tags from Filenames", command=self.show_filename_tags)
+        self.filename_button.grid(row=idx+3, column=2, pady=10)
+        self.busy_row = idx + 4
 
         # Now it's safe to grab existing tags
         self.grab_existing_tags()
@@ -100,191 +181,246 @@ class AudioTagEditor:
             print("No file chosen to grab tags from.")
             return
 
-        try:
-            if self.file_type == ".mp3":
-                self._grab_mp3_tags()
-            elif self.file_type == ".m4a" or self.file_type == ".mp4":
-                self._grab_m4a_tags()
-            elif self.file_type == ".flac":
-                self._grab_flac_tags()
-            elif self.file_type == ".ogg":
-                self._grab_ogg_tags()
-            elif self.file_type == ".aac":
-                self._grab_aac_tags()
-            elif self.file_type == ".wav":
-                self._grab_wav_tags()
-            else:
-                print(f"Unsupported file type: {self.file_type}")
-                return
-        except Exception as e:
-            print(f"Error loading tags: {e}")
-
-    def _grab_mp3_tags(self):
-        audio = MP3(self.file_path, ID3=ID3)
-        print(f"Loaded MP3 tags for {self.file_name}")
-        tag_map = {
-            "TIT2": "Song Name",
-            "TPE1": "Artist",
-            "TALB": "Album",
-            "TCON": "Genre",
-            "TYER": "Year"
-        }
-        for tag in tag_map:
-            if tag in audio.tags:
-                tag_name = tag_map[tag]
-                self.tag_widgets[tag_name].insert(0, audio.tags[tag].text[0])
-                print(f"Existing tag {tag_name}: {audio.tags[tag].text[0]}")
-        # Display existing cover art if present
-        apic_key = next((k for k in audio.tags.keys() if k.startswith("APIC")), None)
-        if apic_key:
-            apic = audio.tags[apic_key]
-            image_data = apic.data
-            image = Image.open(io.BytesIO(image_data))
-            image.thumbnail((150, 150))
-            self.cover_art_image = ImageTk.PhotoImage(image)
-            self.cover_art_label.config(image=self.cover_art_image, text="")
-            print("Displayed existing cover art.")
+        self.stop_watching()
+        # Keep the parsed files around, saving reuses them instead of parsing again
+        self.tag_file = None
+        self.tag_files = []
+        self.shown_values = {}
+        self.set_entries_state("disabled")
+        self.save_button.config(state="disabled")
+        self.cover_art_label.config(image="", text="Loading tags...")
+        # Opening other files supersedes this load if it's still running
+        self.runner.submit(load_tag_files, self.file_paths, self.folder, self.preview_cache, key="load",
+                           on_done=self.on_tags_loaded, on_error=self.on_load_error,
+                           on_progress=self.on_load_progress)
+
+    def on_load_progress(self, done, total):
+        self.cover_art_label.config(image="", text=f"Loading tags {done}/{total}...")
+
+    def on_tags_loaded(self, result):
+        tag_files, errors, preview, shared_cover = result
+        for path, error in errors:
+            print(f"Error loading tags for {path}: {error}")
+        if not tag_files:
+            self.on_load_error(errors[0][1] if errors else tagcore.TagError("No audio files found."))
+            return
+        self.tag_files = tag_files
+        self.tag_file = tag_files[0] if len(tag_files) == 1 else None
+        self.file_paths = [tag_file.path for tag_file in tag_files]
+        self.set_entries_state("normal")
+        self.save_button.config(state="normal" if self.save_task is None else "disabled")
+        if len(tag_files) > 1 or self.folder:
+            message = f"Loaded {len(tag_files)} files"
+            if errors:
+                message += f", {len(errors)} could not be read"
+            self.show_verify_label(message + ".")
+        print(f"Loaded tags for {self.file_name}")
+        for field in tagcore.FIELDS:
+            values = {tag_file.fields.get(field, "") for tag_file in tag_files}
+            value = values.pop() if len(values) == 1 else MULTIPLE_VALUES
+            self.shown_values[field] = value
+            if value:
+                self.tag_widgets[field].insert(0, value)
+                print(f"Existing tag {field}: {value}")
+        if shared_cover:
+            self.show_cover_art(preview)
         else:
-            self.cover_art_label.config(image="", text="No cover art found.")
+            self.cover_art_label.config(image="", text="Files have different cover art.")
+        self.start_watching()
 
-    def _grab_m4a_tags(self):
-        audio = MP4(self.file_path)
-        print(f"Loaded MP4/M4A tags for {self.file_name}")
-        tag_map = {
-            "\xa9nam": "Song Name",
-            "\xa9ART": "Artist",
-            "\xa9alb": "Album",
-            "\xa9gen": "Genre",
-            "\xa9day": "Year"
-        }
-        for mp4_tag, field in tag_map.items():
-            value = audio.tags.get(mp4_tag)
-            if value and len(value) > 0:
-                self.tag_widgets[field].insert(0, value[0])
-                print(f"Existing tag {field}: {value[0]}")
-        # Display cover art if present
-        covr = audio.tags.get("covr")
-        if covr and len(covr) > 0:
-            image_data = covr[0]
-            try:
-                image = Image.open(io.BytesIO(image_data))
-                image.thumbnail((150, 150))
-                self.cover_art_image = ImageTk.PhotoImage(image)
-                self.cover_art_label.config(image=self.cover_art_image, text="")
-                print("Displayed existing cover art.")
-            except Exception as e:
-                print(f"Error displaying cover art: {e}")
-                self.cover_art_label.config(image="", text="No cover art found.")
+    def start_watching(self):
+        """Follow changes other programs make to the open files (or folder)."""
+        if self.folder:
+            directories, recursive = [self.folder], True
         else:
-            self.cover_art_label.config(image="", text="No cover art found.")
-
-    def _grab_flac_tags(self):
-        audio = FLAC(self.file_path)
-        print(f"Loaded FLAC tags for {self.file_name}")
-        tag_map = {
-            "TITLE": "Song Name",
-            "ARTIST": "Artist",
-            "ALBUM": "Album",
-            "GENRE": "Genre",
-            "DATE": "Year"
-        }
-        for flac_tag, field in tag_map.items():
-            value = audio.get(flac_tag)
-            if value and len(value) > 0:
-                self.tag_widgets[field].insert(0, value[0])
-                print(f"Existing tag {field}: {value[0]}")
-        # Display cover art if present
-        if audio.pictures:
-            picture = audio.pictures[0]
-            image_data = picture.data
-            try:
-                image = Image.open(io.BytesIO(image_data))
-                image.thumbnail((150, 150))
-                self.cover_art_image = ImageTk.PhotoImage(image)
-                self.cover_art_label.config(image=self.cover_art_image, text="")
-                print("Displayed existing cover art.")
-            except Exception as e:
-                print(f"Error displaying cover art: {e}")
-                self.cover_art_label.config(image="", text="No cover art found.")
+            directories = sorted({os.path.dirname(os.path.abspath(path)) for path in self.file_paths})
+            recursive = False
+        self.watch_task = self.runner.submit(watch_directories, directories, recursive, key="watch",
+                                             on_progress=self.on_files_changed,
+                                             on_error=self.on_watch_error)
+
+    def stop_watching(self):
+        if self.watch_task is not None:
+            self.watch_task.cancel()
+            self.watch_task = None
+
+    def on_watch_error(self, error):
+        print(f"Stopped watching for file changes: {error}")
+        self.watch_task = None
+
+    def on_files_changed(self, changes):
+        if self.watch_task is None or not self.tag_files:
+            return
+        if self.save_task is not None:
+            # Most of these are our own writes, which reload_tag_files skips;
+            # whatever someone else changed is picked up after the save
+            self.deferred_changes.update(changes)
+            return
+        if any(change == "rescan" for change in changes.values()):
+            # Too many changes to follow one by one, check every open file (and the folder) again
+            self.runner.submit(reload_tag_files, list(self.tag_files), list(self.tag_files), [],
+                               self.preview_cache, True, self.folder, key="reload",
+                               on_done=self.on_files_reloaded, on_error=self.on_load_error)
+            return
+        removed_trees = [os.path.join(path, "") for path, change in changes.items() if change == "removed_tree"]
+        open_files = {os.path.abspath(tag_file.path): tag_file for tag_file in self.tag_files}
+        gone = {path for path in open_files
+                if changes.get(path) == "removed" or path.startswith(tuple(removed_trees))}
+        # Files added to an open folder are picked up too
+        new_paths = [path for path, change in changes.items()
+                     if change == "changed" and path not in open_files and self.folder]
+        touched = [tag_file for path, tag_file in open_files.items()
+                   if path not in gone and changes.get(path) == "changed"]
+        if not gone and not new_paths and not touched:
+            return
+        kept = [tag_file for path, tag_file in open_files.items() if path not in gone]
+        self.runner.submit(reload_tag_files, kept, touched, new_paths, self.preview_cache, key="reload",
+                           on_done=self.on_files_reloaded, on_error=self.on_load_error)
+
+    def on_files_reloaded(self, result):
+        tag_files, reloaded, errors, preview, shared_cover = result
+        for path, error in errors:
+            print(f"Error reloading tags for {path}: {error}")
+        if self.watch_task is None:
+            return
+        if not reloaded and len(tag_files) == len(self.tag_files):
+            return
+        self.tag_files = tag_files
+        self.tag_file = tag_files[0] if len(tag_files) == 1 else None
+        self.file_paths = [tag_file.path for tag_file in tag_files]
+        if not tag_files:
+            self.show_verify_label("The open files were removed or moved.")
+            self.save_button.config(state="disabled")
+            return
+        self.refresh_entries()
+        if shared_cover:
+            self.show_cover_art(preview)
         else:
-            self.cover_art_label.config(image="", text="No cover art found.")
+            self.cover_art_label.config(image="", text="Files have different cover art.")
+        print(f"Reloaded {reloaded} file(s) changed on disk")
+        self.show_verify_label(f"Reloaded {reloaded} file(s) changed on disk, {len(tag_files)} open.")
+
+    def refresh_entries(self):
+        """Show the open files' current values, leaving values the user is in the middle of editing alone."""
+        for field in tagcore.FIELDS:
+            values = {tag_file.fields.get(field, "") for tag_file in self.tag_files}
+            value = values.pop() if len(values) == 1 else MULTIPLE_VALUES
+            entry = self.tag_widgets[field]
+            if entry.get() == self.shown_values.get(field, ""):
+                entry.delete(0, tk.END)
+                entry.insert(0, value)
+            self.shown_values[field] = value
+
+    def on_load_error(self, error):
+        self.set_entries_state("normal")
+        if isinstance(error, tagcore.TagError):
+            print(error)
+        else:
+            print(f"Error loading tags: {error}")
+        self.cover_art_label.config(image="", text="Could not load tags.")
 
-    def _grab_ogg_tags(self):
-        audio = OggVorbis(self.file_path)
-        print(f"Loaded OGG tags for {self.file_name}")
-        tag_map = {
-            "TITLE": "Song Name",
-            "ARTIST": "Artist",
-            "ALBUM": "Album",
-            "GENRE": "Genre",
-            "DATE": "Year"
-        }
-        for ogg_tag, field in tag_map.items():
-            value = audio.get(ogg_tag)
-            if value and len(value) > 0:
-                self.tag_widgets[field].insert(0, value[0])
-                print(f"Existing tag {field}: {value[0]}")
-        self.cover_art_label.config(image="", text="No cover art found.")
-
-    def _grab_aac_tags(self):
-        try:
-            audio = AAC(self.file_path)
-            print(f"Loaded AAC tags for {self.file_name}")
-            # AAC files may use ID3 tags
-            if hasattr(audio, 'tags') and audio.tags:
-                tag_map = {
-                    "TIT2": "Song Name",
-                    "TPE1": "Artist",
-                    "TALB": "Album",
-                    "TCON": "Genre",
-                    "TYER": "Year"
-                }
-                for tag in tag_map:
-                    if tag in audio.tags:
-                        tag_name = tag_map[tag]
-                        self.tag_widgets[tag_name].insert(0, audio.tags[tag].text[0])
-                        print(f"Existing tag {tag_name}: {audio.tags[tag].text[0]}")
-        except Exception as e:
-            print(f"Error loading AAC tags: {e}")
-        self.cover_art_label.config(image="", text="No cover art found.")
+    def set_entries_state(self, state):
+        for entry in self.tag_widgets.values():
+            entry.config(state=state)
 
-    def _grab_wav_tags(self):
-        try:
-            audio = WAVE(self.file_path)
-            print(f"Loaded WAV tags for {self.file_name}")
-            # WAV files may use ID3 tags
-            if hasattr(audio, 'tags') and audio.tags:
-                tag_map = {
-                    "TIT2": "Song Name",
-                    "TPE1": "Artist",
-                    "TALB": "Album",
-                    "TCON": "Genre",
-                    "TYER": "Year"
-                }
-                for tag in tag_map:
-                    if tag in audio.tags:
-                        tag_name = tag_map[tag]
-                        self.tag_widgets[tag_name].insert(0, audio.tags[tag].text[0])
-                        print(f"Existing tag {tag_name}: {audio.tags[tag].text[0]}")
-        except Exception as e:
-            print(f"Error loading WAV tags: {e}")
-        self.cover_art_label.config(image="", text="No cover art found.")
+    def show_cover_art(self, preview):
+        if preview is None:
+            self.cover_art_label.config(image="", text="No cover art found.")
+            return
+        from PIL import ImageTk
+        self.cover_art_image = ImageTk.PhotoImage(preview)
+        self.cover_art_label.config(image=self.cover_art_image, text="")
+        print("Displayed existing cover art.")
 
     def save_tags(self):
-        if self.file_type == ".mp3":
-            self.save_mp3_tags()
-        elif self.file_type == ".flac":
-            self.save_flac_tags()
-        elif self.file_type == ".ogg":
-            self.save_ogg_tags()
-        elif self.file_type == ".aac":
-            self.save_aac_tags()
-        elif self.file_type == ".m4a":
-            self.save_m4a_tags()
-        elif self.file_type == ".wav":
-            self.save_wav_tags()
-        else:
+        if not self.tag_files:
             print("Unsupported file type for saving tags.")
+            return
+        cover = self.cover_data if self.cover_art_selected else None
+        # Only write what the user edited; a "<multiple>" field left alone keeps each file's value
+        edited = {field: value for field, value in self.get_tag_values().items()
+                  if value != self.shown_values.get(field, "")}
+        self.shown_values.update(edited)
+        self.start_save([(tag_file, edited, cover) for tag_file in self.tag_files])
+        self.clear_chosen_cover()
+
+    def start_save(self, jobs):
+        """Save (tag_file, fields, cover) jobs in the background, showing progress."""
+        self.save_button.config(state="disabled")
+        self.show_busy(len(jobs))
+        self.save_task = self.runner.submit(save_tag_files, jobs, on_done=self.on_save_done,
+                                            on_error=self.on_save_error, on_progress=self.on_save_progress)
+
+    def show_busy(self, total):
+        self.hide_busy()
+        label = tk.Label(self.root, text="Saving...")
+        label.grid(row=self.busy_row, column=0, sticky="e", padx=5)
+        progress = ttk.Progressbar(self.root, length=150, maximum=total)
+        progress.grid(row=self.busy_row, column=1, padx=5)
+        cancel = tk.Button(self.root, text="Cancel", command=self.cancel_save)
+        cancel.grid(row=self.busy_row + 1, column=0, columnspan=2)
+        if total == 1:
+            # Nothing to report part way through a single save, just show activity
+            progress.config(mode="indeterminate")
+            progress.start(10)
+        self.busy_label, self.progress_bar = label, progress
+        self.busy_widgets = [label, progress, cancel]
+
+    def hide_busy(self):
+        for widget in self.busy_widgets:
+            widget.destroy()
+        self.busy_widgets = []
+
+    def cancel_save(self):
+        if self.save_task is not None:
+            self.save_task.cancel()
+            self.busy_label.config(text="Cancelling...")
+
+    def on_save_progress(self, done, total):
+        if self.busy_widgets:
+            self.progress_bar.config(value=done)
+            self.busy_label.config(text=f"Saving {done}/{total}...")
+
+    def finish_save(self):
+        self.save_task = None
+        self.hide_busy()
+        if self.tag_files and self.save_button.winfo_exists():
+            self.save_button.config(state="normal")
+        if self.deferred_changes:
+            changes, self.deferred_changes = self.deferred_changes, {}
+            self.on_files_changed(changes)
+
+    def on_save_done(self, results):
+        cancelled = self.save_task is not None and self.save_task.cancelled
+        self.finish_save()
+        if self.refresh_after_save:
+            # Each file got its own values, show what they have now
+            self.refresh_after_save = False
+            self.refresh_entries()
+        saved = sum(1 for _tag_file, was_saved, error in results if was_saved)
+        errors = [(tag_file, error) for tag_file, _was_saved, error in results if error]
+        for tag_file, error in errors:
+            print(f"Error saving tags for {tag_file.path}: {error}")
+        if saved and self.library_browser is not None:
+            # Keep the library list in step with what was just written
+            self.library_browser.update_paths([tag_file.path for tag_file, was_saved, _error in results
+                                               if was_saved])
+        if cancelled:
+            self.show_success_label(f"Save cancelled, {saved} file(s) saved.")
+        elif errors:
+            self.show_success_label(f"Error saving tags: {errors[0][1]}", fg="red")
+        elif saved:
+            print(f"Tags saved successfully for {saved} file(s)")
+            self.show_success_label()
+        else:
+            print("No tag changes to save")
+            self.show_success_label("No changes to save.")
+
+    def on_save_error(self, error):
+        self.refresh_after_save = False
+        self.finish_save()
+        print(f"Error saving tags: {error}")
+        self.show_success_label(f"Error saving tags: {error}", fg="red")
 
     def get_tag_values(self):
         """Return a dict of tag values from the entry widgets."""
@@ -296,183 +432,18 @@ class AudioTagEditor:
             "Year": self.tag_widgets["Year"].get(),
         }
 
-    def show_success_label(self, message="Tags saved successfully!"):
+    def show_success_label(self, message="Tags saved successfully!", fg="green"):
         if hasattr(self, 'success_label') and self.success_label:
             self.success_label.destroy()
-        self.success_label = tk.Label(self.root, text=message, fg="green")
+        self.success_label = tk.Label(self.root, text=message, fg=fg)
         self.success_label.grid(row=0, column=0, columnspan=2, pady=5)
 
-    def cleanup_temp_cover(self):
-        if self.temp_path:
-            temp_dir = os.path.dirname(self.temp_path)
-            for f in glob.glob(os.path.join(temp_dir, "ATE_*")):
-                try:
-                    os.remove(f)
-                except Exception as e:
-                    # Ignore errors about file being used by another process
-                    if "used by another process" not in str(e):
-                        print(f"Error removing temp file {f}: {e}")
-            self.temp_path = None
-            self.cover_art_selected = False
-
-    def save_mp3_tags(self):
-        try:
-            audio = MP3(self.file_path, ID3=ID3)
-            print(f"Loaded MP3 tags for {self.file_name}")
-            
-            # Ensure tags exist
-            if audio.tags is None:
-                audio.add_tags()
-                
-            tags = self.get_tag_values()
-            # Remove and add tags
-            for tag, frame, value in [
-                ("TIT2", TIT2, tags["Song Name"]),
-                ("TPE1", TPE1, tags["Artist"]),
-                ("TALB", TALB, tags["Album"]),
-                ("TCON", TCON, tags["Genre"]),
-                ("TYER", TYER, tags["Year"]),
-            ]:
-                if tag in audio.tags:
-                    del audio.tags[tag]
-                audio.tags.add(frame(encoding=3, text=value))
-            # Cover art
-            if self.cover_art_selected:
-                print(self.temp_path)
-                with open(str(self.temp_path), 'rb') as img_file:
-                    audio.tags.add(APIC(encoding=3, mime='image/png', type=3, desc='Cover Art', data=img_file.read()))
-            audio.save()
-            print(f"MP3 tags saved successfully for {self.file_name}")
-            self.show_success_label()
-            self.cleanup_temp_cover()
-        except ID3NoHeaderError:
-            audio = MP3(self.file_path)
-            audio.add_tags()
-            self.save_mp3_tags()
-        except Exception as e:
-            print(f"Error saving MP3 tags: {e}")
-
-    def save_m4a_tags(self):
-        try:
-            audio = MP4(self.file_path)
-            print(f"Loaded M4A tags for {self.file_name}")
-            tags = self.get_tag_values()
-            # Set tags
-            audio["\xa9nam"] = tags["Song Name"]
-            audio["\xa9ART"] = tags["Artist"]
-            audio["\xa9alb"] = tags["Album"]
-            audio["\xa9gen"] = tags["Genre"]
-            audio["\xa9day"] = tags["Year"]
-            # Cover art
-            if self.cover_art_selected and self.temp_path:
-                with open(self.temp_path, "rb") as img_file:
-                    cover_data = img_file.read()
-                    audio["covr"] = [MP4Cover(cover_data, imageformat=MP4Cover.FORMAT_PNG)]
-            audio.save()
-            print(f"M4A tags saved successfully for {self.file_name}")
-            self.show_success_label()
-            self.cleanup_temp_cover()
-        except Exception as e:
-            print(f"Error saving M4A tags: {e}")
-
-    def save_flac_tags(self):
-        try:
-            audio = FLAC(self.file_path)
-            print(f"Loaded FLAC tags for {self.file_name}")
-            tags = self.get_tag_values()
-            # Set tags
-            audio["TITLE"] = tags["Song Name"]
-            audio["ARTIST"] = tags["Artist"]
-            audio["ALBUM"] = tags["Album"]
-            audio["GENRE"] = tags["Genre"]
-            audio["DATE"] = tags["Year"]
-            # Cover art
-            if self.cover_art_selected and self.temp_path:
-                with open(self.temp_path, "rb") as img_file:
-                    picture = Picture()
-                    picture.type = 3  # Cover (front)
-                    picture.mime = "image/png"
-                    picture.data = img_file.read()
-                    audio.clear_pictures()
-                    audio.add_picture(picture)
-            audio.save()
-            print(f"FLAC tags saved successfully for {self.file_name}")
-            self.show_success_label()
-            self.cleanup_temp_cover()
-        except Exception as e:
-            print(f"Error saving FLAC tags: {e}")
-
-    def save_ogg_tags(self):
-        try:
-            audio = OggVorbis(self.file_path)
-            print(f"Loaded OGG tags for {self.file_name}")
-            tags = self.get_tag_values()
-            # Set tags
-            audio["TITLE"] = tags["Song Name"]
-            audio["ARTIST"] = tags["Artist"]
-            audio["ALBUM"] = tags["Album"]
-            audio["GENRE"] = tags["Genre"]
-            audio["DATE"] = tags["Year"]
-            audio.save()
-            print(f"OGG tags saved successfully for {self.file_name}")
-            self.show_success_label()
-            self.cleanup_temp_cover()
-        except Exception as e:
-            print(f"Error saving OGG tags: {e}")
-
-    def save_aac_tags(self):
-        try:
-            audio = AAC(self.file_path)
-            print(f"Loaded AAC tags for {self.file_name}")
-            tags = self.get_tag_values()
-            # AAC files may use ID3 tags
-            if not hasattr(audio, 'tags') or not audio.tags:
-                audio.add_tags()
-            # Remove and add tags
-            for tag, frame, value in [
-                ("TIT2", TIT2, tags["Song Name"]),
-                ("TPE1", TPE1, tags["Artist"]),
-                ("TALB", TALB, tags["Album"]),
-                ("TCON", TCON, tags["Genre"]),
-                ("TYER", TYER, tags["Year"]),
-            ]:
-                if tag in audio.tags:
-                    del audio.tags[tag]
-                audio.tags.add(frame(encoding=3, text=value))
-            audio.save()
-            print(f"AAC tags saved successfully for {self.file_name}")
-            self.show_success_label()
-            self.cleanup_temp_cover()
-        except Exception as e:
-            print(f"Error saving AAC tags: {e}")
-
-    def save_wav_tags(self):
-        try:
-            audio = WAVE(self.file_path)
-            print(f"Loaded WAV tags for {self.file_name}")
-            tags = self.get_tag_values()
-            # WAV files may use ID3 tags
-            if not hasattr(audio, 'tags') or not audio.tags:
-                audio.add_tags()
-            # Remove and add tags
-            for tag, frame, value in [
-                ("TIT2", TIT2, tags["Song Name"]),
-                ("TPE1", TPE1, tags["Artist"]),
-                ("TALB", TALB, tags["Album"]),
-                ("TCON", TCON, tags["Genre"]),
-                ("TYER", TYER, tags["Year"]),
-            ]:
-                if tag in audio.tags:
-                    del audio.tags[tag]
-                audio.tags.add(frame(encoding=3, text=value))
-            audio.save()
-            print(f"WAV tags saved successfully for {self.file_name}")
-            self.show_success_label()
-            self.cleanup_temp_cover()
-        except Exception as e:
-            print(f"Error saving WAV tags: {e}")
+    def clear_chosen_cover(self):
+        self.cover_data = None
+        self.cover_art_selected = False
 
     def hide_tag_options(self):
+        self.stop_watching()
         # Destroy tag widgets if they exist
         for widget in getattr(self, 'tag_widgets', {}).values():
             widget.destroy()
@@ -480,6 +451,16 @@ class AudioTagEditor:
             self.cover_art_button.destroy()
         if hasattr(self, 'cover_art_label') and self.cover_art_label:
             self.cover_art_label.destroy()
+        if hasattr(self, 'save_button') and self.save_button:
+            self.save_button.destroy()
+        if hasattr(self, 'filename_button') and self.filename_button:
+            self.filename_button.destroy()
+
+    def show_filename_tags(self):
+        if not self.tag_files:
+            print("No files loaded to take tags from.")
+            return
+        FilenameTagsDialog(self)
 
     def choose_cover_art(self):
         art_path = filedialog.askopenfilename(
@@ -487,21 +468,317 @@ class AudioTagEditor:
             filetypes=(("Image Files", "*.jpg *.jpeg *.png *.bmp *.gif *.webp"), ("All Files", "*.*"))
         )
         if art_path:
-            self.cover_art_label.config(text=f"Selected cover art: {os.path.basename(art_path)}")
-            img = Image.open(art_path)
-            img.thumbnail((150, 150))
-            self.cover_art_image = ImageTk.PhotoImage(img)
-            self.cover_art_label.config(image=self.cover_art_image, text="")
-            with tempfile.NamedTemporaryFile(prefix="ATE_", suffix=".png", delete=False) as tmp:
-                self.cleanup_temp_cover()
-                self.temp_path = tmp.name
-                img.save(self.temp_path, format='PNG')
-                print(f"Temporary cover art saved at: {self.temp_path}")
-            self.cover_art_selected = True
+            self.cover_art_label.config(image="", text=f"Loading {os.path.basename(art_path)}...")
+            self.runner.submit(prepare_chosen_cover, art_path, self.preview_cache,
+                               self.cover_max_dimension, self.cover_quality, key="cover",
+                               on_done=self.on_cover_art_ready, on_error=self.on_cover_art_error)
         else:
             self.cover_art_label.config(image="", text="No cover art selected.")
 
-if __name__ == "__main__":
+    def on_cover_art_ready(self, result):
+        self.cover_data, preview = result
+        from PIL import ImageTk
+        self.cover_art_image = ImageTk.PhotoImage(preview)
+        self.cover_art_label.config(image=self.cover_art_image, text="")
+        print(f"Cover art ready to embed ({len(self.cover_data)} bytes)")
+        self.cover_art_selected = True
+
+    def on_cover_art_error(self, error):
+        print(f"Error loading cover art: {error}")
+        self.cover_art_label.config(image="", text="Could not read cover art.")
+        self.clear_chosen_cover()
+
+    def close(self):
+        self.stop_watching()
+        if self.library_browser is not None:
+            self.library_browser.close()
+        # Pending saves still run to completion before the process exits
+        self.runner.shutdown()
+        self.root.destroy()
+
+
+class FilenameTagsDialog:
+    """Previews the tags a path template gives the open files, and saves them.
+
+    The template is compiled once and matched against every open path in
+    one go; only values that differ from the files' current tags are
+    shown and saved.
+    """
+
+    # Rows put in the preview table, the rest are still saved
+    PREVIEW_ROWS = 1000
+
+    def __init__(self, editor):
+        self.editor = editor
+        self.jobs = []
+        self.window = tk.Toplevel(editor.root)
+        self.window.title("Tags from Filenames")
+        tk.Label(self.window, text="Template:").grid(row=0, column=0, sticky="e", padx=5, pady=5)
+        self.entry = tk.Entry(self.window, width=40)
+        self.entry.insert(0, DEFAULT_PATH_TEMPLATE)
+        self.entry.grid(row=0, column=1, sticky="we", padx=5)
+        self.entry.bind("<Return>", lambda event: self.preview())
+        tk.Button(self.window, text="Preview", command=self.preview).grid(row=0, column=2, padx=5)
+        self.table = ttk.Treeview(self.window, show="headings", height=15)
+        self.table.grid(row=1, column=0, columnspan=3, sticky="nsew", padx=5)
+        scrollbar = ttk.Scrollbar(self.window, orient="vertical", command=self.table.yview)
+        scrollbar.grid(row=1, column=3, sticky="ns")
+        self.table.config(yscrollcommand=scrollbar.set)
+        self.status = tk.Label(self.window, text="")
+        self.status.grid(row=2, column=0, columnspan=2, sticky="w", padx=5)
+        self.apply_button = tk.Button(self.window, text="Apply", command=self.apply, state="disabled")
+        self.apply_button.grid(row=2, column=2, pady=5)
+        self.window.columnconfigure(1, weight=1)
+        self.window.rowconfigure(1, weight=1)
+        self.preview()
+
+    def preview(self):
+        import path_templates
+        self.jobs = []
+        self.table.delete(*self.table.get_children())
+        try:
+            template = path_templates.PathTemplate(self.entry.get())
+        except ValueError as e:
+            self.status.config(text=str(e), fg="red")
+            self.apply_button.config(state="disabled")
+            return
+        tag_files = {tag_file.path: tag_file for tag_file in self.editor.tag_files}
+        current = {path: tag_file.fields for path, tag_file in tag_files.items()}
+        plan, unmatched = path_templates.plan_tags(template, list(tag_files), current)
+        self.jobs = [(tag_files[path], fields, None) for path, fields in plan]
+
+        columns = ["file"] + [f"field{i}" for i in range(len(template.fields))]
+        self.table.config(columns=columns)
+        self.table.heading("file", text="File")
+        self.table.column("file", width=200)
+        for column, field in zip(columns[1:], template.fields):
+            self.table.heading(column, text=field)
+            self.table.column(column, width=120)
+        for path, fields in plan[:self.PREVIEW_ROWS]:
+            # Blank cells are values the file already has
+            values = [os.path.basename(path)] + [fields.get(field, "") for field in template.fields]
+            self.table.insert("", tk.END, values=values)
+        self.status.config(text=f"{len(plan)} file(s) to change, {unmatched} don't match the template.",
+                           fg="black")
+        self.apply_button.config(state="normal" if self.jobs else "disabled")
+
+    def apply(self):
+        if self.editor.save_task is not None:
+            self.status.config(text="Wait for the current save to finish.", fg="red")
+            return
+        print(f"Saving tags from filenames for {len(self.jobs)} file(s)")
+        self.editor.refresh_after_save = True
+        self.editor.start_save(self.jobs)
+        self.window.destroy()
+
+
+# Work functions run on the BackgroundRunner's threads, they must not touch Tk widgets
+
+# Held while the open files are saved or reloaded, so a reload never reads a
+# file a save is writing
+_file_lock = threading.Lock()
+
+def load_tag_files(task, file_paths, folder, preview_cache):
+    """Parse files concurrently and work out whether they share cover art.
+
+    Returns (tag_files, errors, preview, shared_cover) where preview is the
+    cover preview when every file has the same cover (or None without one).
+    """
+    if folder:
+        from batch import iter_audio_files
+        file_paths = sorted(iter_audio_files(folder))
+    tag_files, errors = [], []
+    with ThreadPoolExecutor(max_workers=FILE_IO_WORKERS) as executor:
+        futures = [executor.submit(tagcore.TagFile, path) for path in file_paths]
+        for done, (path, future) in enumerate(zip(file_paths, futures), start=1):
+            if task.cancelled:
+                for pending in futures:
+                    pending.cancel()
+                return [], [], None, False
+            try:
+                tag_files.append(future.result())
+            except Exception as e:
+                errors.append((path, e))
+            task.report(done, len(file_paths))
+    cover_data = {tag_file.cover for tag_file in tag_files}
+    shared_cover = len(cover_data) <= 1
+    preview = None
+    cover = cover_data.pop() if shared_cover and cover_data else None
+    if cover and not task.cancelled:
+        try:
+            preview = preview_cache.get(cover)
+        except Exception as e:
+            print(f"Error displaying cover art: {e}")
+    return tag_files, errors, preview, shared_cover
+
+
+def reload_tag_files(task, tag_files, touched, new_paths, preview_cache, rescan=False, folder=None):
+    """Re-read the touched files that really changed and load files new to an open folder.
+
+    With ``rescan``, files that are gone are dropped, and files new to an
+    open ``folder`` are found by listing it again.  Returns (tag_files,
+    reloaded, errors, preview, shared_cover); files that can no longer be
+    read are left out of tag_files.
+    """
+    with _file_lock:
+        broken = set()
+        errors = []
+        reloaded = 0
+        if rescan and folder:
+            from batch import iter_audio_files
+            open_paths = {os.path.abspath(tag_file.path) for tag_file in tag_files}
+            new_paths = [path for path in sorted(iter_audio_files(folder))
+                         if os.path.abspath(path) not in open_paths]
+        for tag_file in touched:
+            if rescan and not os.path.exists(tag_file.path):
+                broken.add(id(tag_file))
+                continue
+            try:
+                if not tag_file.changed_on_disk():
+                    # Our own save, or a touch that left the file as it was
+                    continue
+                tag_file.load()
+                reloaded += 1
+            except Exception as e:
+                broken.add(id(tag_file))
+                errors.append((tag_file.path, e))
+        tag_files = [tag_file for tag_file in tag_files if id(tag_file) not in broken]
+        for path in new_paths:
+            try:
+                tag_files.append(tagcore.TagFile(path))
+                reloaded += 1
+            except Exception as e:
+                errors.append((path, e))
+        cover_data = {tag_file.cover for tag_file in tag_files}
+        shared_cover = len(cover_data) <= 1
+        cover = cover_data.pop() if shared_cover and cover_data else None
+        preview = None
+        if cover:
+            try:
+                preview = preview_cache.get(cover)
+            except Exception as e:
+                print(f"Error displaying cover art: {e}")
+        return tag_files, reloaded, errors, preview, shared_cover
+
+
+def watch_directories(task, directories, recursive):
+    """Report settled batches of file changes (see watcher.py) until cancelled."""
+    import watcher
+    watcher.watch(directories, task.report, recursive=recursive, should_stop=lambda: task.cancelled)
+
+
+def save_tag_files(task, jobs):
+    """Save (tag_file, fields, cover) jobs concurrently, skipping the rest once cancelled.
+
+    Files whose tags already have the given values are left alone by
+    TagFile.save, so only files that actually change get rewritten.  The
+    values the saves replace are journaled first, so "main.py journal
+    undo" can put them back.  The files are saved even when that fails.
+    """
+    with _file_lock:
+        results = []
+        batch_dir = journal_saves(jobs)
+        with ThreadPoolExecutor(max_workers=FILE_IO_WORKERS) as executor:
+            def save(job):
+                tag_file, fields, cover = job
+                if task.cancelled:
+                    return None
+                try:
+                    return tag_file, tag_file.save(fields, cover), None
+                except Exception as e:
+                    return tag_file, False, e
+
+            for result in executor.map(save, jobs):
+                if result is not None:
+                    results.append(result)
+                    task.report(len(results), len(jobs))
+    if batch_dir is not None:
+        finish_journal(batch_dir)
+    return results
+
+
+def journal_saves(jobs):
+    """Journal the values (tag_file, fields, cover) jobs will replace; returns the batch directory, or None."""
+    import journal
+    try:
+        batch_dir = journal.begin(f"editor save of {len(jobs)} files")
+    except OSError as e:
+        print(f"Error journaling the save, it can't be undone: {e}")
+        return None
+    segment = journal.Segment(batch_dir)
+    for tag_file, fields, cover in jobs:
+        try:
+            segment.record(tag_file, fields, cover)
+        except Exception as e:
+            print(f"Error journaling {tag_file.path}, its save can't be undone: {e}")
+    try:
+        segment.sync()
+    except OSError as e:
+        print(f"Error journaling the save, it can't be undone: {e}")
+    return batch_dir
+
+
+def finish_journal(batch_dir):
+    import journal
+    try:
+        if journal.finish(batch_dir):
+            # Editor saves would otherwise pile up along with every cover they replaced
+            journal.prune(JOURNAL_KEEP, os.path.dirname(batch_dir))
+    except OSError as e:
+        print(f"Error finishing the save's journal: {e}")
+
+
+def prepare_chosen_cover(task, art_path, preview_cache, max_dimension, quality):
+    with open(art_path, "rb") as img_file:
+        image_data = img_file.read()
+    # The preview is decoded separately, the embedded bytes stay full size
+    preview = preview_cache.get(image_data)
+    return covers.prepare_cover(image_data, max_dimension, quality), preview
+
+# Command line modes, mapped to the module that implements them
+COMMANDS = {
+    "batch": "batch",
+    "index": "library_index",
+    "tags": "tag_exchange",
+    "paths": "path_templates",
+    "serve": "service",
+    "journal": "journal",
+}
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    argv, profile_output = startup_profile.strip_flag(argv)
+    startup_profile.mark("main() started")
+    # AUDIO_TAG_TRACE=<file> times every tag read, save and cover decode
+    instrumentation.enable_from_environment()
+    if argv and argv[0] in COMMANDS:
+        command = importlib.import_module(COMMANDS[argv[0]])
+        if startup_profile.active():
+            startup_profile.mark(f"{argv[0]} command imported")
+            startup_profile.finish(profile_output)
+        return command.main(argv[1:])
+    global tk, filedialog, ttk
+    import tkinter as tk
+    from tkinter import filedialog, ttk
+    startup_profile.mark("tkinter imported")
     root = tk.Tk()
+    startup_profile.mark("Tk root created")
     app = AudioTagEditor(root)
-    root.mainloop()
\ No newline at end of file
+    startup_profile.mark("editor built")
+    if startup_profile.active():
+        def first_window_drawn():
+            root.update_idletasks()
+            startup_profile.mark("first window drawn")
+            startup_profile.finish(profile_output)
+        root.after_idle(first_window_drawn)
+    root.mainloop()
+    return 0
+
+
+if __name__ == "__main__":
+    if getattr(sys, "frozen", False):
+        # Process pool workers of the PyInstaller build re-enter here
+        import multiprocessing
+        multiprocessing.freeze_support()
+    sys.exit(main())
@@ -0,0 +1,331 @@
+"""Fill in tags from file paths, or rename files from their tags, with one template.
+
+A template is a path relative to some library root with placeholders for
+fields, e.g. ``{artist}/{album}/{track} - {title}``.  Placeholder names
+are the ones batch manifests accept (title, artist, album, genre, year);
+any other name, like ``{track}`` or ``{_}``, matches text that is left
+out.  The template is matched against the last components of a path, and
+the file extension is never part of it.
+"""
+import os
+import re
+import sys
+import string
+import argparse
+
+import tagcore
+import batch
+
+
+# Written for fields that are empty when renaming
+UNKNOWN_VALUE = "Unknown"
+
+# Characters that can't appear in a file name on Windows
+_UNSAFE_CHARS = re.compile(r'[<>:"/\\|?*\x00-\x1f]')
+
+
+class PathTemplate:
+    """A template compiled once into regexes for matching and a format string for renaming."""
+
+    def __init__(self, template):
+        self.template = template.strip().replace("\\", "/").strip("/")
+        if not self.template:
+            raise ValueError("Empty template")
+        self.fields = []
+        self._format_parts = []
+        directory, _sep, name = self.template.rpartition("/")
+        # The directory part is matched once per directory, the file name part once per file
+        self._directory = self._compile(directory, template) if directory else None
+        self._name = self._compile(name, template)
+        if not self.fields:
+            raise ValueError(f"Template {template!r} has no field placeholders")
+        self.depth = self.template.count("/") + 1
+
+    def _compile(self, part, template):
+        """Return (regex, {group: field}) for one side of the template."""
+        if self._format_parts:
+            self._format_parts.append(("/", None))
+        try:
+            parsed = list(string.Formatter().parse(part))
+        except ValueError as e:
+            raise ValueError(f"Invalid template {template!r}: {e}") from None
+        pattern = []
+        groups = {}
+        for literal, name, _spec, _conversion in parsed:
+            pattern.append(re.escape(literal))
+            self._format_parts.append((literal, None))
+            if name is None:
+                continue
+            if not name:
+                raise ValueError(f"Invalid template {template!r}: empty placeholder")
+            field = tagcore.normalize_field_name(name)
+            self._format_parts.append(("", field or name))
+            if field and field not in self.fields:
+                self.fields.append(field)
+                group = f"g{len(self.fields)}"
+                groups[group] = field
+                pattern.append(f"(?P<{group}>[^/]+?)")
+            else:
+                # A repeated field or a skipped placeholder, match it but don't capture it
+                pattern.append("[^/]+?")
+        return re.compile("".join(pattern), re.DOTALL), groups
+
+    def _split(self, path):
+        """Return (directory components, file name without extension) the template covers, or None."""
+        parts = _normalize_path(path).rsplit("/", self.depth)
+        if len(parts) < self.depth:
+            return None
+        name = os.path.splitext(parts[-1])[0]
+        return "/".join(parts[len(parts) - self.depth:-1]), name
+
+    def _match_directory(self, directory):
+        if self._directory is None:
+            return {}
+        regex, groups = self._directory
+        match = regex.fullmatch(directory)
+        return {field: match.group(group).strip() for group, field in groups.items()} if match else None
+
+    def _match_name(self, name, directory_fields):
+        regex, groups = self._name
+        match = regex.fullmatch(name)
+        if match is None:
+            return None
+        fields = dict(directory_fields)
+        fields.update((field, match.group(group).strip()) for group, field in groups.items())
+        return fields
+
+    def match(self, path):
+        """Return the fields a single path gives, or None if it doesn't fit the template."""
+        split = self._split(path)
+        if split is None:
+            return None
+        directory_fields = self._match_directory(split[0])
+        return None if directory_fields is None else self._match_name(split[1], directory_fields)
+
+    def match_many(self, paths):
+        """Match a list of paths at once, returning a list of field dicts (None where a path doesn't fit).
+
+        Tracks of an album share their directory, so the directory side
+        of the template is matched once per distinct directory and only
+        the file name is matched per file.
+        """
+        directories = {}
+        results = []
+        for path in paths:
+            split = self._split(path)
+            if split is None:
+                results.append(None)
+                continue
+            directory, name = split
+            if directory not in directories:
+                directories[directory] = self._match_directory(directory)
+            directory_fields = directories[directory]
+            results.append(None if directory_fields is None else self._match_name(name, directory_fields))
+        return results
+
+    def format(self, fields):
+        """Return the relative path (without extension) the template gives for these field values."""
+        parts = []
+        for literal, field in self._format_parts:
+            if field is None:
+                parts.append(literal)
+            elif field not in tagcore.FIELDS:
+                raise ValueError(f"{{{field}}} can't be filled in from tags when renaming")
+            else:
+                parts.append(_safe_name(fields.get(field, "")))
+        return "/".join(part.strip(" .") or UNKNOWN_VALUE for part in "".join(parts).split("/"))
+
+    def target_path(self, path, fields, root):
+        """Return where ``path`` goes under ``root`` when renamed from its tags, keeping the extension."""
+        extension = os.path.splitext(path)[1]
+        return os.path.join(root, *self.format(fields).split("/")) + extension
+
+
+def _normalize_path(path):
+    return path.replace(os.sep, "/") if os.sep != "/" else path
+
+
+def _safe_name(value):
+    value = _UNSAFE_CHARS.sub("_", str(value).strip())
+    return value or UNKNOWN_VALUE
+
+
+def read_all_tags(paths, workers=None):
+    """Return {path: fields} for the given files, read across the batch process pool."""
+    tags = {}
+
+    def on_result(result):
+        if result["status"] == "error":
+            _print_error(result)
+        else:
+            tags[result["path"]] = result["fields"]
+
+    jobs = ({"path": path, "fields": {}, "cover": None} for path in paths)
+    batch.run_batch(jobs, workers=workers, on_result=on_result)
+    return tags
+
+
+def _print_error(result):
+    if result["status"] == "error":
+        print(f"error     {result['path']}: {result['error']}", file=sys.stderr)
+
+
+def plan_tags(template, paths, current=None):
+    """Return (plan, unmatched): (path, changes) pairs for the paths the template
+    matches, and the number of paths it doesn't.
+
+    ``changes`` maps each field to its new value.  When ``current`` maps
+    paths to their existing fields, only values that differ are kept and
+    files with nothing to change are left out.
+    """
+    plan = []
+    unmatched = 0
+    for path, fields in zip(paths, template.match_many(paths)):
+        if fields is None:
+            unmatched += 1
+            continue
+        if current is not None:
+            existing = current.get(path)
+            if existing is None:
+                continue
+            fields = {field: value for field, value in fields.items() if existing.get(field, "") != value}
+        if fields:
+            plan.append((path, fields))
+    return plan, unmatched
+
+
+def plan_renames(template, root, current):
+    """Return (renames, conflicts) for moving each file to where its tags put it under root.
+
+    ``renames`` lists (source, target) pairs; ``conflicts`` lists (source,
+    target, reason) for files that would overwrite another file or land
+    on the same name as another file of the batch.
+    """
+    renames, conflicts = [], []
+    claimed = {}
+    for path, fields in sorted(current.items()):
+        target = template.target_path(path, fields, root)
+        if os.path.abspath(target) == os.path.abspath(path):
+            continue
+        key = os.path.normcase(os.path.abspath(target))
+        if key in claimed:
+            conflicts.append((path, target, f"same name as {claimed[key]}"))
+            continue
+        claimed[key] = path
+        if os.path.exists(target) and not _same_file(path, target):
+            conflicts.append((path, target, "target exists"))
+            continue
+        renames.append((path, target))
+    return renames, conflicts
+
+
+def _same_file(a, b):
+    # On a case-insensitive file system a change of case is the same file
+    try:
+        return os.path.samefile(a, b)
+    except OSError:
+        return False
+
+
+def apply_renames(renames, root):
+    """Move files to their new names, removing directories the moves left empty.
+
+    Returns (renamed, errors) where errors lists (source, error) pairs.
+    """
+    renamed, errors = 0, []
+    emptied = set()
+    for source, target in renames:
+        try:
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            if os.path.exists(target) and not _same_file(source, target):
+                raise FileExistsError(f"{target} already exists")
+            os.rename(source, target)
+            renamed += 1
+            emptied.add(os.path.dirname(os.path.abspath(source)))
+        except OSError as e:
+            errors.append((source, e))
+    root = os.path.abspath(root)
+    # Deepest directories first, never above the root
+    for directory in sorted(emptied, key=len, reverse=True):
+        while directory != root and directory.startswith(os.path.join(root, "")):
+            try:
+                os.rmdir(directory)
+            except OSError:
+                break
+            directory = os.path.dirname(directory)
+    return renamed, errors
+
+
+def print_table(rows, headers, max_width=40):
+    """Print rows as aligned columns, cutting long values short."""
+    if not rows:
+        return
+    def cut(value):
+        value = str(value)
+        return value if len(value) <= max_width else value[:max_width - 1] + "…"
+
+    rows = [[cut(value) for value in row] for row in rows]
+    widths = [max([len(header)] + [len(row[i]) for row in rows]) for i, header in enumerate(headers)]
+    print("  ".join(header.ljust(width) for header, width in zip(headers, widths)).rstrip())
+    print("  ".join("-" * width for width in widths))
+    for row in rows:
+        print("  ".join(value.ljust(width) for value, width in zip(row, widths)).rstrip())
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="main.py paths",
+                                     description="Tag files from their paths, or rename them from their tags.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    for name, help_text in (("tags", "Fill in tags from each file's path"),
+                            ("rename", "Move each file to the path its tags give under the directory")):
+        command = commands.add_parser(name, help=help_text)
+        command.add_argument("directory")
+        command.add_argument("template", help='e.g. "{artist}/{album}/{track} - {title}"')
+        command.add_argument("--apply", action="store_true",
+                             help="Make the changes; without it only the preview is printed")
+        command.add_argument("--limit", type=int, default=50, help="Rows shown in the preview (0 for all)")
+        command.add_argument("--workers", type=int, default=None, help="Worker processes (default: CPU count)")
+    return parser
+
+
+def main(argv):
+    args = build_parser().parse_args(argv)
+    try:
+        template = PathTemplate(args.template)
+        if args.command == "rename":
+            # Fail before reading anything if the template can't be filled in
+            template.format({})
+    except ValueError as e:
+        print(f"Error: {e}", file=sys.stderr)
+        return 2
+    paths = sorted(batch.iter_audio_files(args.directory))
+    current = read_all_tags(paths, args.workers)
+    shown = slice(None if args.limit == 0 else args.limit)
+
+    if args.command == "tags":
+        plan, unmatched = plan_tags(template, paths, current)
+        rows = [[os.path.relpath(path, args.directory)] + [fields.get(field, "") for field in template.fields]
+                for path, fields in plan[shown]]
+        print_table(rows, ["path"] + template.fields)
+        print(f"{len(plan)} of {len(paths)} files would change, {unmatched} don't match the template")
+        if not args.apply or not plan:
+            return 0
+        jobs = ({"path": path, "fields": fields, "cover": None} for path, fields in plan)
+        summary = batch.run_batch(jobs, workers=args.workers, on_result=_print_error)
+        print(f"{summary['written']} files written, {summary['errors']} errors in {summary['seconds']:.2f}s")
+        return 1 if summary["errors"] else 0
+
+    renames, conflicts = plan_renames(template, args.directory, current)
+    rows = [[os.path.relpath(source, args.directory), os.path.relpath(target, args.directory)]
+            for source, target in renames[shown]]
+    print_table(rows, ["from", "to"], max_width=60)
+    for source, target, reason in conflicts:
+        print(f"skipped   {source}: {reason} ({target})", file=sys.stderr)
+    print(f"{len(renames)} of {len(paths)} files would move, {len(conflicts)} skipped")
+    if not args.apply or not renames:
+        return 0
+    renamed, errors = apply_renames(renames, args.directory)
+    for source, error in errors:
+        print(f"error     {source}: {error}", file=sys.stderr)
+    print(f"{renamed} files renamed, {len(errors)} errors")
+    return 1 if errors else 0
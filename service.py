@@ -0,0 +1,416 @@
+"""Serve tag reads and writes over a local HTTP/JSON API.
+
+Scripts on the same machine submit jobs instead of starting a process
+per file:
+
+    POST /jobs          {"type": "read", "items": ["/music/a.mp3", ...]}
+                        {"type": "write", "items": [{"path": ..., "fields": {"artist": ...}}]}
+                        {"type": "cover", "cover": "/art/front.jpg", "items": ["/music/a.mp3", ...]}
+                        -> 202 {"id": ..., "status": "queued", ...}
+    GET /jobs/<id>      status and progress; results once done (?results=0 leaves them out)
+    DELETE /jobs/<id>   cancel a job that hasn't started
+    GET /health         queue and worker counts
+
+Jobs wait in a bounded queue and run on a pool of worker processes that
+stays up for the life of the server.  When the queue is full, new jobs
+get 503 with a Retry-After header.  Connections are kept alive between
+requests.  The server only listens on the loopback interface.
+"""
+import os
+import sys
+import json
+import time
+import queue
+import uuid
+import argparse
+import threading
+from collections import OrderedDict
+from concurrent.futures.process import BrokenProcessPool
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs
+
+import tagcore
+import batch
+
+
+HOST = "127.0.0.1"
+DEFAULT_PORT = 8765
+
+# Jobs waiting to run, and the files they may hold between them
+QUEUE_SIZE = 256
+MAX_QUEUED_ITEMS = 50000
+MAX_ITEMS_PER_JOB = 10000
+MAX_BODY_SIZE = 16 * 1024 * 1024
+
+# Jobs run at the same time; each feeds its files to the shared process pool
+JOB_THREADS = 2
+
+# Finished jobs kept for status polling, oldest dropped first once there
+# are more jobs, more results between them, or they're older than this
+KEEP_FINISHED = 1000
+KEEP_RESULTS = 100000
+KEEP_SECONDS = 3600
+
+# Seconds an idle keep-alive connection stays open
+IDLE_TIMEOUT = 60
+
+JOB_TYPES = ("read", "write", "cover")
+
+
+class JobError(ValueError):
+    """A submitted job that can't be accepted; ``status`` is the HTTP status to answer with."""
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+class Job:
+    def __init__(self, job_type, items, cover_options):
+        self.id = uuid.uuid4().hex
+        self.type = job_type
+        self.items = items
+        self.cover_options = cover_options
+        self.status = "queued"
+        self.results = []
+        self.summary = None
+        self.error = None
+        self.submitted = time.time()
+        self.started = None
+        self.finished = None
+
+    def to_dict(self, with_results=True):
+        data = {
+            "id": self.id,
+            "type": self.type,
+            "status": self.status,
+            "items": len(self.items),
+            "done": len(self.results),
+            "submitted": self.submitted,
+            "started": self.started,
+            "finished": self.finished,
+        }
+        if self.summary is not None:
+            data["summary"] = self.summary
+        if self.error is not None:
+            data["error"] = self.error
+        if with_results and self.status in ("done", "failed"):
+            data["results"] = self.results
+        return data
+
+
+def parse_job(data):
+    """Turn a submitted JSON body into a Job, raising JobError when it's invalid."""
+    if not isinstance(data, dict):
+        raise JobError("Expected a JSON object")
+    job_type = data.get("type")
+    if job_type not in JOB_TYPES:
+        raise JobError(f"'type' must be one of {', '.join(JOB_TYPES)}")
+    items = data.get("items")
+    if not isinstance(items, list) or not items:
+        raise JobError("'items' must be a non-empty list")
+    if len(items) > MAX_ITEMS_PER_JOB:
+        raise JobError(f"At most {MAX_ITEMS_PER_JOB} items per job", status=413)
+    cover_options = {}
+    for option in ("max_dimension", "quality"):
+        value = data.get(option)
+        if value is None:
+            continue
+        if not isinstance(value, int) or isinstance(value, bool) or value <= 0:
+            raise JobError(f"'{option}' must be a positive integer")
+        cover_options[option] = value
+
+    jobs = []
+    for item in items:
+        if isinstance(item, str):
+            item = {"path": item}
+        if not isinstance(item, dict) or not isinstance(item.get("path"), str):
+            raise JobError("Every item needs a 'path'")
+        fields = {}
+        if job_type == "write":
+            if not isinstance(item.get("fields") or {}, dict):
+                raise JobError(f"'fields' must be an object for {item['path']}")
+            for name, value in (item.get("fields") or {}).items():
+                field = tagcore.normalize_field_name(name)
+                if field is None:
+                    raise JobError(f"Unknown field: {name}")
+                if isinstance(value, (dict, list)):
+                    raise JobError(f"'{name}' must be a string or number for {item['path']}")
+                fields[field] = "" if value is None else str(value)
+            if not fields:
+                raise JobError(f"No fields to write for {item['path']}")
+        cover = None
+        if job_type == "cover":
+            cover = item.get("cover") or data.get("cover")
+            if not cover:
+                raise JobError(f"No cover image for {item['path']}")
+            if not isinstance(cover, str):
+                raise JobError(f"'cover' must be an image path for {item['path']}")
+        jobs.append({"path": item["path"], "fields": fields, "cover": cover})
+    return Job(job_type, jobs, cover_options)
+
+
+class JobQueue:
+    """Accepts jobs up to a limit and runs them on threads sharing one process pool."""
+
+    def __init__(self, workers=None, threads=JOB_THREADS, size=QUEUE_SIZE, max_items=MAX_QUEUED_ITEMS):
+        self.workers = workers or os.cpu_count() or 1
+        self.size = size
+        self.max_items = max_items
+        # Counted here rather than bounded by the queue, which still holds
+        # cancelled jobs until a thread takes them off it
+        self.queue = queue.Queue()
+        self.jobs = OrderedDict()
+        self.queued_jobs = 0
+        self.queued_items = 0
+        self.lock = threading.Lock()
+        # Started once, so no request pays for spawning worker processes
+        self.executor = batch.make_executor(self.workers)
+        self.threads = [threading.Thread(target=self._run, name=f"job-{i}", daemon=True) for i in range(threads)]
+        for thread in self.threads:
+            thread.start()
+
+    def submit(self, job):
+        with self.lock:
+            if self.queued_jobs >= self.size:
+                raise JobError("Job queue is full, retry later", status=503)
+            if self.queued_items + len(job.items) > self.max_items:
+                raise JobError("Too many files queued, retry later", status=503)
+            self.queue.put(job)
+            self.queued_jobs += 1
+            self.queued_items += len(job.items)
+            self.jobs[job.id] = job
+            self._forget_finished()
+
+    def _forget_finished(self):
+        # Called with the lock held
+        finished = [job for job in self.jobs.values() if job.finished is not None]
+        finished.sort(key=lambda job: job.finished, reverse=True)
+        cutoff = time.time() - KEEP_SECONDS
+        kept = results = 0
+        for job in finished:
+            kept += 1
+            results += len(job.results)
+            if kept > KEEP_FINISHED or results > KEEP_RESULTS or job.finished < cutoff:
+                del self.jobs[job.id]
+
+    def get(self, job_id):
+        with self.lock:
+            return self.jobs.get(job_id)
+
+    def cancel(self, job_id):
+        """Cancel a queued job; returns the job, or None when there's no such job."""
+        with self.lock:
+            job = self.jobs.get(job_id)
+            if job is not None and job.status == "queued":
+                job.status = "cancelled"
+                job.finished = time.time()
+                self.queued_jobs -= 1
+                self.queued_items -= len(job.items)
+            return job
+
+    def stats(self):
+        with self.lock:
+            statuses = {}
+            for job in self.jobs.values():
+                statuses[job.status] = statuses.get(job.status, 0) + 1
+            return {
+                "queued_jobs": self.queued_jobs,
+                "queue_size": self.size,
+                "queued_items": self.queued_items,
+                "max_queued_items": self.max_items,
+                "workers": self.workers,
+                "jobs": statuses,
+            }
+
+    def _run(self):
+        while True:
+            job = self.queue.get()
+            if job is None:
+                return
+            with self.lock:
+                if job.status == "cancelled":
+                    continue
+                job.status = "running"
+                job.started = time.time()
+                self.queued_jobs -= 1
+                self.queued_items -= len(job.items)
+                executor = self.executor
+            try:
+                job.summary = batch.run_batch(job.items, workers=self.workers, on_result=job.results.append,
+                                              cover_options=job.cover_options, executor=executor)
+                job.status = "done"
+            except BrokenProcessPool as e:
+                # A worker died; later jobs get a fresh pool
+                self._replace_executor(executor)
+                job.error = f"{type(e).__name__}: {e}"
+                job.status = "failed"
+            except Exception as e:
+                job.error = f"{type(e).__name__}: {e}"
+                job.status = "failed"
+            with self.lock:
+                job.finished = time.time()
+                self._forget_finished()
+
+    def _replace_executor(self, broken):
+        with self.lock:
+            # Another job thread may have replaced it already
+            if self.executor is not broken:
+                return
+            self.executor = batch.make_executor(self.workers)
+        broken.shutdown(wait=False)
+
+    def close(self):
+        for _thread in self.threads:
+            self.queue.put(None)
+        for thread in self.threads:
+            thread.join()
+        self.executor.shutdown()
+
+
+class RequestHandler(BaseHTTPRequestHandler):
+    # HTTP/1.1 keeps connections open between requests
+    protocol_version = "HTTP/1.1"
+    timeout = IDLE_TIMEOUT
+    # Headers and body go out in separate writes; without this a kept-alive
+    # connection waits on delayed ACKs for every small response
+    disable_nagle_algorithm = True
+    server_version = "AudioTagEditor"
+
+    def send_json(self, status, data, headers=None):
+        body = json.dumps(data).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_error_json(self, status, message, headers=None):
+        self.send_json(status, {"error": message}, headers)
+
+    def read_body(self):
+        try:
+            length = int(self.headers.get("Content-Length") or 0)
+        except ValueError:
+            length = -1
+        if length < 0:
+            # Without a usable length the body can't be skipped either
+            self.close_connection = True
+            raise JobError("Invalid Content-Length")
+        if length > MAX_BODY_SIZE:
+            # The body isn't read, so the connection can't be reused
+            self.close_connection = True
+            raise JobError("Request body too large", status=413)
+        return self.rfile.read(length)
+
+    def local_request(self):
+        # Refuse pages in a browser reaching this server through a rebound DNS name
+        host = (self.headers.get("Host") or "").rsplit(":", 1)[0]
+        if host not in ("127.0.0.1", "localhost", "[::1]"):
+            self.send_error_json(403, "Only local requests are accepted")
+            return False
+        return True
+
+    def do_GET(self):
+        if not self.local_request():
+            return
+        url = urlsplit(self.path)
+        if url.path == "/health":
+            self.send_json(200, self.server.jobs.stats())
+            return
+        job = self.job_for(url.path)
+        if job is not None:
+            with_results = parse_qs(url.query).get("results", ["1"])[0] != "0"
+            self.send_json(200, job.to_dict(with_results))
+
+    def do_POST(self):
+        if not self.local_request():
+            return
+        try:
+            body = self.read_body()
+            if urlsplit(self.path).path != "/jobs":
+                self.send_error_json(404, "Not found")
+                return
+            # A JSON content type can't be sent by a plain cross-site form
+            if self.headers.get_content_type() != "application/json":
+                raise JobError("Content-Type must be application/json", status=415)
+            try:
+                data = json.loads(body)
+            except ValueError as e:
+                raise JobError(f"Invalid JSON: {e}") from None
+            job = parse_job(data)
+            self.server.jobs.submit(job)
+        except JobError as e:
+            headers = {"Retry-After": "1"} if e.status == 503 else None
+            self.send_error_json(e.status, str(e), headers)
+            return
+        self.send_json(202, job.to_dict(), {"Location": f"/jobs/{job.id}"})
+
+    def do_DELETE(self):
+        if not self.local_request():
+            return
+        job = self.job_for(urlsplit(self.path).path)
+        if job is None:
+            return
+        job = self.server.jobs.cancel(job.id)
+        if job is None:
+            # It ran and was forgotten since the lookup
+            self.send_error_json(409, "Job is no longer queued, only queued jobs can be cancelled")
+        elif job.status == "cancelled":
+            self.send_json(200, job.to_dict(with_results=False))
+        else:
+            self.send_error_json(409, f"Job is {job.status}, only queued jobs can be cancelled")
+
+    def job_for(self, path):
+        """Return the job a /jobs/<id> path names, answering 404 when there isn't one."""
+        prefix, _sep, job_id = path.rpartition("/")
+        job = self.server.jobs.get(job_id) if prefix == "/jobs" else None
+        if job is None:
+            self.send_error_json(404, "Not found")
+        return job
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+
+class TagServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, port=DEFAULT_PORT, workers=None, verbose=False):
+        super().__init__((HOST, port), RequestHandler)
+        self.jobs = JobQueue(workers)
+        self.verbose = verbose
+
+    def server_close(self):
+        super().server_close()
+        self.jobs.close()
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="main.py serve",
+                                     description="Serve tag reads and writes over HTTP on localhost.")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT, help=f"Port to listen on (default: {DEFAULT_PORT})")
+    parser.add_argument("--workers", type=int, default=None, help="Worker processes (default: CPU count)")
+    parser.add_argument("--verbose", action="store_true", help="Log every request")
+    return parser
+
+
+def main(argv):
+    args = build_parser().parse_args(argv)
+    try:
+        server = TagServer(args.port, args.workers, args.verbose)
+    except OSError as e:
+        print(f"Error: can't listen on {HOST}:{args.port}: {e}", file=sys.stderr)
+        return 2
+    print(f"Serving on http://{HOST}:{server.server_address[1]} with {server.jobs.workers} workers "
+          f"(Ctrl+C to stop)", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+    return 0
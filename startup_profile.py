@@ -0,0 +1,112 @@
+import sys
+import time
+import builtins
+import importlib
+import threading
+
+
+FLAG = "--profile-startup"
+
+# Number of slowest imports listed in the summary
+TOP_IMPORTS = 15
+
+_start = None
+_milestones = []
+_imports = []
+_stack = []
+_original_import = builtins.__import__
+_original_import_module = importlib.import_module
+_main_thread = threading.get_ident()
+
+
+def requested(argv):
+    return any(arg == FLAG or arg.startswith(FLAG + "=") for arg in argv)
+
+
+def strip_flag(argv):
+    """Return argv without the profiling flag, and the report file it names (or None)."""
+    rest, output = [], None
+    for arg in argv:
+        if arg.startswith(FLAG + "="):
+            output = arg.split("=", 1)[1]
+        elif arg != FLAG:
+            rest.append(arg)
+    return rest, output
+
+
+def _timed(import_func, name, *args, **kwargs):
+    if name in sys.modules or threading.get_ident() != _main_thread:
+        return import_func(name, *args, **kwargs)
+    start = time.perf_counter()
+    _stack.append(0.0)
+    try:
+        return import_func(name, *args, **kwargs)
+    finally:
+        elapsed = time.perf_counter() - start
+        children = _stack.pop()
+        if _stack:
+            _stack[-1] += elapsed
+        _imports.append((name, elapsed - children, elapsed, len(_stack)))
+
+
+def _import(name, globals=None, locals=None, fromlist=(), level=0):
+    if level:
+        # Relative imports are rare here and cheap to leave untimed
+        return _original_import(name, globals, locals, fromlist, level)
+    return _timed(_original_import, name, globals, locals, fromlist, level)
+
+
+def _import_module(name, package=None):
+    return _timed(_original_import_module, name, package)
+
+
+def start():
+    """Begin timing imports; call before anything heavy is imported."""
+    global _start
+    _start = time.perf_counter()
+    builtins.__import__ = _import
+    importlib.import_module = _import_module
+    mark("profiling started")
+
+
+def active():
+    return _start is not None and builtins.__import__ is _import
+
+
+def mark(label):
+    if _start is not None:
+        _milestones.append((label, time.perf_counter() - _start))
+
+
+def stop():
+    builtins.__import__ = _original_import
+    importlib.import_module = _original_import_module
+
+
+def report():
+    """Return the profile as text, in the style of ``python -X importtime``."""
+    lines = ["import time: self [us] | cumulative | imported package"]
+    for name, self_time, cumulative, depth in _imports:
+        lines.append(f"import time: {self_time * 1e6:9.0f} | {cumulative * 1e6:10.0f} | {'  ' * depth}{name}")
+    lines.append("")
+    lines.append("Slowest imports (cumulative):")
+    top_level = [entry for entry in _imports if entry[3] == 0]
+    for name, _self_time, cumulative, _depth in sorted(top_level, key=lambda e: -e[2])[:TOP_IMPORTS]:
+        lines.append(f"  {cumulative * 1000:8.1f} ms  {name}")
+    lines.append("")
+    lines.append("Milestones (since profiling started):")
+    for label, seconds in _milestones:
+        lines.append(f"  {seconds * 1000:8.1f} ms  {label}")
+    return "\n".join(lines) + "\n"
+
+
+def finish(output=None):
+    """Stop timing and write the report to ``output`` (a path) or stderr."""
+    stop()
+    text = report()
+    if output or sys.stderr is None:
+        # Windowed builds have no console, fall back to a file next to the cwd
+        with open(output or "startup-profile.txt", "w", encoding="utf-8") as f:
+            f.write(text)
+    else:
+        sys.stderr.write(text)
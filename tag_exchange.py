@@ -0,0 +1,273 @@
+import os
+import sys
+import csv
+import json
+import time
+import argparse
+import itertools
+
+import batch
+
+
+# Column written for each editor field; the names are accepted back by
+# batch manifests, so an export can be edited and imported as it is
+EXPORT_COLUMNS = {
+    "Song Name": "title",
+    "Artist": "artist",
+    "Album": "album",
+    "Genre": "genre",
+    "Year": "year",
+}
+HEADER = ["path", "format"] + list(EXPORT_COLUMNS.values())
+
+# Rows buffered per Parquet row group
+PARQUET_ROW_GROUP = 10000
+
+# Manifest rows applied between checkpoints during an import
+IMPORT_BATCH_SIZE = 5000
+
+
+def export_format(path):
+    lower = path.lower()
+    if lower.endswith(".parquet"):
+        return "parquet"
+    if lower.endswith((".jsonl", ".ndjson", ".json")):
+        return "jsonl"
+    return "csv"
+
+
+class _CsvWriter:
+    def __init__(self, path):
+        self.file = open(path, "w", newline="", encoding="utf-8")
+        self.writer = csv.DictWriter(self.file, fieldnames=HEADER)
+        self.writer.writeheader()
+
+    def write(self, row):
+        self.writer.writerow(row)
+
+    def close(self):
+        self.file.close()
+
+
+class _JsonlWriter:
+    def __init__(self, path):
+        self.file = open(path, "w", encoding="utf-8")
+
+    def write(self, row):
+        self.file.write(json.dumps(row, ensure_ascii=False) + "\n")
+
+    def close(self):
+        self.file.close()
+
+
+class _ParquetWriter:
+    def __init__(self, path):
+        try:
+            import pyarrow
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise ValueError("Writing Parquet files needs pyarrow (pip install pyarrow)") from None
+        self.pyarrow = pyarrow
+        self.schema = pyarrow.schema([(column, pyarrow.string()) for column in HEADER])
+        self.writer = pq.ParquetWriter(path, self.schema)
+        self.rows = []
+
+    def write(self, row):
+        self.rows.append(row)
+        if len(self.rows) >= PARQUET_ROW_GROUP:
+            self._flush()
+
+    def _flush(self):
+        if self.rows:
+            self.writer.write_table(self.pyarrow.Table.from_pylist(self.rows, schema=self.schema))
+            self.rows = []
+
+    def close(self):
+        self._flush()
+        self.writer.close()
+
+
+WRITERS = {"csv": _CsvWriter, "jsonl": _JsonlWriter, "parquet": _ParquetWriter}
+
+
+def export_tags(root, output, workers=None, relative=False, on_error=None):
+    """Write the tags of every audio file below root to a CSV, JSONL or Parquet file.
+
+    Files are read across the batch process pool and rows are written as
+    results arrive, so memory use doesn't depend on the size of the tree.
+    With ``relative`` paths are written relative to the output file, which
+    is how manifests are resolved when the file is imported again.
+    Returns the batch summary.
+    """
+    writer = WRITERS[export_format(output)](output)
+    base_dir = os.path.dirname(os.path.abspath(output))
+
+    def on_result(result):
+        if result["status"] == "error":
+            if on_error:
+                on_error(result)
+            return
+        path = os.path.relpath(result["path"], base_dir) if relative else os.path.abspath(result["path"])
+        row = {"path": path, "format": result.get("format")}
+        for field, column in EXPORT_COLUMNS.items():
+            row[column] = result["fields"].get(field, "")
+        writer.write(row)
+
+    try:
+        jobs = batch.iter_directory_jobs(root, {})
+        return batch.run_batch(jobs, workers=workers, on_result=on_result)
+    finally:
+        writer.close()
+
+
+def _manifest_identity(manifest):
+    # A checkpoint only holds a row count, which means nothing for another manifest
+    stat = os.stat(manifest)
+    return {"manifest": os.path.abspath(manifest), "size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+
+def _read_checkpoint(path, identity):
+    """Return the rows already applied according to a checkpoint, 0 without one.
+
+    Raises ValueError when the checkpoint was written for another
+    manifest, or for this one before it changed.
+    """
+    try:
+        with open(path, encoding="utf-8") as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        return 0
+    if {key: data.get(key) for key in identity} != identity:
+        raise ValueError(f"Checkpoint {path} is for another manifest, or the manifest changed since it "
+                         f"was written; delete it to start over")
+    return data.get("rows", 0)
+
+
+def _write_checkpoint(path, identity, rows):
+    # Replace rather than rewrite, so a crash never leaves half a checkpoint
+    temp_path = path + ".tmp"
+    with open(temp_path, "w", encoding="utf-8") as f:
+        json.dump(dict(identity, rows=rows), f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temp_path, path)
+
+
+def import_tags(manifest, workers=None, batch_size=IMPORT_BATCH_SIZE, checkpoint=None, on_result=None,
+                on_batch=None, journal_dir=None):
+    """Apply a CSV, JSONL or Parquet tag file back onto the files it names.
+
+    Each file is only written when one of its values differs from what is
+    on disk.  Rows are applied in batches of ``batch_size``; after each
+    batch the number of rows done is saved to ``checkpoint`` (if given),
+    and an interrupted import started again with the same checkpoint
+    skips those rows.  The checkpoint is removed once the import is
+    done.  With ``journal_dir`` (see journal.begin) the
+    replaced values are journaled.  Returns the totals of the batch
+    summaries.
+    """
+    identity = _manifest_identity(manifest) if checkpoint else None
+    skip = _read_checkpoint(checkpoint, identity) if checkpoint else 0
+    jobs = itertools.islice(batch.iter_manifest_jobs(manifest), skip, None)
+    totals = {"files": 0, "written": 0, "unchanged": 0, "read": 0, "errors": 0,
+              "in_place": 0, "rewrites": 0, "bytes_written": 0, "skipped": skip}
+    start = time.perf_counter()
+    done = skip
+    # One pool for the whole import, rather than one started and stopped per batch
+    with batch.make_executor(workers) as executor:
+        while True:
+            chunk = list(itertools.islice(jobs, batch_size))
+            if not chunk:
+                break
+            summary = batch.run_batch(chunk, workers=workers, on_result=on_result, executor=executor,
+                                      journal=journal_dir)
+            for key in totals:
+                if key in summary and key != "skipped":
+                    totals[key] += summary[key]
+            done += len(chunk)
+            if checkpoint:
+                _write_checkpoint(checkpoint, identity, done)
+            if on_batch:
+                on_batch(done, summary)
+    if checkpoint and os.path.exists(checkpoint):
+        os.remove(checkpoint)
+    totals["seconds"] = time.perf_counter() - start
+    return totals
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="main.py tags",
+                                     description="Export the tags of a library to a file, or import them back.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    export = commands.add_parser("export", help="Write the tags of a directory tree to CSV, JSONL or Parquet")
+    export.add_argument("directory")
+    export.add_argument("output", help="Output file; .csv, .jsonl or .parquet (needs pyarrow)")
+    export.add_argument("--relative", action="store_true",
+                        help="Write paths relative to the output file instead of absolute ones")
+    export.add_argument("--workers", type=int, default=None, help="Worker processes (default: CPU count)")
+
+    imp = commands.add_parser("import", help="Apply an edited export (or any manifest) back to the files")
+    imp.add_argument("manifest", help="CSV, JSONL or Parquet file with a path column and field columns")
+    imp.add_argument("--batch-size", type=int, default=IMPORT_BATCH_SIZE,
+                     help=f"Rows applied between checkpoints (default: {IMPORT_BATCH_SIZE})")
+    imp.add_argument("--checkpoint", help="Progress file; rerunning with it resumes an interrupted import")
+    imp.add_argument("--results", help="Write per-file results as JSON lines to this file")
+    imp.add_argument("--journal", action="store_true",
+                     help="Journal the values every save replaces, so the import can be undone")
+    imp.add_argument("--workers", type=int, default=None, help="Worker processes (default: CPU count)")
+    return parser
+
+
+def _print_error(result):
+    print(f"error     {result['path']}: {result['error']}", file=sys.stderr)
+
+
+def main(argv):
+    args = build_parser().parse_args(argv)
+    journal_dir = None
+    try:
+        if args.command == "export":
+            summary = export_tags(args.directory, args.output, args.workers, args.relative, _print_error)
+            print(f"Exported {summary['read']} files to {args.output} ({summary['errors']} errors) in "
+                  f"{summary['seconds']:.2f}s: {summary['files_per_second']:.1f} files/s")
+            return 1 if summary["errors"] else 0
+
+        results_file = open(args.results, "w", encoding="utf-8") if args.results else None
+
+        def on_result(result):
+            if results_file:
+                results_file.write(json.dumps(result) + "\n")
+            if result["status"] == "error":
+                _print_error(result)
+
+        def on_batch(done, summary):
+            print(f"{done} rows applied: {summary['written']} written, {summary['unchanged']} unchanged, "
+                  f"{summary['errors']} errors", flush=True)
+
+        if args.journal:
+            import journal
+            journal_dir = journal.begin(f"tags import {args.manifest}")
+        try:
+            totals = import_tags(args.manifest, args.workers, args.batch_size, args.checkpoint, on_result, on_batch,
+                                 journal_dir)
+            if journal_dir and not journal.finish(journal_dir):
+                journal_dir = None
+        finally:
+            if results_file:
+                results_file.close()
+    except ValueError as e:
+        if journal_dir:
+            journal.finish(journal_dir)
+        print(f"Error: {e}", file=sys.stderr)
+        return 2
+    skipped = f", {totals['skipped']} rows done before" if totals["skipped"] else ""
+    print(f"{totals['files']} files: {totals['written']} written, {totals['unchanged']} already up to date, "
+          f"{totals['errors']} errors{skipped} in {totals['seconds']:.2f}s")
+    if totals["written"]:
+        print(f"{totals['in_place']} saved in place, {totals['rewrites']} rewritten, "
+              f"~{totals['bytes_written'] / (1024 * 1024):.1f} MiB written")
+    if journal_dir:
+        batch_id = os.path.basename(journal_dir)
+        print(f"Journaled as {batch_id}, undo with: python main.py journal undo {batch_id}")
+    return 1 if totals["errors"] else 0
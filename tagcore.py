@@ -0,0 +1,240 @@
+import os
+import threading
+from collections import Counter
+
+import formats
+import instrumentation
+
+
+# Field names as shown in the editor window
+FIELDS = ["Song Name", "Artist", "Album", "Genre", "Year"]
+
+# Alternative spellings accepted from manifests and the command line
+FIELD_ALIASES = {
+    "song name": "Song Name",
+    "title": "Song Name",
+    "artist": "Artist",
+    "album": "Album",
+    "genre": "Genre",
+    "year": "Year",
+    "date": "Year",
+}
+
+
+class TagError(Exception):
+    pass
+
+
+class PaddingPolicy:
+    """Decides how much padding to leave after the tags when saving.
+
+    Existing padding is kept as long as the new tags fit, so the save is
+    done in place.  When they don't and the file has to be rewritten
+    anyway, generous padding is reserved so the next edits (a bigger
+    cover, longer titles) fit in place again.  Padding only gets trimmed
+    once it grows past ``max_padding``.
+    """
+
+    def __init__(self, min_padding=64 * 1024, ratio=0.01, max_padding=4 * 1024 * 1024):
+        self.min_padding = min_padding
+        self.ratio = ratio
+        self.max_padding = max_padding
+
+    def rewrite_padding(self, size):
+        return min(max(self.min_padding, int(size * self.ratio)), self.max_padding)
+
+    def __call__(self, info):
+        if 0 <= info.padding <= self.max_padding:
+            return info.padding
+        return self.rewrite_padding(info.size)
+
+
+DEFAULT_PADDING_POLICY = PaddingPolicy()
+
+# Trims leftover padding to the minimum, for passes meant to reclaim disk space
+COMPACT_PADDING_POLICY = PaddingPolicy(max_padding=DEFAULT_PADDING_POLICY.min_padding)
+
+# Totals over every save in this process, see TagFile.last_save for a single one
+save_stats = Counter()
+_save_stats_lock = threading.Lock()
+
+
+class _CountingFile:
+    # File object wrapper counting the bytes mutagen writes through it
+    def __init__(self, fileobj):
+        self._fileobj = fileobj
+        self.bytes_written = 0
+
+    def write(self, data):
+        self.bytes_written += len(data)
+        return self._fileobj.write(data)
+
+    def __getattr__(self, name):
+        return getattr(self._fileobj, name)
+
+
+class _PaddingRecorder:
+    # Wraps a policy to remember what mutagen asked and what was decided
+    def __init__(self, policy):
+        self.policy = policy
+        self.info = None
+        self.padding = None
+
+    def __call__(self, info):
+        self.info = info
+        self.padding = self.policy(info)
+        return self.padding
+
+
+def is_audio_file(file_path):
+    return formats.handler_for_extension(file_path) is not None
+
+
+def file_type_of(file_path):
+    return os.path.splitext(file_path)[1].lower()
+
+
+def normalize_field_name(name):
+    """Map a manifest/command line column name onto one of FIELDS."""
+    if name in FIELDS:
+        return name
+    return FIELD_ALIASES.get(name.strip().lower())
+
+
+class TagFile:
+    """An audio file whose tags are parsed once and kept for later saves.
+
+    ``fields`` and ``cover`` hold the values as they are on disk, so
+    ``save`` can write only what was edited and skip the rewrite entirely
+    when nothing differs.
+    """
+
+    def __init__(self, file_path, padding_policy=None, handler=None):
+        self.path = file_path
+        self.padding_policy = padding_policy or DEFAULT_PADDING_POLICY
+        self.last_save = None
+        self.file_type = file_type_of(file_path)
+        self.handler = handler or formats.handler_for_extension(file_path)
+        self.load()
+
+    def load(self):
+        self.signature = _signature(self.path)
+        with instrumentation.stage("parse", self._format_name(), self.path) as parse:
+            try:
+                if self.handler is None:
+                    raise TagError(f"Unsupported file type: {self.file_type}")
+                self.audio, self.info = self.handler.load(self.path)
+            except Exception:
+                # Mislabeled files (an MP3 named .m4a, ...) get a second chance
+                # with the handler their contents point to
+                sniffed = formats.sniff_handler(self.path)
+                if sniffed is None or sniffed is self.handler:
+                    raise
+                self.handler = sniffed
+                parse.format = sniffed.name
+                self.audio, self.info = sniffed.load(self.path)
+        with instrumentation.stage("extract", self.handler.name, self.path):
+            self.fields, self.cover = self.handler.read(self.handler, self.audio)
+        instrumentation.count("loads", self.handler.name)
+
+    def _format_name(self):
+        return self.handler.name if self.handler else self.file_type.lstrip(".") or None
+
+    @property
+    def format(self):
+        return self.handler.name
+
+    @property
+    def duration(self):
+        return getattr(self.info, "length", None)
+
+    @property
+    def bitrate(self):
+        return getattr(self.info, "bitrate", None)
+
+    def changed_on_disk(self):
+        """True when the file was modified since it was loaded or last saved."""
+        return _signature(self.path) != self.signature
+
+    def changes(self, fields, cover=None):
+        """Return the fields that differ from the loaded values, and whether the cover does."""
+        changed = {field: value for field, value in fields.items()
+                   if self.fields.get(field, "") != value}
+        return changed, cover is not None and cover != self.cover
+
+    def save(self, fields, cover=None):
+        """Write edited fields (and cover image bytes) back to the file.
+
+        Only the fields present in ``fields`` that differ from the loaded
+        values are written.  Returns False without touching the file when
+        there is nothing to write.
+        """
+        if self.changed_on_disk():
+            # Changed on disk since it was loaded, don't save over a stale copy
+            self.load()
+        changed, cover_changed = self.changes(fields, cover)
+        if not changed and not cover_changed:
+            return False
+        self.handler.apply(self.handler, self.audio, changed, cover if cover_changed else None)
+        recorder = _PaddingRecorder(self.padding_policy)
+        old_size = self.signature[0]
+        with instrumentation.stage("save", self.handler.name, self.path), open(self.path, "rb+") as fileobj:
+            counter = _CountingFile(fileobj)
+            if self.handler.padding:
+                self.audio.save(counter, padding=recorder)
+            else:
+                self.audio.save(counter)
+        self.fields.update(changed)
+        if cover_changed:
+            self.cover = cover
+        self.signature = _signature(self.path)
+        self.last_save = _save_report(recorder, counter, old_size, self.signature[0])
+        with _save_stats_lock:
+            save_stats["saves"] += 1
+            save_stats["in_place" if self.last_save["in_place"] else "rewrites"] += 1
+            save_stats["bytes_written"] += self.last_save["bytes_written"]
+        instrumentation.count("saves", self.handler.name)
+        instrumentation.count("in_place" if self.last_save["in_place"] else "rewrites", self.handler.name)
+        return True
+
+
+def _save_report(recorder, counter, old_size, new_size):
+    if recorder.info is None:
+        # The format never asked about padding, go by the file size
+        in_place = old_size == new_size
+    else:
+        in_place = recorder.padding == recorder.info.padding and old_size == new_size
+    return {"in_place": in_place, "bytes_written": counter.bytes_written, "padding": recorder.padding}
+
+
+def _signature(file_path):
+    stat = os.stat(file_path)
+    return (stat.st_size, stat.st_mtime_ns)
+
+
+def read_tags(file_path, handler=None):
+    """Return the fields, cover image bytes (or None) and stream info of an audio file.
+
+    The result is a dict with "fields", "cover", "format", "duration"
+    (seconds) and "bitrate" (bits per second) keys.
+    """
+    tag_file = TagFile(file_path, handler=handler)
+    return {
+        "fields": tag_file.fields,
+        "cover": tag_file.cover,
+        "format": tag_file.format,
+        "duration": tag_file.duration,
+        "bitrate": tag_file.bitrate,
+    }
+
+
+def write_tags(file_path, fields, cover=None, padding_policy=None, handler=None):
+    """Write the given fields (and optional cover image bytes) to an audio file.
+
+    Only the fields present in ``fields`` are touched, so a partial edit
+    leaves the remaining tags as they are.  Returns the save report of
+    ``TagFile.last_save``, or None when the file already had these values
+    and was left alone.
+    """
+    tag_file = TagFile(file_path, padding_policy, handler)
+    return tag_file.last_save if tag_file.save(fields, cover) else None
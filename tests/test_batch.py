@@ -0,0 +1,39 @@
+import json
+
+import batch
+import tagcore
+from benchmarks.corpus import make_file
+
+
+def test_manifest_rows_for_one_file_are_merged_into_one_save(tmp_path):
+    path = make_file(str(tmp_path / "track.mp3"), "mp3", audio_size=4096)
+    manifest = tmp_path / "edits.jsonl"
+    manifest.write_text("\n".join(json.dumps(row) for row in [
+        {"path": "track.mp3", "artist": "First"},
+        {"path": "track.mp3", "album": "Second"},
+        {"path": "track.mp3", "artist": "Third"},
+    ]))
+
+    summary = batch.run_batch(batch.iter_manifest_jobs(str(manifest)), workers=1)
+
+    assert (summary["files"], summary["written"]) == (1, 1)
+    fields = tagcore.TagFile(path).fields
+    assert (fields["Artist"], fields["Album"]) == ("Third", "Second")
+
+
+def test_merged_cover_normalization_keeps_the_other_rows_fields(tmp_path):
+    path = make_file(str(tmp_path / "track.flac"), "flac", audio_size=4096, cover_resolution=600)
+    old_cover = tagcore.TagFile(path).cover
+    jobs = [
+        {"path": path, "fields": {"Artist": "New Artist"}, "cover": None},
+        {"path": path, "fields": {"Album": "New Album"}, "cover": None, "normalize_cover": True},
+    ]
+    results = []
+
+    summary = batch.run_batch(jobs, workers=1, on_result=results.append, cover_options={"max_dimension": 100})
+
+    assert summary["written"] == 1
+    assert results[0]["cover_bytes_saved"] > 0
+    tag_file = tagcore.TagFile(path)
+    assert (tag_file.fields["Artist"], tag_file.fields["Album"]) == ("New Artist", "New Album")
+    assert len(tag_file.cover) < len(old_cover)
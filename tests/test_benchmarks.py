@@ -0,0 +1,32 @@
+import json
+import os
+
+import tagcore
+from benchmarks import corpus, run
+
+
+def case(format, load_ms, bytes_written=100):
+    return {"format": format, "audio_size": 4096, "tag_size": 32, "padding": 1024, "cover": 0,
+            "load": {"median_ms": load_ms}, "save": {"median_ms": 1.0}, "bytes_written": bytes_written}
+
+
+def test_compare_reports_only_regressions_past_the_threshold(capsys):
+    baseline = {"single": [case("mp3", 1.0), case("flac", 1.0)]}
+    current = {"single": [case("mp3", 1.05), case("flac", 2.0), case("ogg", 9.0)]}
+
+    regressions = run.compare(baseline, current, 0.10)
+
+    assert [(dict(key)["format"], name) for _suite, key, name, _change in regressions] == [("flac", "load median ms")]
+    assert "REGRESSION" in capsys.readouterr().out
+
+
+def test_corpus_files_load_with_their_tags(tmp_path):
+    paths = corpus.make_corpus(str(tmp_path), count=2, audio_size=4096, cover_resolution=32)
+
+    assert len(paths) == 2 * len(corpus.FORMATS)
+    for path in paths:
+        tag_file = tagcore.TagFile(path)
+        assert tag_file.fields["Artist"]
+        assert tag_file.cover
+    with open(os.path.join(str(tmp_path), "corpus.json")) as f:
+        assert json.load(f)["count"] == 2
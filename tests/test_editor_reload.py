@@ -0,0 +1,45 @@
+import shutil
+import threading
+
+import main
+import tagcore
+from background import Task
+from benchmarks.corpus import make_file
+
+
+class FakePreviewCache:
+    def get(self, data):
+        return None
+
+
+def test_rescan_reloads_changed_drops_removed_and_finds_new_files(tmp_path):
+    changed = make_file(str(tmp_path / "changed.mp3"), "mp3", audio_size=4096, index=0)
+    removed = make_file(str(tmp_path / "removed.mp3"), "mp3", audio_size=4096, index=1)
+    tag_files = [tagcore.TagFile(changed), tagcore.TagFile(removed)]
+    tagcore.TagFile(changed).save({"Artist": "Someone Else"}, None)
+    shutil.move(removed, tmp_path / "added.mp3")
+
+    result = main.reload_tag_files(Task(), tag_files, tag_files, [], FakePreviewCache(), True, str(tmp_path))
+
+    reloaded_files, reloaded, errors = result[:3]
+    assert errors == []
+    assert reloaded == 2
+    assert [tag_file.path for tag_file in reloaded_files] == [changed, str(tmp_path / "added.mp3")]
+    assert reloaded_files[0].fields["Artist"] == "Someone Else"
+
+
+def test_reload_waits_for_a_running_save(tmp_path):
+    path = make_file(str(tmp_path / "track.mp3"), "mp3", audio_size=4096)
+    tag_file = tagcore.TagFile(path)
+    done = threading.Event()
+
+    def reload():
+        main.reload_tag_files(Task(), [tag_file], [tag_file], [], FakePreviewCache())
+        done.set()
+
+    with main._file_lock:
+        thread = threading.Thread(target=reload)
+        thread.start()
+        assert not done.wait(0.2)
+    thread.join(5)
+    assert done.is_set()
@@ -0,0 +1,41 @@
+import os
+
+import journal
+import main
+import tagcore
+from background import Task
+from benchmarks.corpus import make_file
+
+
+def save(path, artist):
+    tag_file = tagcore.TagFile(path)
+    [(_tag_file, saved, error)] = main.save_tag_files(Task(), [(tag_file, {"Artist": artist}, None)])
+    assert error is None
+    return saved
+
+
+def test_save_goes_ahead_when_journaling_fails(tmp_path, monkeypatch):
+    path = make_file(str(tmp_path / "track.mp3"), "mp3", audio_size=4096)
+
+    def unwritable(description):
+        raise PermissionError("journal directory is read-only")
+
+    monkeypatch.setattr(journal, "begin", unwritable)
+    assert save(path, "New Artist")
+    assert tagcore.TagFile(path).fields["Artist"] == "New Artist"
+
+
+def test_editor_saves_prune_the_journal(tmp_path, monkeypatch):
+    path = make_file(str(tmp_path / "track.mp3"), "mp3", audio_size=4096)
+    root = tmp_path / "journal"
+    begin = journal.begin
+    monkeypatch.setattr(journal, "begin", lambda description: begin(description, str(root)))
+    monkeypatch.setattr(main, "JOURNAL_KEEP", 2)
+
+    for index in range(4):
+        assert save(path, f"New Artist {index}")
+
+    batches = journal.list_batches(str(root))
+    assert len(batches) == 2
+    assert [info["description"] for _batch_dir, info, _files in batches] == ["editor save of 1 files"] * 2
+    assert all(os.path.isdir(batch_dir) for batch_dir, _info, _files in batches)
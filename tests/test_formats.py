@@ -0,0 +1,42 @@
+import random
+
+import pytest
+
+import formats
+import tagcore
+from benchmarks import corpus
+
+HANDLERS = formats.handlers()
+
+
+@pytest.mark.parametrize("handler", HANDLERS, ids=[handler.name for handler in HANDLERS])
+def test_save_round_trip(tmp_path, handler):
+    path = str(tmp_path / ("track" + handler.extensions[0]))
+    corpus.WRITERS[handler.name](path, 8192, random.Random(0))
+    cover = corpus.make_cover(64)
+    fields = {"Song Name": "Title", "Artist": "Artist", "Album": "Album", "Genre": "Genre", "Year": "2001"}
+
+    tag_file = tagcore.TagFile(path)
+    assert tag_file.format == handler.name
+    assert tag_file.save(fields, cover)
+
+    reloaded = tagcore.TagFile(path)
+    assert reloaded.fields == fields
+    assert reloaded.cover == cover
+    assert formats.sniff_handler(path) is handler
+    assert not reloaded.save(fields, cover)
+
+
+def test_register_handler_replaces_the_old_handler():
+    old = formats.handler_named("flac")
+    order = [handler.name for handler in formats.handlers()]
+    new = formats.FormatHandler("flac", old.extensions, old.tag_map, old.load, old.read, old.apply,
+                                old.sniff, old.payload)
+    try:
+        formats.register_handler(new)
+        assert [handler.name for handler in formats.handlers()] == order
+        assert formats.handler_named("flac") is new
+        assert formats.handler_for_extension("a.flac") is new
+    finally:
+        formats.register_handler(old)
+    assert formats.handlers() == HANDLERS
@@ -0,0 +1,50 @@
+import os
+import json
+from collections import Counter
+
+import pytest
+
+import batch
+import instrumentation
+from benchmarks.corpus import make_file
+
+
+@pytest.fixture
+def instrumented(monkeypatch):
+    """Instrumentation starting empty, and turned off again after the test."""
+    monkeypatch.setattr(instrumentation, "_enabled", False)
+    monkeypatch.setattr(instrumentation, "_histograms", {})
+    monkeypatch.setattr(instrumentation, "_counters", Counter())
+    monkeypatch.setattr(instrumentation, "_events", [])
+    monkeypatch.setattr(instrumentation, "_trace", None)
+    yield instrumentation
+    instrumentation.finish(output=None)
+
+
+def test_histogram_percentiles_are_bucket_bounds():
+    histogram = instrumentation.Histogram()
+    for microseconds in (10, 10, 10, 1000):
+        histogram.add(microseconds / 1e6)
+    assert histogram.percentile(0.5) == 16 / 1e6
+    assert histogram.percentile(1.0) == 1000 / 1e6
+
+
+def test_worker_stages_are_merged_and_traced(tmp_path, instrumented):
+    paths = [make_file(str(tmp_path / f"{index}.mp3"), "mp3", audio_size=4096, index=index) for index in range(3)]
+    trace = tmp_path / "trace.jsonl"
+    instrumented.enable(str(trace))
+
+    jobs = [{"path": path, "fields": {"Artist": "New Artist"}, "cover": None} for path in paths]
+    summary = batch.run_batch(jobs, workers=1)
+
+    assert summary["written"] == 3
+    stats = instrumented.stats()
+    assert stats["stages"]["parse/mp3"]["count"] == 3
+    assert stats["stages"]["save/mp3"]["count"] == 3
+    assert stats["counters"]["saves/mp3"] == 3
+    instrumented.finish(output=None)
+    events = [json.loads(line) for line in trace.read_text().splitlines()]
+    saves = [event for event in events if event["stage"] == "save"]
+    assert sorted(event["path"] for event in saves) == sorted(paths)
+    # Recorded in the worker process and handed back to this one
+    assert all(event["pid"] != os.getpid() for event in saves)
@@ -0,0 +1,102 @@
+import os
+import time
+import hashlib
+
+import batch
+import journal
+import tagcore
+from benchmarks.corpus import make_file, make_cover
+
+
+def make_track(directory, name, index=0):
+    return make_file(str(directory / name), "mp3", audio_size=4096, index=index)
+
+
+def record_batch(journal_root, paths, fields, cover=None):
+    """Journal edits of ``paths`` the way a worker does, without saving the files."""
+    batch_dir = journal.begin("test", str(journal_root))
+    segment = journal.Segment(batch_dir)
+    for path in paths:
+        segment.record(tagcore.TagFile(path), fields, cover)
+    segment.sync()
+    return batch_dir
+
+
+def run_undo(batch_dir, force=False):
+    jobs, _covers_left = journal.undo_jobs(batch_dir, force)
+    return batch.run_batch(jobs, workers=1)
+
+
+def test_undo_after_interrupted_batch(tmp_path):
+    saved = make_track(tmp_path, "saved.mp3", 0)
+    never_saved = make_track(tmp_path, "never_saved.mp3", 1)
+    old_artists = {path: tagcore.TagFile(path).fields["Artist"] for path in (saved, never_saved)}
+    batch_dir = record_batch(tmp_path / "journal", [saved, never_saved], {"Artist": "New Artist"})
+    # The run stopped after saving the first file
+    tagcore.TagFile(saved).save({"Artist": "New Artist"}, None)
+
+    summary = run_undo(batch_dir)
+
+    assert (summary["written"], summary["unchanged"], summary["errors"]) == (1, 1, 0)
+    for path, artist in old_artists.items():
+        assert tagcore.TagFile(path).fields["Artist"] == artist
+
+
+def test_undo_leaves_files_edited_since_unless_forced(tmp_path):
+    path = make_track(tmp_path, "track.mp3")
+    old_artist = tagcore.TagFile(path).fields["Artist"]
+    batch_dir = record_batch(tmp_path / "journal", [path], {"Artist": "New Artist"})
+    tagcore.TagFile(path).save({"Artist": "Edited Later"}, None)
+
+    summary = run_undo(batch_dir)
+    assert summary["errors"] == 1
+    assert tagcore.TagFile(path).fields["Artist"] == "Edited Later"
+
+    summary = run_undo(batch_dir, force=True)
+    assert summary["written"] == 1
+    assert tagcore.TagFile(path).fields["Artist"] == old_artist
+
+
+def test_undo_leaves_cover_replaced_since(tmp_path):
+    path = make_file(str(tmp_path / "track.mp3"), "mp3", audio_size=4096, cover_resolution=32)
+    batch_cover, later_cover = make_cover(48, seed=1), make_cover(64, seed=2)
+    batch_dir = record_batch(tmp_path / "journal", [path], {}, batch_cover)
+    tagcore.TagFile(path).save({}, batch_cover)
+    tagcore.TagFile(path).save({}, later_cover)
+
+    summary = run_undo(batch_dir)
+    assert summary["errors"] == 1
+    assert tagcore.TagFile(path).cover == later_cover
+
+
+def test_finished_batch_notes_its_file_count(tmp_path):
+    paths = [make_track(tmp_path, f"{index}.mp3", index) for index in range(3)]
+    batch_dir = record_batch(tmp_path / "journal", paths, {"Artist": "New Artist"})
+    journal.finish(batch_dir)
+
+    assert journal.read_info(batch_dir)["files"] == 3
+    [(_batch_dir, _info, files)] = journal.list_batches(str(tmp_path / "journal"))
+    assert files == 3
+
+
+def test_prune_keeps_running_batches_and_their_covers(tmp_path):
+    root = tmp_path / "journal"
+    path = make_file(str(tmp_path / "track.mp3"), "mp3", audio_size=4096, cover_resolution=32)
+    current_cover, running_cover = tagcore.TagFile(path).cover, make_cover(64, seed=2)
+    old = record_batch(root, [path], {}, make_cover(48, seed=1))
+    journal.finish(old)
+    newer = record_batch(root, [path], {"Artist": "New Artist"})
+    journal.finish(newer)
+    an_hour_ago = time.time() - 3600
+    for directory, _dirs, names in os.walk(root / journal.COVERS_DIR):
+        for name in names:
+            os.utime(os.path.join(directory, name), (an_hour_ago, an_hour_ago))
+    # Its covers are stored, but the record naming them isn't synced yet
+    running = journal.begin("running", str(root))
+    journal.Segment(running).record(tagcore.TagFile(path), {}, running_cover)
+
+    assert journal.prune(1, str(root)) == 1
+    assert not os.path.exists(old)
+    assert os.path.exists(newer) and os.path.exists(running)
+    stored = {name for _dir, _dirs, names in os.walk(root / journal.COVERS_DIR) for name in names}
+    assert stored == {hashlib.sha1(current_cover).hexdigest(), hashlib.sha1(running_cover).hexdigest()}
@@ -0,0 +1,84 @@
+import shutil
+
+import library_index
+import tagcore
+from benchmarks.corpus import make_file
+
+
+def make_library(directory):
+    directory.mkdir()
+    original = make_file(str(directory / "original.mp3"), "mp3", audio_size=8192, index=0)
+    copy = str(directory / "copy.mp3")
+    shutil.copy(original, copy)
+    tagcore.TagFile(copy).save({"Artist": "Retagged"}, None)
+    other = make_file(str(directory / "other.ogg"), "ogg", audio_size=8192, index=1)
+    return original, copy, other
+
+
+def test_scan_leaves_audio_sizes_to_find_duplicates(tmp_path):
+    original, copy, _other = make_library(tmp_path / "music")
+    with library_index.LibraryIndex(str(tmp_path / "index.db")) as index:
+        index.rescan(str(tmp_path / "music"), workers=1)
+        sizes = index.conn.execute("SELECT audio_size FROM tracks").fetchall()
+        assert [row[0] for row in sizes] == [None, None, None]
+
+        groups, summary = index.find_duplicates(str(tmp_path / "music"), workers=2)
+
+    assert [sorted(row["path"] for row in group) for group in groups] == [sorted([original, copy])]
+    assert summary["duplicates"] == 1
+    # The Ogg file's audio size is unique, so it's never hashed
+    assert summary["hashed"] == 2
+
+
+def test_reindexing_a_file_keeps_its_rowid(tmp_path):
+    original, _copy, _other = make_library(tmp_path / "music")
+    with library_index.LibraryIndex(str(tmp_path / "index.db")) as index:
+        index.rescan(str(tmp_path / "music"), workers=1)
+        rowid_sql = "SELECT rowid FROM tracks WHERE path = ?"
+        rowid = index.conn.execute(rowid_sql, (original,)).fetchone()[0]
+        tagcore.TagFile(original).save({"Artist": "Changed"}, None)
+
+        summary = index.update_paths([original])
+
+        assert summary["updated"] == 1
+        assert index.conn.execute(rowid_sql, (original,)).fetchone()[0] == rowid
+        assert index.get(original)["artist"] == "Changed"
+
+
+def test_stopped_rescan_keeps_what_it_parsed_and_removes_nothing(tmp_path):
+    make_library(tmp_path / "music")
+    with library_index.LibraryIndex(str(tmp_path / "index.db")) as index:
+        index.rescan(str(tmp_path / "music"), workers=1)
+        for path in list(map(str, (tmp_path / "music").iterdir()))[:1]:
+            tagcore.TagFile(path).save({"Album": "Changed"}, None)
+        checks = []
+
+        summary = index.rescan(str(tmp_path / "music"), workers=1,
+                               should_stop=lambda: checks.append(1) or len(checks) > 1)
+
+        assert summary["removed"] == 0
+        assert index.count() == 3
+
+
+def test_superseded_query_is_interrupted(tmp_path):
+    import sqlite3
+
+    import pytest
+
+    from background import Task
+    import library_browser
+
+    db_path = str(tmp_path / "index.db")
+    with library_index.LibraryIndex(db_path) as index:
+        rows = []
+        for i in range(20000):
+            row = dict.fromkeys(library_index.COLUMNS)
+            row.update(path=f"/music/{i}.mp3", inode=i, size=1, mtime_ns=1, artist=f"Artist {i % 500}",
+                       title=f"Title {i}")
+            rows.append(row)
+        index.upsert(rows)
+    task = Task()
+    assert len(library_browser.query_ids(task, db_path, "title", "artist", False)[0]) == 20000
+    task.cancel()
+    with pytest.raises(sqlite3.OperationalError, match="interrupted"):
+        library_browser.query_ids(task, db_path, "title", "artist", False)
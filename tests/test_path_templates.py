@@ -0,0 +1,59 @@
+import os
+
+import pytest
+
+from path_templates import PathTemplate, plan_tags, plan_renames, apply_renames
+
+
+def test_match_many_fills_fields_from_directories_and_names():
+    template = PathTemplate("{artist}/{album}/{track} - {title}")
+    paths = ["/music/Miles Davis/Kind of Blue/01 - So What.mp3",
+             "/music/Miles Davis/Kind of Blue/02 - Freddie Freeloader.flac",
+             "/music/loose track.mp3"]
+
+    assert template.match_many(paths) == [
+        {"Artist": "Miles Davis", "Album": "Kind of Blue", "Song Name": "So What"},
+        {"Artist": "Miles Davis", "Album": "Kind of Blue", "Song Name": "Freddie Freeloader"},
+        None,
+    ]
+
+
+def test_plan_tags_keeps_only_changed_values():
+    template = PathTemplate("{artist}/{title}")
+    paths = ["/music/Someone/Song.mp3", "/music/Someone/Other.mp3", "/short.mp3"]
+    current = {paths[0]: {"Artist": "Someone", "Song Name": "Old"}, paths[1]: {"Artist": "Someone", "Song Name": "Other"}}
+
+    assert plan_tags(template, paths, current) == ([(paths[0], {"Song Name": "Song"})], 1)
+
+
+@pytest.mark.parametrize("template", ["", "{}", "no placeholders", "{artist"])
+def test_invalid_templates_are_refused(template):
+    with pytest.raises(ValueError):
+        PathTemplate(template)
+
+
+def test_format_replaces_unsafe_characters_and_empty_fields():
+    template = PathTemplate("{artist}/{album}/{title}")
+    assert template.format({"Artist": "AC/DC", "Song Name": "What?"}) == "AC_DC/Unknown/What_"
+
+
+def test_renames_never_overwrite(tmp_path):
+    template = PathTemplate("{artist}/{title}")
+    for name in ("a.mp3", "b.mp3", "taken.mp3"):
+        (tmp_path / name).write_bytes(b"")
+    (tmp_path / "Someone").mkdir()
+    (tmp_path / "Someone" / "Taken.mp3").write_bytes(b"")
+    current = {
+        str(tmp_path / "a.mp3"): {"Artist": "Someone", "Song Name": "Song"},
+        str(tmp_path / "b.mp3"): {"Artist": "Someone", "Song Name": "Song"},
+        str(tmp_path / "taken.mp3"): {"Artist": "Someone", "Song Name": "Taken"},
+    }
+
+    renames, conflicts = plan_renames(template, str(tmp_path), current)
+    assert renames == [(str(tmp_path / "a.mp3"), str(tmp_path / "Someone" / "Song.mp3"))]
+    assert [(os.path.basename(source), reason) for source, _target, reason in conflicts] == [
+        ("b.mp3", f"same name as {tmp_path / 'a.mp3'}"),
+        ("taken.mp3", "target exists"),
+    ]
+    assert apply_renames(renames, str(tmp_path)) == (1, [])
+    assert (tmp_path / "Someone" / "Song.mp3").exists()
@@ -0,0 +1,83 @@
+import os
+import time
+
+import pytest
+
+import service
+from benchmarks.corpus import make_file
+
+
+def wait_finished(job, timeout=60):
+    deadline = time.time() + timeout
+    while job.finished is None:
+        assert time.time() < deadline, "job didn't finish"
+        time.sleep(0.05)
+
+
+@pytest.mark.parametrize("data", [
+    {"type": "write", "items": [{"path": "a.mp3", "fields": {"artist": ["A", "B"]}}]},
+    {"type": "write", "items": [{"path": "a.mp3", "fields": {"artist": {"name": "A"}}}]},
+    {"type": "write", "items": [{"path": "a.mp3", "fields": ["artist"]}]},
+    {"type": "write", "items": [{"path": "a.mp3", "fields": {"mood": "calm"}}]},
+    {"type": "cover", "items": ["a.mp3"], "cover": ["front.jpg"]},
+    {"type": "cover", "items": ["a.mp3"], "cover": "front.jpg", "max_dimension": True},
+    {"type": "read", "items": [{"name": "a.mp3"}]},
+    {"type": "read", "items": []},
+])
+def test_invalid_jobs_are_rejected(data):
+    with pytest.raises(service.JobError) as raised:
+        service.parse_job(data)
+    assert raised.value.status == 400
+
+
+def test_scalar_fields_are_accepted():
+    job = service.parse_job({"type": "write", "items": [{"path": "a.mp3", "fields": {"year": 1999, "genre": None}}]})
+    assert job.items[0]["fields"] == {"Year": "1999", "Genre": ""}
+
+
+def test_cancelled_job_frees_its_place():
+    jobs = service.JobQueue(workers=1, threads=0, size=1)
+    try:
+        job = service.parse_job({"type": "read", "items": ["a.mp3"]})
+        jobs.submit(job)
+        with pytest.raises(service.JobError):
+            jobs.submit(service.parse_job({"type": "read", "items": ["b.mp3"]}))
+        assert jobs.cancel(job.id).status == "cancelled"
+        jobs.submit(service.parse_job({"type": "read", "items": ["b.mp3"]}))
+    finally:
+        jobs.close()
+
+
+def test_crashed_worker_only_fails_its_job(tmp_path):
+    path = make_file(str(tmp_path / "track.mp3"), "mp3", audio_size=4096)
+    jobs = service.JobQueue(workers=1, threads=1)
+    try:
+        # A worker that dies breaks the whole pool
+        jobs.executor.submit(os._exit, 1)
+        broken = service.parse_job({"type": "read", "items": [path]})
+        jobs.submit(broken)
+        wait_finished(broken)
+        after = service.parse_job({"type": "read", "items": [path]})
+        jobs.submit(after)
+        wait_finished(after)
+    finally:
+        jobs.close()
+    assert broken.status == "failed" and "BrokenProcessPool" in broken.error
+    assert after.status == "done" and after.results[0]["status"] == "read"
+
+
+def test_finished_jobs_are_dropped_past_the_result_limit(monkeypatch):
+    monkeypatch.setattr(service, "KEEP_RESULTS", 3)
+    jobs = service.JobQueue(workers=1, threads=0)
+    try:
+        finished = []
+        for index in range(3):
+            job = service.parse_job({"type": "read", "items": ["a.mp3"]})
+            job.results = [{}, {}]
+            job.finished = time.time() + index
+            jobs.jobs[job.id] = job
+            finished.append(job)
+        jobs.submit(service.parse_job({"type": "read", "items": ["a.mp3"]}))
+        assert [jobs.get(job.id) is not None for job in finished] == [False, False, True]
+    finally:
+        jobs.close()
@@ -0,0 +1,9 @@
+import subprocess
+import sys
+
+
+def test_command_line_modes_do_not_import_tkinter():
+    code = "import sys, main; main.main(['journal', '--dir', sys.argv[1], 'list']); print('tkinter' in sys.modules)"
+    output = subprocess.run([sys.executable, "-c", code, "/nonexistent-journal"], capture_output=True, text=True,
+                            check=True).stdout
+    assert output.strip().endswith("False")
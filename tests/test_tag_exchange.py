@@ -0,0 +1,46 @@
+import os
+
+import pytest
+
+import tag_exchange
+import tagcore
+from benchmarks.corpus import make_file
+
+
+def make_manifest(tmp_path, name, artist, count=3):
+    paths = [make_file(str(tmp_path / f"{name}{i}.mp3"), "mp3", audio_size=4096, index=i) for i in range(count)]
+    manifest = tmp_path / f"{name}.csv"
+    manifest.write_text("path,artist\n" + "".join(f"{path},{artist}\n" for path in paths))
+    return str(manifest), paths
+
+
+def test_interrupted_import_resumes_from_its_checkpoint(tmp_path):
+    manifest, paths = make_manifest(tmp_path, "a", "Imported")
+    checkpoint = str(tmp_path / "import.progress")
+
+    class Interrupted(Exception):
+        pass
+
+    def stop_after_first_batch(done, summary):
+        raise Interrupted
+
+    with pytest.raises(Interrupted):
+        tag_exchange.import_tags(manifest, workers=1, batch_size=2, checkpoint=checkpoint,
+                                 on_batch=stop_after_first_batch)
+    assert [tagcore.TagFile(path).fields["Artist"] for path in paths] == ["Imported", "Imported", "Artist 2"]
+
+    totals = tag_exchange.import_tags(manifest, workers=1, batch_size=2, checkpoint=checkpoint)
+
+    assert (totals["skipped"], totals["files"], totals["written"]) == (2, 1, 1)
+    assert tagcore.TagFile(paths[2]).fields["Artist"] == "Imported"
+    assert not os.path.exists(checkpoint)
+
+
+def test_checkpoint_of_another_manifest_is_refused(tmp_path):
+    first, _paths = make_manifest(tmp_path, "a", "First")
+    second, _paths = make_manifest(tmp_path, "b", "Second")
+    checkpoint = str(tmp_path / "import.progress")
+    tag_exchange._write_checkpoint(checkpoint, tag_exchange._manifest_identity(first), 3)
+
+    with pytest.raises(ValueError, match="another manifest"):
+        tag_exchange.import_tags(second, workers=1, checkpoint=checkpoint)
@@ -0,0 +1,59 @@
+import os
+import sys
+
+import pytest
+
+import watcher
+
+
+def test_debouncer_waits_for_quiet_and_keeps_the_latest_change():
+    debouncer = watcher.Debouncer(delay=1.0, max_delay=10.0)
+    debouncer.add([("a.mp3", "changed")], now=0.0)
+    debouncer.add([("a.mp3", "removed"), ("b.mp3", "changed")], now=0.5)
+
+    assert debouncer.take(now=1.0) == {}
+    assert debouncer.timeout(now=1.0) == 0.5
+    assert debouncer.take(now=1.5) == {"a.mp3": "removed", "b.mp3": "changed"}
+    assert debouncer.timeout() is None
+
+
+def test_debouncer_never_holds_changes_past_max_delay():
+    debouncer = watcher.Debouncer(delay=1.0, max_delay=3.0)
+    for now in (0.0, 0.9, 1.8, 2.7):
+        debouncer.add([(f"{now}.mp3", "changed")], now=now)
+    assert len(debouncer.take(now=3.0)) == 4
+
+
+def test_rescan_is_not_replaced_by_later_changes():
+    debouncer = watcher.Debouncer(delay=0.0)
+    debouncer.add([("/music", "rescan")], now=0.0)
+    debouncer.add([("/music", "removed_tree")], now=0.0)
+    assert debouncer.take(now=0.0) == {"/music": "rescan"}
+
+
+def read_changes(file_watcher):
+    changes = []
+    for _attempt in range(20):
+        changes.extend(file_watcher.read(0.1))
+        if changes:
+            break
+    return dict(changes)
+
+
+@pytest.mark.parametrize("poll_interval", [
+    pytest.param(None, marks=pytest.mark.skipif(not sys.platform.startswith("linux"), reason="inotify is Linux only")),
+    0.01,
+])
+def test_watcher_reports_audio_files_only(tmp_path, poll_interval):
+    (tmp_path / "album").mkdir()
+    existing = tmp_path / "album" / "existing.mp3"
+    existing.write_bytes(b"old")
+    file_watcher = watcher.open_watcher([str(tmp_path)], poll_interval=poll_interval)
+    try:
+        (tmp_path / "album" / "new.flac").write_bytes(b"new")
+        (tmp_path / "album" / "notes.txt").write_bytes(b"ignored")
+        assert read_changes(file_watcher) == {str(tmp_path / "album" / "new.flac"): "changed"}
+        os.remove(existing)
+        assert read_changes(file_watcher) == {str(existing): "removed"}
+    finally:
+        file_watcher.close()
@@ -0,0 +1,292 @@
+"""Notice audio files changing on disk.
+
+On Linux directories are watched with inotify (through ctypes, no extra
+dependency); elsewhere, or when inotify is unavailable, they are polled.
+Either way the watcher reports batches of changes after a burst of
+events has settled, so a tool writing a whole album triggers one
+update instead of hundreds.
+
+A batch maps paths to what happened to them:
+
+- "changed": an audio file was written, created or moved in
+- "removed": an audio file was deleted or moved away
+- "removed_tree": a directory was deleted or moved away
+- "rescan": events were lost (the kernel queue overflowed), the
+  directory should be scanned again in full
+"""
+import os
+import sys
+import time
+import errno
+import select
+import struct
+
+import tagcore
+from batch import iter_audio_files
+
+
+# Seconds without events before a batch is reported, and the longest a
+# change waits when events keep coming
+DEBOUNCE_DELAY = 1.0
+MAX_DELAY = 10.0
+
+POLL_INTERVAL = 2.0
+
+# From <sys/inotify.h>
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+
+# Files are reported once they are closed after writing rather than on
+# every write; IN_ATTRIB catches touch and metadata-only updates
+WATCH_MASK = (IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+              | IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR)
+
+_EVENT_HEADER = struct.Struct("iIII")
+
+
+class InotifyWatcher:
+    """Watches directories (and, when ``recursive``, everything below them) with inotify."""
+
+    def __init__(self, directories, recursive=True):
+        import ctypes
+        import ctypes.util
+        self._libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        self.fd = self._libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self.recursive = recursive
+        self.roots = [os.path.abspath(directory) for directory in directories]
+        self._paths = {}
+        self._watches = {}
+        for root in self.roots:
+            self._add_tree(root)
+
+    def _add(self, directory):
+        wd = self._libc.inotify_add_watch(self.fd, os.fsencode(directory), WATCH_MASK)
+        if wd < 0:
+            import ctypes
+            error = ctypes.get_errno()
+            if error == errno.ENOSPC:
+                print("Out of inotify watches, raise fs.inotify.max_user_watches", file=sys.stderr)
+            elif error not in (errno.ENOENT, errno.ENOTDIR):
+                print(f"Error watching {directory}: {os.strerror(error)}", file=sys.stderr)
+            return
+        self._paths[wd] = directory
+        self._watches[directory] = wd
+
+    def _add_tree(self, directory):
+        self._add(directory)
+        if not self.recursive:
+            return
+        stack = [directory]
+        while stack:
+            try:
+                with os.scandir(stack.pop()) as entries:
+                    for entry in entries:
+                        if entry.is_dir(follow_symlinks=False):
+                            self._add(entry.path)
+                            stack.append(entry.path)
+            except OSError:
+                pass
+
+    def _forget_tree(self, directory):
+        prefix = os.path.join(directory, "")
+        for path in [path for path in self._watches if path == directory or path.startswith(prefix)]:
+            wd = self._watches.pop(path)
+            self._paths.pop(wd, None)
+            self._libc.inotify_rm_watch(self.fd, wd)
+
+    def read(self, timeout):
+        """Wait up to ``timeout`` seconds and return the (path, change) pairs seen."""
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return []
+        changes = []
+        while True:
+            try:
+                data = os.read(self.fd, 64 * 1024)
+            except BlockingIOError:
+                break
+            offset = 0
+            while offset < len(data):
+                wd, mask, _cookie, length = _EVENT_HEADER.unpack_from(data, offset)
+                offset += _EVENT_HEADER.size
+                name = os.fsdecode(data[offset:offset + length].rstrip(b"\0"))
+                offset += length
+                self._handle(wd, mask, name, changes)
+        return changes
+
+    def _handle(self, wd, mask, name, changes):
+        if mask & IN_Q_OVERFLOW:
+            changes.extend((root, "rescan") for root in self.roots)
+            return
+        directory = self._paths.get(wd)
+        if directory is None:
+            return
+        if mask & IN_IGNORED:
+            # The watch is gone (directory deleted or unmounted)
+            self._paths.pop(wd, None)
+            self._watches.pop(directory, None)
+            return
+        if mask & (IN_DELETE_SELF | IN_MOVE_SELF):
+            if directory in self.roots:
+                changes.append((directory, "removed_tree"))
+            return
+        path = os.path.join(directory, name)
+        if mask & IN_ISDIR:
+            if not self.recursive:
+                return
+            if mask & (IN_CREATE | IN_MOVED_TO):
+                # Files may have landed before the watch was added, report them all
+                self._add_tree(path)
+                changes.extend((file_path, "changed") for file_path in iter_audio_files(path))
+            elif mask & (IN_DELETE | IN_MOVED_FROM):
+                self._forget_tree(path)
+                changes.append((path, "removed_tree"))
+            return
+        if not tagcore.is_audio_file(name):
+            return
+        if mask & (IN_DELETE | IN_MOVED_FROM):
+            changes.append((path, "removed"))
+        elif mask & (IN_CLOSE_WRITE | IN_MOVED_TO | IN_ATTRIB):
+            changes.append((path, "changed"))
+
+    def close(self):
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1
+
+
+class PollingWatcher:
+    """Finds changes by comparing (inode, size, mtime) of every audio file between polls."""
+
+    def __init__(self, directories, recursive=True, interval=POLL_INTERVAL):
+        self.roots = [os.path.abspath(directory) for directory in directories]
+        self.recursive = recursive
+        self.interval = interval
+        self._next_poll = time.monotonic() + interval
+        self._snapshot = self._scan()
+
+    def _files(self, root):
+        if self.recursive:
+            return iter_audio_files(root)
+        try:
+            with os.scandir(root) as entries:
+                return [entry.path for entry in entries
+                        if entry.is_file() and tagcore.is_audio_file(entry.name)]
+        except OSError:
+            return []
+
+    def _scan(self):
+        snapshot = {}
+        for root in self.roots:
+            for path in self._files(root):
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                snapshot[path] = (stat.st_ino, stat.st_size, stat.st_mtime_ns)
+        return snapshot
+
+    def read(self, timeout):
+        wait = self._next_poll - time.monotonic()
+        if wait > timeout:
+            time.sleep(timeout)
+            return []
+        if wait > 0:
+            time.sleep(wait)
+        self._next_poll = time.monotonic() + self.interval
+        previous, self._snapshot = self._snapshot, self._scan()
+        changes = [(path, "changed") for path, signature in self._snapshot.items()
+                   if previous.get(path) != signature]
+        changes.extend((path, "removed") for path in previous if path not in self._snapshot)
+        return changes
+
+    def close(self):
+        pass
+
+
+def open_watcher(directories, recursive=True, poll_interval=None):
+    """Return an inotify watcher where possible, a polling one otherwise.
+
+    Passing ``poll_interval`` forces polling, e.g. for network shares
+    where inotify doesn't see changes made by other machines.
+    """
+    if poll_interval is None and sys.platform.startswith("linux"):
+        try:
+            return InotifyWatcher(directories, recursive)
+        except (OSError, AttributeError) as e:
+            print(f"inotify unavailable ({e}), polling for changes instead", file=sys.stderr)
+    return PollingWatcher(directories, recursive, poll_interval or POLL_INTERVAL)
+
+
+class Debouncer:
+    """Collects changes until ``delay`` seconds pass without new ones.
+
+    The latest change to a path wins, so a file written and then deleted
+    in the same burst is only reported as removed.  Changes are never
+    held back longer than ``max_delay`` even if events keep coming.
+    """
+
+    def __init__(self, delay=DEBOUNCE_DELAY, max_delay=MAX_DELAY):
+        self.delay = delay
+        self.max_delay = max_delay
+        self.pending = {}
+        self._first = None
+        self._last = None
+
+    def add(self, changes, now=None):
+        if not changes:
+            return
+        now = time.monotonic() if now is None else now
+        for path, change in changes:
+            if self.pending.get(path) == "rescan":
+                continue
+            self.pending[path] = change
+        if self._first is None:
+            self._first = now
+        self._last = now
+
+    def timeout(self, now=None):
+        """Seconds until the pending batch is due, or None when nothing is pending."""
+        if not self.pending:
+            return None
+        now = time.monotonic() if now is None else now
+        return max(0.0, min(self._last + self.delay, self._first + self.max_delay) - now)
+
+    def take(self, now=None):
+        """Return the pending batch if it's due, otherwise an empty dict."""
+        if not self.pending or self.timeout(now) > 0:
+            return {}
+        batch, self.pending = self.pending, {}
+        self._first = self._last = None
+        return batch
+
+
+def watch(directories, on_batch, recursive=True, delay=DEBOUNCE_DELAY, max_delay=MAX_DELAY,
+          poll_interval=None, should_stop=None, idle_timeout=0.5):
+    """Call ``on_batch(changes)`` with every settled batch of changes until ``should_stop()``.
+
+    ``should_stop`` is checked at least every ``idle_timeout`` seconds.
+    """
+    watcher = open_watcher(directories, recursive, poll_interval)
+    debouncer = Debouncer(delay, max_delay)
+    try:
+        while not (should_stop and should_stop()):
+            timeout = debouncer.timeout()
+            debouncer.add(watcher.read(idle_timeout if timeout is None else min(timeout, idle_timeout)))
+            batch = debouncer.take()
+            if batch:
+                on_batch(batch)
+    finally:
+        watcher.close()